@@ -1,11 +1,17 @@
+from bisect import bisect_right
+from collections import defaultdict
 from datetime import datetime, date, timedelta
+from hashlib import md5
+from time import time_ns
+from django.core.cache import cache
 from django.utils.formats import date_format
 from decimal import Decimal, ROUND_HALF_UP
 from django.utils.html import format_html
 from django.conf import settings
-from django.db.models import Sum
+from django.db.models import Q, Sum
 
 from planner.models import ActOfAcceptance, Deal, Payment, Task, Customer, Employee, Execution
+from analytics.models import FinanceFact, ProductivityFact
 
 
 def last_day_of_month(any_day):
@@ -15,6 +21,48 @@ def last_day_of_month(any_day):
     return next_month - timedelta(days=next_month.day)
 
 
+# Data domains which contexts depend on. Versions of domains are changed on writes of their models
+FINANCE = 'finance'
+PRODUCTIVITY = 'productivity'
+CONTEXT_DOMAINS = {
+    'employee_productivity_context': [PRODUCTIVITY],
+    'manager_productivity_context': [PRODUCTIVITY],
+    'income_structure_context': [FINANCE, PRODUCTIVITY],
+}
+
+# Contexts which depend on current date whatever period they cover
+DATE_CONTEXTS = ['payment_queue_context', 'overdue_payment_context', 'overdue_execution_context']
+
+# Seconds to keep contexts of current year and contexts of DATE_CONTEXTS, they are also rebuilt every day.
+# Contexts of past years are kept until data version is changed
+CONTEXT_CACHE_TIMEOUT = 60 * 60
+
+
+def data_version(domain):
+    """ return version of data domain shared between processes through cache """
+    return cache.get_or_set(f'data_version_{domain}', time_ns, None)
+
+
+def invalidate_data(*domains):
+    """ change versions of data domains so cached contexts are rebuilt """
+    cache.set_many({f'data_version_{domain}': time_ns() for domain in domains}, None)
+
+
+def cached_context(name, key, year, render):
+    """ return context from cache or render and cache it. Key is tuple of context arguments,
+    year is the last year covered by context """
+    today = date.today()
+    past = bool(year) and int(year) < today.year and name not in DATE_CONTEXTS
+    versions = [data_version(domain) for domain in CONTEXT_DOMAINS.get(name, [FINANCE])]
+    key = (key, versions) if past else (key, today, versions)
+    cache_key = f'context_{name}_' + md5(repr(key).encode()).hexdigest()
+    context = cache.get(cache_key)
+    if context is None:
+        context = render()
+        cache.set(cache_key, context, None if past else CONTEXT_CACHE_TIMEOUT)
+    return context
+
+
 def receivables_context(company, customer, from_date, to_date):
 
     # get deals
@@ -86,8 +134,8 @@ def waiting_for_act_context(company, customer, from_date, to_date):
     deal_list = []
     for deal in deals:
         index += 1
-        acts_total = deal.acts_total()
-        paid_total = deal.paid_total()
+        acts_total = deal.acts_total
+        paid_total = deal.paid_total
         if acts_total > paid_total:
             svalue += acts_total - paid_total
 
@@ -136,8 +184,8 @@ def payment_queue_context(company, customer, from_date, to_date):
     deal_list = []
     for deal in deals:
         index += 1
-        acts_total = deal.acts_total()
-        paid_total = deal.paid_total()
+        acts_total = deal.acts_total
+        paid_total = deal.paid_total
         if acts_total > paid_total:
             svalue += acts_total - paid_total
 
@@ -186,8 +234,8 @@ def overdue_payment_context(company, customer, from_date, to_date):
     deal_list = []
     for deal in deals:
         index += 1
-        acts_total = deal.acts_total()
-        paid_total = deal.paid_total()
+        acts_total = deal.acts_total
+        paid_total = deal.paid_total
         if acts_total > paid_total:
             svalue += acts_total - paid_total
 
@@ -236,8 +284,8 @@ def overdue_execution_context(company, customer, from_date, to_date):
     deal_list = []
     for deal in deals:
         index += 1
-        acts_total = deal.acts_total()
-        paid_total = deal.paid_total()
+        acts_total = deal.acts_total
+        paid_total = deal.paid_total
         if acts_total > paid_total:
             svalue += acts_total - paid_total
 
@@ -265,7 +313,10 @@ def overdue_execution_context(company, customer, from_date, to_date):
 def context_report_render(report, customer, company=None, from_date=None, to_date=None):
     """ return context defined in report.context """
 
-    return globals()[report.context](company, customer, from_date, to_date)
+    return cached_context(report.context,
+                          (getattr(company, 'pk', None), getattr(customer, 'pk', None), from_date, to_date),
+                          to_date.year if to_date else None,
+                          lambda: globals()[report.context](company, customer, from_date, to_date))
 
 
 def act_list_context(company, customer, from_date, to_date):
@@ -412,11 +463,89 @@ def customer_report_context(company, customer, from_date, to_date):
 def context_chart_render(chart, year, customers=None):
     """ return context defined in chart.context """
 
-    return globals()[chart.context](year, customers)
+    return cached_context(chart.context,
+                          (str(year), sorted(obj.pk for obj in customers) if customers is not None else None),
+                          year,
+                          lambda: globals()[chart.context](year, customers))
 
 def range_for_year(year):
     return date.today().month+1 if int(year) == date.today().year else 13
 
+def running_sums(queryset, since, until):
+    """ return function(customer_id, day) with sum of queryset values dated after since and on or before day """
+    dates = defaultdict(list)
+    totals = defaultdict(list)
+    rows = queryset.filter(date__gt=since, date__lte=until) \
+                   .order_by().values('deal__customer', 'date') \
+                   .annotate(total=Sum('value')) \
+                   .values_list('deal__customer', 'date', 'total') \
+                   .order_by('deal__customer', 'date')
+    for customer, day, total in rows:
+        dates[customer].append(day)
+        totals[customer].append(total + (totals[customer][-1] if totals[customer] else 0))
+
+    def total_on(customer, day):
+        index = bisect_right(dates[customer], day)
+        return totals[customer][index - 1] if index else 0
+    return total_on
+
+
+def customers_fin_analysis(year, customers):
+    """ return dict {customer_id: {series: list of month values}} for fin analysis charts """
+    months = range(1, range_for_year(year))
+    periods = {month: last_day_of_month(date(year=int(year), month=month, day=1)) for month in months}
+    postpaids = {}
+    for customer in customers:
+        for month in months:
+            # postpaid date of current month is counted from today, of other months from the end of month
+            if int(year) == date.today().year and month == date.today().month:
+                postpaids[(customer.pk, month)] = date.today() - timedelta(days=customer.debtor_term or 0)
+            else:
+                postpaids[(customer.pk, month)] = periods[month] - timedelta(days=customer.debtor_term or 0)
+
+    # monthly figures and receivables at the end of months summed by companies
+    figures = defaultdict(Decimal)
+    balances = defaultdict(dict)
+    receivables = {}
+    facts = list(FinanceFact.objects.filter(customer__in=customers, month__lte=periods[months[-1]]))
+    index = 0
+    for month in months:
+        while index < len(facts) and facts[index].month <= periods[month]:
+            fact = facts[index]
+            index += 1
+            balances[fact.customer_id][fact.company_id] = fact.receivables
+            if fact.month.year == int(year):
+                for figure in ('acts', 'payments', 'work_done'):
+                    figures[(fact.customer_id, figure, fact.month.month)] += getattr(fact, figure)
+        for customer in customers:
+            receivables[(customer.pk, month)] = sum(balances[customer.pk].values())
+
+    # overdue receivables exclude acts issued after postpaid date
+    since = min(postpaids.values(), default=date.today())
+    until = max(periods[months[-1]], date.today())
+    acts_receivables = running_sums(ActOfAcceptance.objects.filter(deal__customer__in=customers).in_receivables(),
+                                    since, until)
+
+    analysis = {}
+    for customer in customers:
+        series = defaultdict(list)
+        for month in months:
+            acts_for_month = figures[(customer.pk, 'acts', month)]
+            work_done_for_month = figures[(customer.pk, 'work_done', month)]
+            receivables_for_period = receivables[(customer.pk, month)]
+            not_overdue = acts_receivables(customer.pk, periods[month]) - \
+                acts_receivables(customer.pk, postpaids[(customer.pk, month)])
+
+            series['acts_income'].append(float(acts_for_month))
+            series['payments_income'].append(float(figures[(customer.pk, 'payments', month)]))
+            series['work_done'].append(float(work_done_for_month))
+            series['receivables'].append(float(receivables_for_period))
+            series['overdue_receivables'].append(float(receivables_for_period - not_overdue))
+            series['stock'].append(float(work_done_for_month - acts_for_month))
+        analysis[customer.pk] = series
+    return analysis
+
+
 def fin_analysis_context(year, customers):
 
     # prepare chart data
@@ -433,62 +562,26 @@ def fin_analysis_context(year, customers):
     for month in range(1, range_for_year(year)):
         xAxis.append(date_format(date.today().replace(day=1, month=month), 'M'))
 
+    analysis = customers_fin_analysis(year, customers)
     for customer in customers:
-        acts_income_list = []
-        payments_income_list = []
-        work_done_list = []
-        receivables_list = []
-        overdue_receivables_list = []
-        stock_list = []
-
-        for month in range(1, range_for_year(year)):
-            period = last_day_of_month(datetime(year=int(year), month=month, day=1))
-            if month == date.today().month:
-                postpaid = date.today() - timedelta(days=customer.debtor_term)
-            else:
-                postpaid = period - timedelta(days=customer.debtor_term)
-
-            acts_customer = ActOfAcceptance.objects.filter(deal__customer=customer)
-            payments_customer = Payment.objects.filter(deal__customer=customer)
-            acts_income = acts_customer.filter(date__year=year,
-                                               date__month=month) \
-                                       .aggregate(Sum('value'))['value__sum'] or 0
-            acts_income_list.append(float(acts_income))
-            payments_income = payments_customer.filter(date__year=year,
-                                                       date__month=month) \
-                                               .aggregate(Sum('value'))['value__sum'] or 0
-            payments_income_list.append(float(payments_income))
-            work_done_income = Task.objects.filter(deal__customer=customer,
-                                                   actual_finish__year=year,
-                                                   actual_finish__month=month) \
-                                            .aggregate(Sum('project_type__price'))['project_type__price__sum'] or 0
-            work_done_list.append(float(work_done_income))
-            acts_for_period = acts_customer.receivables().filter(date__lte=period) \
-                                                         .aggregate(Sum('value'))['value__sum'] or 0
-            overdue_acts_for_period = acts_customer.receivables().filter(date__lte=postpaid) \
-                                                         .aggregate(Sum('value'))['value__sum'] or 0
-            payments_for_period = payments_customer.receivables().filter(date__lte=period) \
-                                                                 .aggregate(Sum('value'))['value__sum'] or 0
-            receivables_list.append(float(acts_for_period - payments_for_period))
-            overdue_receivables_list.append(float(overdue_acts_for_period - payments_for_period))
-            stock_list.append(float(work_done_income-acts_income))
+        series = analysis[customer.pk]
 
         acts_data.append({"name": customer.name,
-                          "data": acts_income_list})
+                          "data": series['acts_income']})
         payments_data.append({"name": customer.name,
-                              "data": payments_income_list})
+                              "data": series['payments_income']})
         work_done_data.append({"name": customer.name,
-                               "data": work_done_list})
+                               "data": series['work_done']})
         receivables_data.append({"name": customer.name,
-                                 "data": receivables_list})
+                                 "data": series['receivables']})
         overdue_receivables_data.append({"name": customer.name,
-                                 "data": overdue_receivables_list})
+                                 "data": series['overdue_receivables']})
         stock_data.append({"name": customer.name,
-                           "data": stock_list})
+                           "data": series['stock']})
         turnover_closed_data.append({"name": customer.name,
-                                     "y": sum(acts_income_list)})
+                                     "y": sum(series['acts_income'])})
         turnover_data.append({"name": customer.name,
-                              "y": sum(work_done_list)})
+                              "y": sum(series['work_done'])})
 
     # creating context
     context = {
@@ -516,46 +609,15 @@ def customer_fin_analysis_context(year, customers):
     for month in range(1, range_for_year(year)):
         xAxis.append(date_format(date.today().replace(day=1, month=month), 'M'))
 
-    acts_income_list = []
-    payments_income_list = []
-    work_done_list = []
-    receivables_list = []
-    stock_list = []
+    analysis = defaultdict(list)
+    if customer:
+        analysis = customers_fin_analysis(year, [customer])[customer.pk]
 
-    for month in range(1, range_for_year(year)):
-        period = last_day_of_month(datetime(year=int(year), month=month, day=1))
-
-        acts_customer = ActOfAcceptance.objects.filter(deal__customer=customer)
-        payments_customer = Payment.objects.filter(deal__customer=customer)
-
-        acts_income = acts_customer.filter(date__year=year,
-                                            date__month=month) \
-                                   .aggregate(Sum('value'))['value__sum'] or 0
-        acts_income_list.append(float(acts_income))
-
-        payments_income = payments_customer.filter(date__year=year,
-                                                    date__month=month) \
-                                           .aggregate(Sum('value'))['value__sum'] or 0
-        payments_income_list.append(float(payments_income))
-
-        work_done_income = Task.objects.filter(deal__customer=customer,
-                                                actual_finish__year=year,
-                                                actual_finish__month=month) \
-                                       .aggregate(Sum('project_type__price'))['project_type__price__sum'] or 0
-        work_done_list.append(float(work_done_income))
-
-        acts_for_period = acts_customer.receivables().filter(date__lte=period) \
-                                                     .aggregate(Sum('value'))['value__sum'] or 0
-        payments_for_period = payments_customer.receivables().filter(date__lte=period) \
-                                                             .aggregate(Sum('value'))['value__sum'] or 0
-        receivables_list.append(float(acts_for_period - payments_for_period))
-        stock_list.append(float(work_done_income-acts_income))
-
-    series.append({"name": "Дохід по актам", "data": acts_income_list})
-    series.append({"name": "Оплачено", "data": payments_income_list})
-    series.append({"name": "Виконано робіт", "data": work_done_list})
-    series.append({"name": "Дебіторська заборгованість", "data": receivables_list})
-    series.append({"name": "Рівень запасів", "data": stock_list})
+    series.append({"name": "Дохід по актам", "data": analysis['acts_income']})
+    series.append({"name": "Оплачено", "data": analysis['payments_income']})
+    series.append({"name": "Виконано робіт", "data": analysis['work_done']})
+    series.append({"name": "Дебіторська заборгованість", "data": analysis['receivables']})
+    series.append({"name": "Рівень запасів", "data": analysis['stock']})
 
     # creating context
     context = {
@@ -583,34 +645,34 @@ def income_structure_context(year, customers):
         customer_ids = list(set(ActOfAcceptance.objects.filter(date__year=year).values_list('deal__customer', flat=True)))
         customers = Customer.objects.filter(pk__in=customer_ids)
 
+    totals = FinanceFact.objects.filter(customer__in=customers, month__year__lte=year) \
+                                .order_by().values('customer') \
+                                .annotate(acts_income=Sum('acts', filter=Q(month__year=year)),
+                                          payments_income=Sum('payments', filter=Q(month__year=year)),
+                                          work_done_income=Sum('work_done', filter=Q(month__year=year)),
+                                          acts_sum=Sum('acts'),
+                                          payments_sum=Sum('payments'))
+    totals = {total['customer']: total for total in totals}
+
     for customer in customers:
-        acts_customer = ActOfAcceptance.objects.filter(deal__customer=customer)
-        payments_customer = Payment.objects.filter(deal__customer=customer)
+        total = totals.get(customer.pk, {})
 
-        acts_income = acts_customer.filter(date__year=year) \
-                                   .aggregate(Sum('value'))['value__sum'] or 0
+        acts_income = total.get('acts_income') or 0
         if acts_income > 0:
             acts_data.append({"name": customer.name,
                               "y": float(acts_income)})
 
-        work_done_income = Task.objects.filter(deal__customer=customer,
-                                               actual_finish__year=year) \
-                                       .aggregate(Sum('project_type__price'))['project_type__price__sum'] or 0
+        work_done_income = total.get('work_done_income') or 0
         if work_done_income > 0:
             work_done_data.append({"name": customer.name,
                                    "y": float(work_done_income)})
 
-        payments_income = payments_customer.filter(date__year=year) \
-                                   .aggregate(Sum('value'))['value__sum'] or 0
+        payments_income = total.get('payments_income') or 0
         if payments_income > 0:
             payments_data.append({"name": customer.name,
                                   "y": float(payments_income)})
 
-        acts_sum = acts_customer.filter(date__year__lte=year) \
-                                .aggregate(Sum('value'))['value__sum'] or 0
-        payments_sum = payments_customer.filter(date__year__lte=year) \
-                                        .aggregate(Sum('value'))['value__sum'] or 0
-        receivables = acts_sum - payments_sum
+        receivables = (total.get('acts_sum') or 0) - (total.get('payments_sum') or 0)
         if receivables > 0:
             receivables_data.append({"name": customer.name,
                                      "y": float(receivables)})
@@ -643,6 +705,9 @@ def employee_productivity_context(year, employees):
     for month in range(1, range_for_year(year)):
         xAxis.append(date_format(date.today().replace(day=1, month=month), 'M'))
 
+    facts = {(fact.employee_id, fact.month.month): fact
+             for fact in ProductivityFact.objects.filter(employee__in=employees, month__year=year)}
+
     for employee in employees:
         work_done_list = []
         work_salary_list = []
@@ -650,33 +715,15 @@ def employee_productivity_context(year, employees):
         work_duration_list = []
 
         for month in range(1, range_for_year(year)):
-            income = 0
-            income_owner = 0
-            period = last_day_of_month(datetime(year=int(year), month=month, day=1))
-
-            # calculate executor bonuses
-            executions = employee.executions_for_period(period)
-            for query in executions:
-                income += query.task.money_earned(query.part)
-
-            # calculate inttask bonuses
-            income += employee.inttask_set.filter(actual_finish__month=period.month,
-                                                   actual_finish__year=period.year)\
-                                           .aggregate(Sum('bonus'))['bonus__sum'] or 0
-
-            # calculate owner bonuses
-            tasks = employee.tasks_for_period(period)
-            for query in tasks:
-                income_owner += query.money_earned()
-
-            #calculate duration
-            duration = executions.filter(subtask__simultaneous_execution=False) \
-                                 .aggregate(Sum('actual_duration'))['actual_duration__sum'] or timedelta()
-            duration_hr = duration.total_seconds() / 3600
+            fact = facts.get((employee.pk, month), ProductivityFact())
+
+            # executor and inttask bonuses
+            income = fact.executed_income + fact.inttasks_income
+            duration_hr = fact.duration.total_seconds() / 3600
 
             work_done_list.append(int(income))
             work_salary_list.append(int(income/employee.salary*10))
-            work_owner_list.append(int(income_owner))
+            work_owner_list.append(int(fact.owner_income))
             work_duration_list.append(round(duration_hr, 2))
 
         work_done_data.append({"name": employee.name, "data": work_done_list})
@@ -708,28 +755,21 @@ def manager_productivity_context(year, pms):
     for month in range(1, range_for_year(year)):
         xAxis.append(date_format(date.today().replace(day=1, month=month), 'M'))
 
+    facts = {(fact.employee_id, fact.month.month): fact
+             for fact in ProductivityFact.objects.filter(employee__in=pms, month__year=year)}
+
     for pm in pms:
         income_list = []
         costs_list = []
         earnings_list = []
 
         for month in range(1, range_for_year(year)):
-            period = datetime(year=int(year), month=month, day=1)
-            income = 0
-            costs = 0
-            earnings = 0
+            fact = facts.get((pm.pk, month), ProductivityFact())
 
             # calculate work efficiency
-            tasks = pm.tasks_for_period(period)
-            for task in tasks:
-                task_income = task.money_earned()
-                income += task_income
-                task_costs = task.costs_with_salary()
-                costs += task_costs
-                earnings += task_income - task_costs
-            income_list.append(round(float(income), 2))
-            costs_list.append(round(float(costs + pm.salary), 2))
-            earnings_list.append(round(float(earnings), 2))
+            income_list.append(round(float(fact.owner_income), 2))
+            costs_list.append(round(float(fact.owner_costs + pm.salary), 2))
+            earnings_list.append(round(float(fact.owner_income - fact.owner_costs), 2))
 
         income_data.append({"name": pm.name, "data": income_list})
         costs_data.append({"name": pm.name, "data": costs_list})
@@ -0,0 +1,97 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime
+from dateutil.rrule import rrule, MONTHLY
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from analytics.tasks import recalc_kpi
+
+
+def month(value):
+    """ parse YYYY-MM argument to date of the first day of month """
+    return datetime.strptime(value, '%Y-%m').date()
+
+
+def recalc_month(period):
+    """ recalculate KPIs of month in worker process """
+    recalc_kpi(period=period)
+    return period
+
+
+class Command(BaseCommand):
+    help = 'Recalculate KPIs of every month in range. Finished months are kept in state file ' \
+           'so interrupted backfill resumes where it stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='start', type=month, required=True, help='First month, YYYY-MM')
+        parser.add_argument('--to', dest='end', type=month, required=True, help='Last month, YYYY-MM')
+        parser.add_argument('--workers', type=int, default=1, help='Number of worker processes')
+        parser.add_argument('--state', default='backfill_kpi.state', help='File with backfilled range and finished months')
+        parser.add_argument('--restart', action='store_true', help='Discard state file and start backfill anew')
+
+    def handle(self, *args, **options):
+        if options['start'] > options['end']:
+            raise CommandError('--from month is after --to month')
+        if options['workers'] < 1:
+            raise CommandError('--workers must be positive')
+
+        # first line of state file is the backfilled range, next ones are finished months
+        state = options['state']
+        months_range = '%s %s' % (options['start'].strftime('%Y-%m'), options['end'].strftime('%Y-%m'))
+        done = set()
+        if options['restart'] and os.path.exists(state):
+            os.remove(state)
+        if os.path.exists(state):
+            with open(state) as state_file:
+                state_range = state_file.readline().strip()
+                done = {line.strip() for line in state_file if line.strip()}
+            if state_range != months_range:
+                raise CommandError('State file %s is for months %s, not %s. Use --restart to start new backfill'
+                                   % (state, state_range.replace(' ', ' - '), months_range.replace(' ', ' - ')))
+        else:
+            with open(state, 'w') as state_file:
+                state_file.write(months_range + '\n')
+
+        periods = [period.date() for period in rrule(MONTHLY, dtstart=options['start'], until=options['end'])
+                   if period.strftime('%Y-%m') not in done]
+        total = len(periods)
+        if done:
+            self.stdout.write('Resuming, %s months already done' % len(done))
+
+        failed = []
+        with open(state, 'a') as state_file:
+            for count, (period, error) in enumerate(self.run(periods, options['workers']), 1):
+                if error:
+                    failed.append(period)
+                    self.stderr.write('[%s/%s] %s failed: %s' % (count, total, period.strftime('%Y-%m'), error))
+                    continue
+                state_file.write(period.strftime('%Y-%m') + '\n')
+                state_file.flush()
+                self.stdout.write('[%s/%s] %s done' % (count, total, period.strftime('%Y-%m')))
+
+        if failed:
+            raise CommandError('KPIs are not calculated for %s. Run command again to retry them'
+                               % ', '.join(period.strftime('%Y-%m') for period in sorted(failed)))
+        os.remove(state)
+        self.stdout.write(self.style.SUCCESS('KPIs recalculated for %s months' % total))
+
+    @staticmethod
+    def run(periods, workers):
+        """ yield (period, error) as months are recalculated """
+        if workers == 1:
+            for period in periods:
+                try:
+                    recalc_month(period)
+                except Exception as error:
+                    yield period, error
+                else:
+                    yield period, None
+            return
+
+        # forked workers must open their own database connections
+        connections.close_all()
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(recalc_month, period): period for period in periods}
+            for future in as_completed(futures):
+                yield futures[future], future.exception()
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from analytics.tasks import update_finance_facts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild monthly finance facts of customers and companies from acts, payments and tasks'
+
+    def handle(self, *args, **options):
+        created, updated, deleted = update_finance_facts()
+        self.stdout.write(self.style.SUCCESS('Finance facts rebuilt: %s created, %s updated, %s deleted'
+                                             % (created, updated, deleted)))
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from analytics.tasks import update_productivity_facts
+
+
+class Command(BaseCommand):
+    help = 'Rebuild monthly productivity facts of employees from executions, inttasks and tasks'
+
+    def handle(self, *args, **options):
+        created, updated, deleted = update_productivity_facts()
+        self.stdout.write(self.style.SUCCESS('Productivity facts rebuilt: %s created, %s updated, %s deleted'
+                                             % (created, updated, deleted)))
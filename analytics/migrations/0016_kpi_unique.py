@@ -0,0 +1,29 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def delete_duplicates(apps, schema_editor):
+    """ keep the latest of duplicated KPIs """
+    Kpi = apps.get_model('analytics', 'Kpi')
+    duplicates = Kpi.objects.order_by().values('employee', 'name', 'period') \
+                            .annotate(last_id=Max('pk'), count=Count('pk')).filter(count__gt=1) \
+                            .values_list('employee', 'name', 'period', 'last_id')
+    for employee, name, period, last_id in duplicates:
+        Kpi.objects.filter(employee=employee, name=name, period=period).exclude(pk=last_id).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('analytics', '0015_alter_chart_context'),
+    ]
+
+    operations = [
+        migrations.RunPython(delete_duplicates, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='kpi',
+            unique_together={('employee', 'name', 'period')},
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+
+def month_sums(queryset, date_field, value_field):
+    """ return dict {(customer_id, company_id, month): sum} of queryset values grouped by TruncMonth """
+    rows = queryset.filter(**{date_field + '__isnull': False}) \
+                   .annotate(month=TruncMonth(date_field)) \
+                   .order_by().values('deal__customer', 'deal__company', 'month') \
+                   .annotate(total=Sum(value_field)) \
+                   .values_list('deal__customer', 'deal__company', 'month', 'total')
+    return {(customer, company, month): total or 0 for customer, company, month, total in rows}
+
+
+def fill_finance_facts(apps, schema_editor):
+    """ Calculate finance facts of existing acts, payments and finished tasks """
+    ActOfAcceptance = apps.get_model('planner', 'ActOfAcceptance')
+    Payment = apps.get_model('planner', 'Payment')
+    Task = apps.get_model('planner', 'Task')
+    FinanceFact = apps.get_model('analytics', 'FinanceFact')
+
+    acts = ActOfAcceptance.objects.all()
+    payments = Payment.objects.filter(deal__isnull=False)
+    sums = {'acts': month_sums(acts, 'date', 'value'),
+            'payments': month_sums(payments, 'date', 'value'),
+            'work_done': month_sums(Task.objects.all(), 'actual_finish', 'project_type__price')}
+
+    # receivables change by months, the same filters as ActQuerySet and PaymentQuerySet in_receivables()
+    receivables = defaultdict(Decimal)
+    for key, value in month_sums(acts.exclude(deal__act_status='NI').exclude(deal__pay_status='AP'),
+                                 'date', 'value').items():
+        receivables[key] += value
+    for key, value in month_sums(payments.exclude(deal__pay_status__in=['NP', 'AP']), 'date', 'value').items():
+        receivables[key] -= value
+
+    facts = []
+    balances = defaultdict(Decimal)
+    for key in sorted(set().union(receivables, *sums.values())):
+        customer, company, month = key
+        balances[(customer, company)] += receivables.get(key, 0)
+        facts.append(FinanceFact(customer_id=customer, company_id=company, month=month,
+                                 receivables=balances[(customer, company)],
+                                 **{figure: values.get(key, 0) for figure, values in sums.items()}))
+    FinanceFact.objects.bulk_create(facts, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0102_deal_rollups'),
+        ('analytics', '0016_kpi_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FinanceFact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Місяць')),
+                ('acts', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Виписано актів, грн.')),
+                ('payments', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Оплачено, грн.')),
+                ('work_done', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Виконано робіт, грн.')),
+                ('receivables', models.DecimalField(decimal_places=2, default=0, max_digits=12, verbose_name='Дебіторська заборгованість на кінець місяця, грн.')),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='planner.company', verbose_name='Компанія')),
+                ('customer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='planner.customer', verbose_name='Замовник')),
+            ],
+            options={
+                'verbose_name': 'Фінансовий показник',
+                'verbose_name_plural': 'Фінансові показники',
+                'ordering': ['month'],
+                'unique_together': {('customer', 'company', 'month')},
+            },
+        ),
+        migrations.RunPython(fill_finance_facts, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,105 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+import datetime
+from collections import defaultdict
+from decimal import Decimal
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+from django.db.models.functions import TruncMonth
+
+
+def month_start(day):
+    """ first day of month of date or datetime """
+    if isinstance(day, datetime.datetime):
+        day = day.date()
+    return day.replace(day=1)
+
+
+def fill_productivity_facts(apps, schema_editor):
+    """ Calculate productivity facts of existing executions, inttasks and sent tasks """
+    Execution = apps.get_model('planner', 'Execution')
+    IntTask = apps.get_model('planner', 'IntTask')
+    Task = apps.get_model('planner', 'Task')
+    Order = apps.get_model('planner', 'Order')
+    ProductivityFact = apps.get_model('analytics', 'ProductivityFact')
+
+    facts = defaultdict(lambda: {'executed_income': Decimal(0), 'inttasks_income': Decimal(0),
+                                 'owner_income': Decimal(0), 'owner_costs': Decimal(0),
+                                 'duration': datetime.timedelta()})
+
+    # executors income and duration of checked and done executions
+    executions = Execution.objects.filter(exec_status__in=['OC', 'CR', 'HD'], executor__isnull=False,
+                                          actual_finish__isnull=False)
+    for executor, finish, part, price, net_price_rate, duration, simultaneous in executions.values_list(
+            'executor', 'actual_finish', 'part', 'task__project_type__price', 'task__project_type__net_price_rate',
+            'actual_duration', 'subtask__simultaneous_execution'):
+        fact = facts[(executor, month_start(finish))]
+        net_price = round(price * net_price_rate / 100, 2)
+        fact['executed_income'] += net_price * part / 100 if part else net_price
+        if simultaneous is False:
+            fact['duration'] += duration
+
+    # inttasks bonuses
+    for executor, month, total in IntTask.objects.filter(actual_finish__isnull=False) \
+                                                 .annotate(month=TruncMonth('actual_finish')) \
+                                                 .order_by().values('executor', 'month') \
+                                                 .annotate(total=Sum('bonus')) \
+                                                 .values_list('executor', 'month', 'total'):
+        facts[(executor, month)]['inttasks_income'] += total or 0
+
+    # owners income and costs with executors salary
+    tasks = Task.objects.filter(sending_date__isnull=False)
+    task_keys = {}
+    for task, owner, sending_date, price, net_price_rate in tasks.values_list(
+            'pk', 'owner', 'sending_date', 'project_type__price', 'project_type__net_price_rate'):
+        task_keys[task] = (owner, month_start(sending_date))
+        facts[task_keys[task]]['owner_income'] += round(price * net_price_rate / 100, 2)
+    for task, total in Order.objects.filter(task__in=tasks.values('pk')) \
+                                    .order_by().values('task').annotate(total=Sum('value')) \
+                                    .values_list('task', 'total'):
+        facts[task_keys[task]]['owner_costs'] += total or 0
+    for task, duration, salary in Execution.objects.filter(task__in=tasks.values('pk'),
+                                                           subtask__simultaneous_execution=False,
+                                                           executor__isnull=False) \
+                                                   .exclude(executor__user__username__startswith='outsourcing') \
+                                                   .values_list('task', 'actual_duration', 'executor__salary'):
+        facts[task_keys[task]]['owner_costs'] += Decimal(duration.total_seconds()) * salary / 600000
+
+    ProductivityFact.objects.bulk_create(
+        [ProductivityFact(employee_id=employee, month=month,
+                          **{figure: value.quantize(Decimal("1.0000")) if isinstance(value, Decimal) else value
+                             for figure, value in fact.items()})
+         for (employee, month), fact in facts.items()],
+        batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0102_deal_rollups'),
+        ('analytics', '0017_financefact'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductivityFact',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('month', models.DateField(verbose_name='Місяць')),
+                ('executed_income', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Виконано робіт, грн.')),
+                ('inttasks_income', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Бонуси за завдання, грн.')),
+                ('owner_income', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Виконано проектів, грн.')),
+                ('owner_costs', models.DecimalField(decimal_places=4, default=0, max_digits=14, verbose_name='Витрати по проектах з зарплатою, грн.')),
+                ('duration', models.DurationField(default=datetime.timedelta(0), verbose_name='Тривалість виконання')),
+                ('employee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='planner.employee', verbose_name='Працівник')),
+            ],
+            options={
+                'verbose_name': 'Показник продуктивності',
+                'verbose_name_plural': 'Показники продуктивності',
+                'ordering': ['month'],
+                'unique_together': {('employee', 'month')},
+            },
+        ),
+        migrations.RunPython(fill_productivity_facts, migrations.RunPython.noop),
+    ]
@@ -1,9 +1,13 @@
-from datetime import date
+from datetime import date, timedelta
 from enum import unique
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.contrib.auth.models import User
 from django.contrib.contenttypes.models import ContentType
 
-from planner.models import Employee
+from planner.models import Employee, Customer, Company, Project, Deal, ActOfAcceptance, Payment, Task, Execution, \
+    Order, IntTask, changed_deal_ids
 from html_templates.models import HTMLTemplate
 
 
@@ -14,10 +18,7 @@ class Kpi(models.Model):
     BonusSIA = 'BS'
     Tasks = 'TA'
     Productivity = 'PR'
-    KPI_CHOICES = (
-        (BonusItel, 'Бонус Ітел-Cервіс'),
-        (BonusGKP, 'Бонус Галкомпроект'),
-        (BonusSIA, 'Бонус ФОП'),
+    KPI_CHOICES = Company.BONUS_KPI_CHOICES + (
         (Tasks, 'Бонуси Загальні'),
         (Productivity, 'Продуктивність')
     )
@@ -30,11 +31,226 @@ class Kpi(models.Model):
     class Meta:
         verbose_name = 'КПЕ'
         ordering = ['-period']
+        unique_together = ('employee', 'name', 'period')
 
     def __str__(self):
         return f"{self.employee.name} {self.get_name_display()}"
 
 
+class FinanceFact(models.Model):
+    """ Model contains monthly financial figures of customer deals with company """
+    customer = models.ForeignKey(Customer, verbose_name='Замовник', on_delete=models.CASCADE)
+    company = models.ForeignKey(Company, verbose_name='Компанія', on_delete=models.CASCADE)
+    month = models.DateField('Місяць')
+    acts = models.DecimalField('Виписано актів, грн.', max_digits=12, decimal_places=2, default=0)
+    payments = models.DecimalField('Оплачено, грн.', max_digits=12, decimal_places=2, default=0)
+    work_done = models.DecimalField('Виконано робіт, грн.', max_digits=12, decimal_places=2, default=0)
+    receivables = models.DecimalField('Дебіторська заборгованість на кінець місяця, грн.',
+                                      max_digits=12, decimal_places=2, default=0)
+
+    FIGURES = ['acts', 'payments', 'work_done', 'receivables']
+
+    class Meta:
+        verbose_name = 'Фінансовий показник'
+        verbose_name_plural = 'Фінансові показники'
+        unique_together = ('customer', 'company', 'month')
+        ordering = ['month']
+
+    def __str__(self):
+        return f"{self.customer} {self.company} {self.month:%m.%Y}"
+
+
+def deals_pairs(deal_ids):
+    """ (customer_id, company_id) pairs of deals """
+    return set(Deal.objects.filter(pk__in=deal_ids).values_list('customer', 'company'))
+
+
+@receiver([post_save, post_delete], sender=ActOfAcceptance, dispatch_uid="update_act_finance_facts")
+@receiver([post_save, post_delete], sender=Payment, dispatch_uid="update_payment_finance_facts")
+def update_document_facts(sender, instance, signal, created=False, **kwargs):
+    """ Update finance facts after save or delete ActOfAcceptance or Payment """
+    if signal == post_delete or created or {'deal', 'date', 'value'} & set(instance.changed_fields):
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(deals_pairs(changed_deal_ids(instance, created)))
+
+
+@receiver([post_save, post_delete], sender=Task, dispatch_uid="update_task_finance_facts")
+def update_task_facts(sender, instance, signal, created=False, **kwargs):
+    """ Update finance facts after save or delete Task """
+    if signal == post_delete or created or {'deal', 'project_type', 'actual_finish'} & set(instance.changed_fields):
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(deals_pairs(changed_deal_ids(instance, created)))
+
+
+@receiver([post_save, post_delete], sender=Deal, dispatch_uid="update_deal_finance_facts")
+def update_deal_facts(sender, instance, signal, created=False, **kwargs):
+    """ Update finance facts after save or delete Deal """
+    if created:
+        return
+    pairs = {(instance.customer_id, instance.company_id)}
+    if signal == post_save:
+        changed_fields = set(instance.changed_fields)
+        if not {'customer', 'company', 'act_status', 'pay_status'} & changed_fields:
+            return
+        pairs.add((instance.get_field_diff('customer')[0] if 'customer' in changed_fields else instance.customer_id,
+                   instance.get_field_diff('company')[0] if 'company' in changed_fields else instance.company_id))
+    from analytics.tasks import update_facts_on_commit
+    update_facts_on_commit(pairs)
+
+
+@receiver(post_save, sender=Project, dispatch_uid="update_project_finance_facts")
+def update_project_facts(sender, instance, created, **kwargs):
+    """ Update finance facts of deals with tasks of Project after its price change """
+    if not created and 'price' in instance.changed_fields:
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(set(Deal.objects.filter(task__project_type=instance)
+                                               .values_list('customer', 'company').distinct()))
+
+
+class ProductivityFact(models.Model):
+    """ Model contains monthly productivity figures of employee """
+    employee = models.ForeignKey(Employee, verbose_name='Працівник', on_delete=models.CASCADE)
+    month = models.DateField('Місяць')
+    executed_income = models.DecimalField('Виконано робіт, грн.', max_digits=14, decimal_places=4, default=0)
+    inttasks_income = models.DecimalField('Бонуси за завдання, грн.', max_digits=14, decimal_places=4, default=0)
+    owner_income = models.DecimalField('Виконано проектів, грн.', max_digits=14, decimal_places=4, default=0)
+    owner_costs = models.DecimalField('Витрати по проектах з зарплатою, грн.', max_digits=14, decimal_places=4,
+                                      default=0)
+    duration = models.DurationField('Тривалість виконання', default=timedelta(0))
+
+    FIGURES = ['executed_income', 'inttasks_income', 'owner_income', 'owner_costs', 'duration']
+
+    class Meta:
+        verbose_name = 'Показник продуктивності'
+        verbose_name_plural = 'Показники продуктивності'
+        unique_together = ('employee', 'month')
+        ordering = ['month']
+
+    def __str__(self):
+        return f"{self.employee} {self.month:%m.%Y}"
+
+
+def values_before_and_after(instance, field_name, created):
+    """ Not empty values of instance field before and after save """
+    values = {getattr(instance, instance._meta.get_field(field_name).attname)}
+    if not created and field_name in instance.changed_fields:
+        values.add(instance.get_field_diff(field_name)[0])
+    values.discard(None)
+    return values
+
+
+def owners_months(task_ids):
+    """ (owner_id, sending_date) pairs of sent tasks """
+    return set(Task.objects.filter(pk__in=task_ids, sending_date__isnull=False).values_list('owner', 'sending_date'))
+
+
+@receiver([post_save, post_delete], sender=Execution, dispatch_uid="update_execution_productivity_facts")
+def update_execution_productivity(sender, instance, signal, created=False, **kwargs):
+    """ Update productivity facts of executor and task owner after save or delete Execution """
+    if signal == post_delete or created or \
+            {'task', 'subtask', 'executor', 'part', 'exec_status', 'actual_finish', 'actual_duration'} & \
+            set(instance.changed_fields):
+        employee_months = {(executor, finish) for executor in values_before_and_after(instance, 'executor', created)
+                           for finish in values_before_and_after(instance, 'actual_finish', created)}
+        employee_months |= owners_months(values_before_and_after(instance, 'task', created))
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(employee_months=employee_months)
+
+
+@receiver([post_save, post_delete], sender=Task, dispatch_uid="update_task_productivity_facts")
+def update_task_productivity(sender, instance, signal, created=False, **kwargs):
+    """ Update productivity facts of owner and executors after save or delete Task """
+    changed_fields = set() if signal == post_delete or created else set(instance.changed_fields)
+    employee_months = set()
+    if signal == post_delete or created or {'owner', 'sending_date', 'project_type'} & changed_fields:
+        employee_months = {(owner, sending_date) for owner in values_before_and_after(instance, 'owner', created)
+                           for sending_date in values_before_and_after(instance, 'sending_date', created)}
+    if 'project_type' in changed_fields:
+        employee_months |= set(instance.execution_set.filter(executor__isnull=False, actual_finish__isnull=False)
+                                                     .values_list('executor', 'actual_finish'))
+    if employee_months:
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(employee_months=employee_months)
+
+
+@receiver([post_save, post_delete], sender=Order, dispatch_uid="update_order_productivity_facts")
+def update_order_productivity(sender, instance, signal, created=False, **kwargs):
+    """ Update productivity facts of task owner after save or delete Order """
+    if signal == post_delete or created or {'task', 'value'} & set(instance.changed_fields):
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(employee_months=owners_months(values_before_and_after(instance, 'task', created)))
+
+
+@receiver([post_save, post_delete], sender=IntTask, dispatch_uid="update_inttask_productivity_facts")
+def update_inttask_productivity(sender, instance, signal, created=False, **kwargs):
+    """ Update productivity facts of executor after save or delete IntTask """
+    if signal == post_delete or created or {'executor', 'actual_finish', 'bonus'} & set(instance.changed_fields):
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(employee_months={
+            (executor, finish) for executor in values_before_and_after(instance, 'executor', created)
+            for finish in values_before_and_after(instance, 'actual_finish', created)})
+
+
+@receiver(post_save, sender=Employee, dispatch_uid="update_employee_productivity_facts")
+def update_employee_productivity(sender, instance, created, **kwargs):
+    """ Update productivity facts of owners of tasks executed by Employee after change of its salary """
+    if not created and 'salary' in instance.changed_fields:
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(employee_months=set(Task.objects.filter(execution__executor=instance,
+                                                                       sending_date__isnull=False)
+                                                               .values_list('owner', 'sending_date')))
+
+
+@receiver(post_save, sender=Project, dispatch_uid="update_project_productivity_facts")
+def update_project_productivity(sender, instance, created, **kwargs):
+    """ Update productivity facts of executors and owners of tasks of Project after its price change """
+    if not created and {'price', 'net_price_rate'} & set(instance.changed_fields):
+        employee_months = set(Execution.objects.filter(task__project_type=instance, executor__isnull=False,
+                                                       actual_finish__isnull=False)
+                                               .values_list('executor', 'actual_finish'))
+        employee_months |= set(instance.task_set.filter(sending_date__isnull=False)
+                                                .values_list('owner', 'sending_date'))
+        from analytics.tasks import update_facts_on_commit
+        update_facts_on_commit(employee_months=employee_months)
+
+
+@receiver([post_save, post_delete], sender=Deal, dispatch_uid="invalidate_deal_contexts")
+@receiver([post_save, post_delete], sender=ActOfAcceptance, dispatch_uid="invalidate_act_contexts")
+@receiver([post_save, post_delete], sender=Payment, dispatch_uid="invalidate_payment_contexts")
+def invalidate_finance_contexts(sender, **kwargs):
+    """ Change version of finance data after commit so cached contexts are rebuilt """
+    from analytics.context import invalidate_data, FINANCE
+    transaction.on_commit(lambda: invalidate_data(FINANCE))
+
+
+@receiver([post_save, post_delete], sender=Task, dispatch_uid="invalidate_task_contexts")
+@receiver([post_save, post_delete], sender=Order, dispatch_uid="invalidate_order_contexts")
+@receiver(post_save, sender=Project, dispatch_uid="invalidate_project_contexts")
+@receiver([post_save, post_delete], sender=Customer, dispatch_uid="invalidate_customer_contexts")
+@receiver([post_save, post_delete], sender=Employee, dispatch_uid="invalidate_employee_contexts")
+def invalidate_task_contexts(sender, **kwargs):
+    """ Change versions of finance and productivity data after commit so cached contexts are rebuilt """
+    from analytics.context import invalidate_data, FINANCE, PRODUCTIVITY
+    transaction.on_commit(lambda: invalidate_data(FINANCE, PRODUCTIVITY))
+
+
+@receiver([post_save, post_delete], sender=Execution, dispatch_uid="invalidate_execution_contexts")
+@receiver([post_save, post_delete], sender=IntTask, dispatch_uid="invalidate_inttask_contexts")
+def invalidate_execution_contexts(sender, **kwargs):
+    """ Change version of productivity data after commit so cached contexts are rebuilt """
+    from analytics.context import invalidate_data, PRODUCTIVITY
+    transaction.on_commit(lambda: invalidate_data(PRODUCTIVITY))
+
+
+@receiver(post_save, sender=User, dispatch_uid="invalidate_user_contexts")
+def invalidate_user_contexts(sender, update_fields=None, **kwargs):
+    """ Change versions of finance and productivity data after commit if user could be (de)activated,
+    contexts include active employees only. Saves of last_login on login are skipped """
+    if update_fields is None or 'is_active' in update_fields:
+        from analytics.context import invalidate_data, FINANCE, PRODUCTIVITY
+        transaction.on_commit(lambda: invalidate_data(FINANCE, PRODUCTIVITY))
+
+
 class Report(models.Model):
     """ Model contains Reports """
     CONTEXT_CHOICES = (
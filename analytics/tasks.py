@@ -1,101 +1,380 @@
 """ Tasks for analytics app """
-from datetime import date
+import threading
+from collections import defaultdict
+from datetime import date, datetime, timedelta
 from dateutil.relativedelta import relativedelta
-from decimal import Decimal
+from decimal import Decimal, ROUND_HALF_UP
 from celery.utils.log import get_task_logger
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Q, Sum
+from django.db.models.functions import TruncMonth
 from weasyprint import HTML, CSS
 
 from planner.celery import app
-from planner.models import Employee, Execution
-from analytics.models import Kpi
+from planner.tasks import waits_for_commit
+from planner.models import Employee, Company, Deal, Task, Execution, Order, IntTask, ActOfAcceptance, Payment
+from analytics.models import Kpi, FinanceFact, ProductivityFact
+from analytics.context import invalidate_data, FINANCE, PRODUCTIVITY
 
 LOGGER = get_task_logger(__name__)
+BONUS_KPIS = [Kpi.BonusItel, Kpi.BonusGKP, Kpi.BonusSIA, Kpi.Tasks]
+
+# Customer and company pairs changed in current thread which finance facts are not updated yet
+pending_facts = threading.local()
+
+
+def executions_bonuses(period):
+    """ return dict {(employee_id, company_id): bonuses} of executions finished in period """
+    bonuses = defaultdict(Decimal)
+    executions = Execution.objects.filter(executor__user__is_active=True,
+                                          exec_status__in=[Execution.OnChecking, Execution.OnCorrection,
+                                                           Execution.Done],
+                                          actual_finish__month=period.month,
+                                          actual_finish__year=period.year) \
+                                  .values_list('executor', 'task__deal__company', 'part', 'difficulty',
+                                               'task__difficulty_executor', 'task__project_type__price',
+                                               'task__project_type__net_price_rate',
+                                               'task__project_type__executors_bonus')
+
+    for executor, company, part, difficulty, difficulty_executor, price, net_price_rate, executors_bonus \
+            in executions:
+        # the same arithmetic as Execution.bonus()
+        net_price = round(price * net_price_rate / 100, 2)
+        bonus = net_price * executors_bonus * part / 10000 * difficulty_executor * difficulty
+        bonuses[(executor, company)] += bonus.quantize(Decimal("1.00"), ROUND_HALF_UP)
+    return bonuses
+
+
+def owners_bonuses(period):
+    """ return dict {(employee_id, company_id): bonuses} of tasks sent in period """
+    bonuses = defaultdict(Decimal)
+    tasks = Task.objects.filter(owner__user__is_active=True,
+                                sending_date__month=period.month,
+                                sending_date__year=period.year)
+    task_ids = tasks.values('pk')
+    exec_parts = dict(Execution.objects.filter(task__in=task_ids, executor__isnull=False)
+                      .order_by().values('task').annotate(total=Sum('part')).values_list('task', 'total'))
+    costs = dict(Order.objects.filter(task__in=task_ids)
+                 .order_by().values('task').annotate(total=Sum('value')).values_list('task', 'total'))
+
+    for task, owner, company, difficulty_owner, price, net_price_rate, owner_bonus, executors_bonus, \
+            exclude_costs in tasks.values_list('pk', 'owner', 'deal__company', 'difficulty_owner',
+                                               'project_type__price', 'project_type__net_price_rate',
+                                               'project_type__owner_bonus', 'project_type__executors_bonus',
+                                               'project_type__exclude_costs'):
+        # the same arithmetic as Task.owner_part() and Task.owner_bonus()
+        owner_part = 0
+        if owner_bonus > 0:
+            exec_part = exec_parts.get(task) or 0
+            owner_part = int(100 + (100 - exec_part) * executors_bonus / owner_bonus) if exec_part > 100 else 100
+        net_price = round(price * net_price_rate / 100, 2)
+        if exclude_costs:
+            net_price -= costs.get(task) or 0
+        bonus = net_price * owner_part * owner_bonus / 10000 * difficulty_owner
+        if bonus > 0:
+            bonuses[(owner, company)] += bonus.quantize(Decimal("1.00"), ROUND_HALF_UP)
+    return bonuses
+
+
+def employees_bonuses(period):
+    """ return dict {(employee_id, kpi_name): value} of monthly bonuses """
+    kpis = defaultdict(Decimal)
+
+    # executors and owners bonuses by bonus KPIs of companies
+    companies_kpis = dict(Company.objects.values_list('pk', 'bonus_kpi'))
+    for bonuses in (executions_bonuses(period), owners_bonuses(period)):
+        for (employee, company), value in bonuses.items():
+            if not companies_kpis.get(company):
+                LOGGER.warning("No bonus KPI for company %s", company)
+                continue
+            kpis[(employee, companies_kpis[company])] += value
+
+    # inttasks bonuses
+    inttasks = IntTask.objects.filter(executor__user__is_active=True,
+                                      actual_finish__month=period.month,
+                                      actual_finish__year=period.year) \
+                              .order_by().values('executor').annotate(total=Sum('bonus')) \
+                              .values_list('executor', 'total')
+    for employee, value in inttasks:
+        kpis[(employee, Kpi.Tasks)] += value or 0
+
+    return {key: value for key, value in kpis.items() if value > 0}
+
+
+def employees_productivity(bonuses):
+    """ return dict {(employee_id, Kpi.Productivity): value} from dict of employees bonuses """
+    totals = defaultdict(Decimal)
+    for (employee, name), value in bonuses.items():
+        if name in (Kpi.BonusItel, Kpi.BonusGKP, Kpi.Tasks):
+            totals[employee] += value
+
+    kpis = {}
+    employees = Employee.objects.filter(user__is_active=True, user__groups__name='Проектувальники',
+                                        salary__gt=0).values_list('pk', 'salary', 'coefficient')
+    for employee, salary, coefficient in employees:
+        # calculate productivity
+        # 10000 = 100(percentage) * 100(percentage)
+        productivity = totals[employee] / salary / coefficient * 10000
+        if productivity:
+            kpis[(employee, Kpi.Productivity)] = productivity
+    return kpis
+
+
+def save_kpis(period, kpis, names):
+    """ Replace KPIs with given names for period by kpis dict {(employee_id, name): value}.
+    Changes are applied in one transaction, so readers never see a partially calculated month """
+    kpis = {key: Decimal(value).quantize(Decimal("1.00")) for key, value in kpis.items()}
+
+    with transaction.atomic():
+        existing = Kpi.objects.select_for_update().filter(name__in=names,
+                                                          period__month=period.month,
+                                                          period__year=period.year)
+        to_update = []
+        to_delete = []
+        for kpi in existing:
+            value = kpis.pop((kpi.employee_id, kpi.name), None)
+            if value is None:
+                to_delete.append(kpi.pk)
+            elif kpi.value != value:
+                kpi.value = value
+                kpi.modified = date.today()
+                to_update.append(kpi)
+
+        Kpi.objects.filter(pk__in=to_delete).delete()
+        Kpi.objects.bulk_update(to_update, ['value', 'modified'])
+        Kpi.objects.bulk_create([Kpi(employee_id=employee, name=name, value=value, period=period)
+                                 for (employee, name), value in kpis.items()])
+
+    LOGGER.info("KPIs for %s.%s: %s created, %s updated, %s deleted",
+                period.month, period.year, len(kpis), len(to_update), len(to_delete))
 
 
 @app.task
 def calc_bonuses(period):
     """ Save monthly bonuses of Employees """
-    employees = Employee.objects.filter(user__is_active=True)
-
-    for employee in employees:
-        for kpi_name in [(1, Kpi.BonusItel), (2, Kpi.BonusGKP), (3, Kpi.BonusSIA)]:
-            bonuses = 0
-
-            # calculate executor bonuses
-            executions = employee.executions_for_period(period).filter(task__deal__company=kpi_name[0])
-            for execution in executions:
-                bonuses += execution.bonus()
-
-            # calculate owner bonuses
-            tasks = employee.tasks_for_period(period).filter(deal__company=kpi_name[0])
-            for task in tasks:
-                bonuses += task.owner_bonus()
-
-            # save bonuses
-            if bonuses > 0:
-                Kpi.objects.create(employee=employee,
-                                   name=kpi_name[1],
-                                   value=bonuses,
-                                   period=period
-                                   )
-
-        # calculate inttask bonuses
-        inttask_bonus = employee.inttask_set.filter(actual_finish__month=period.month,
-                                                    actual_finish__year=period.year)\
-                                            .aggregate(Sum('bonus'))['bonus__sum']
-
-        # save inttasks bonuses
-        if inttask_bonus:
-            Kpi.objects.create(employee=employee,
-                               name=Kpi.Tasks,
-                               value=inttask_bonus,
-                               period=period
-                               )
+    save_kpis(period, employees_bonuses(period), BONUS_KPIS)
 
     LOGGER.info("Employee bonuses for %s.%s saved", period.month, period.year)
 
 
 @app.task
 def calc_kpi(period):
-    """ Save monthly bonuses of Employees """
-    employees = Employee.objects.filter(user__is_active=True, user__groups__name='Проектувальники')
-
-    for employee in employees:
-        bonus = Kpi.objects.filter(employee=employee,
-                                   name__in=[Kpi.BonusItel, Kpi.BonusGKP, Kpi.Tasks],
-                                   period__month=period.month,
-                                   period__year=period.year)\
-                           .aggregate(Sum('value'))['value__sum'] or 0
-
-        if employee.salary > 0:
-            # calculate productivity
-            # 10000 = 100(percentage) * 100(percentage)
-            productivity = bonus / employee.salary / employee.coefficient * 10000
-
-        # save productivity
-        if productivity:
-            Kpi.objects.create(employee=employee,
-                               name=Kpi.Productivity,
-                               value=productivity,
-                               period=period
-                               )
+    """ Save monthly productivity of Employees from saved bonuses """
+    bonuses = Kpi.objects.filter(name__in=BONUS_KPIS,
+                                 period__month=period.month,
+                                 period__year=period.year)
+    bonuses = {(employee, name): value for employee, name, value in bonuses.values_list('employee', 'name', 'value')}
+    save_kpis(period, employees_productivity(bonuses), [Kpi.Productivity])
 
     LOGGER.info("Employee KPIs for %s.%s saved", period.month, period.year)
 
 
 @app.task
 def recalc_kpi(prev_month=False, period=None):
-    """ Clear existing KPIs and generate new """
+    """ Calculate KPIs for month and replace existing in one transaction """
     if not period:
         period = date.today()
     if prev_month:
         period = period - relativedelta(months=1)
     period = period.replace(day=1)
 
-    Kpi.objects.filter(period=period).delete()
-    calc_bonuses(period)
-    calc_kpi(period)
+    kpis = employees_bonuses(period)
+    kpis.update(employees_productivity(kpis))
+    save_kpis(period, kpis, [name for name, _ in Kpi.KPI_CHOICES])
+
+
+def update_facts_on_commit(pairs=(), employee_months=()):
+    """ Collect changed (customer_id, company_id) pairs and (employee_id, date) pairs and update their
+        finance and productivity facts once on transaction commit. Outside of transaction facts are updated immediately.
+    """
+    # start new collection if callback of previous one has run or was discarded by rollback
+    is_new = not waits_for_commit(getattr(pending_facts, 'callback', None))
+    if is_new:
+        pending_pairs, pending_months = set(), set()
+        pending_facts.pairs, pending_facts.employee_months = pending_pairs, pending_months
+        pending_facts.callback = lambda: update_pending_facts(pending_pairs, pending_months)
+    pending_facts.pairs.update(pairs)
+    pending_facts.employee_months.update((employee, month_start(day)) for employee, day in employee_months)
+    if is_new:
+        transaction.on_commit(pending_facts.callback)
+
+
+def update_pending_facts(pairs, employee_months):
+    """ Update finance and productivity facts of collected pairs """
+    if pairs:
+        update_finance_facts(pairs=list(pairs))
+    if employee_months:
+        update_productivity_facts(employee_months=list(employee_months))
+
+
+def replace_facts(existing, facts, key_fields):
+    """ Replace rows of existing queryset by facts dict {key: {figure: value}} in one transaction.
+    Return counts of created, updated and deleted rows """
+    model = existing.model
+    with transaction.atomic():
+        to_update = []
+        to_delete = []
+        for fact in existing.select_for_update():
+            values = facts.pop(tuple(getattr(fact, field) for field in key_fields), None)
+            if values is None:
+                to_delete.append(fact.pk)
+            elif any(getattr(fact, figure) != value for figure, value in values.items()):
+                for figure, value in values.items():
+                    setattr(fact, figure, value)
+                to_update.append(fact)
+
+        model.objects.filter(pk__in=to_delete).delete()
+        model.objects.bulk_update(to_update, model.FIGURES, batch_size=500)
+        model.objects.bulk_create([model(**dict(zip(key_fields, key)), **values) for key, values in facts.items()],
+                                  batch_size=500)
+    return len(facts), len(to_update), len(to_delete)
+
+
+def month_sums(queryset, date_field, value_field):
+    """ return dict {(customer_id, company_id, month): sum} of queryset values grouped by TruncMonth """
+    rows = queryset.filter(**{date_field + '__isnull': False}) \
+                   .annotate(month=TruncMonth(date_field)) \
+                   .order_by().values('deal__customer', 'deal__company', 'month') \
+                   .annotate(total=Sum(value_field)) \
+                   .values_list('deal__customer', 'deal__company', 'month', 'total')
+    return {(customer, company, month): total or 0 for customer, company, month, total in rows}
+
+
+def finance_facts(deals):
+    """ return dict {(customer_id, company_id, month): {figure: value}} calculated from acts, payments
+    and finished tasks of deals """
+    acts = ActOfAcceptance.objects.filter(deal__in=deals)
+    payments = Payment.objects.filter(deal__in=deals)
+    sums = {'acts': month_sums(acts, 'date', 'value'),
+            'payments': month_sums(payments, 'date', 'value'),
+            'work_done': month_sums(Task.objects.filter(deal__in=deals), 'actual_finish', 'project_type__price')}
+
+    # receivables change by months
+    receivables = defaultdict(Decimal)
+    for key, value in month_sums(acts.in_receivables(), 'date', 'value').items():
+        receivables[key] += value
+    for key, value in month_sums(payments.in_receivables(), 'date', 'value').items():
+        receivables[key] -= value
+
+    facts = {}
+    balances = defaultdict(Decimal)
+    for key in sorted(set().union(receivables, *sums.values())):
+        customer, company, _ = key
+        balances[(customer, company)] += receivables.get(key, 0)
+        facts[key] = {figure: values.get(key, 0) for figure, values in sums.items()}
+        facts[key]['receivables'] = balances[(customer, company)]
+    return facts
+
+
+@app.task
+def update_finance_facts(pairs=None):
+    """ Recalculate finance facts of (customer_id, company_id) pairs, of all pairs if not given """
+    deals = Deal.objects.all()
+    existing = FinanceFact.objects.all()
+    if pairs is not None:
+        condition = Q(pk__in=[])
+        for customer, company in pairs:
+            condition |= Q(customer=customer, company=company)
+        deals = deals.filter(condition)
+        existing = existing.filter(condition)
+    counts = replace_facts(existing, finance_facts(deals), ('customer_id', 'company_id', 'month'))
+
+    if any(counts):
+        invalidate_data(FINANCE)
+    LOGGER.info("Finance facts: %s created, %s updated, %s deleted", *counts)
+    return counts
+
+
+def month_start(day):
+    """ first day of month of date or datetime """
+    if isinstance(day, datetime):
+        day = day.date()
+    return day.replace(day=1)
+
+
+def months_condition(employee_months, employee_field, date_field):
+    """ return Q for rows of (employee_id, month) pairs """
+    employees = defaultdict(set)
+    for employee, month in employee_months:
+        employees[month].add(employee)
+    condition = Q(pk__in=[])
+    for month, month_employees in employees.items():
+        condition |= Q(**{employee_field + '__in': month_employees,
+                          date_field + '__year': month.year,
+                          date_field + '__month': month.month})
+    return condition
+
+
+def productivity_facts(employee_months=None):
+    """ return dict {(employee_id, month): {figure: value}} calculated from executions, inttasks
+    and sent tasks of (employee_id, month) pairs, of all pairs if not given """
+    executions = Execution.objects.filter(exec_status__in=[Execution.OnChecking, Execution.OnCorrection,
+                                                           Execution.Done],
+                                          executor__isnull=False, actual_finish__isnull=False)
+    inttasks = IntTask.objects.filter(actual_finish__isnull=False)
+    tasks = Task.objects.filter(sending_date__isnull=False)
+    if employee_months is not None:
+        executions = executions.filter(months_condition(employee_months, 'executor', 'actual_finish'))
+        inttasks = inttasks.filter(months_condition(employee_months, 'executor', 'actual_finish'))
+        tasks = tasks.filter(months_condition(employee_months, 'owner', 'sending_date'))
+
+    facts = defaultdict(lambda: {'executed_income': Decimal(0), 'inttasks_income': Decimal(0),
+                                 'owner_income': Decimal(0), 'owner_costs': Decimal(0), 'duration': timedelta()})
+
+    # executors income and duration
+    for executor, finish, part, price, net_price_rate, duration, simultaneous in executions.values_list(
+            'executor', 'actual_finish', 'part', 'task__project_type__price', 'task__project_type__net_price_rate',
+            'actual_duration', 'subtask__simultaneous_execution'):
+        fact = facts[(executor, month_start(finish))]
+        # the same arithmetic as Task.money_earned()
+        net_price = round(price * net_price_rate / 100, 2)
+        fact['executed_income'] += net_price * part / 100 if part else net_price
+        if simultaneous is False:
+            fact['duration'] += duration
+
+    # inttasks bonuses
+    for executor, month, total in inttasks.annotate(month=TruncMonth('actual_finish')) \
+                                          .order_by().values('executor', 'month') \
+                                          .annotate(total=Sum('bonus')) \
+                                          .values_list('executor', 'month', 'total'):
+        facts[(executor, month)]['inttasks_income'] += total or 0
+
+    # owners income and costs with executors salary
+    task_keys = {}
+    for task, owner, sending_date, price, net_price_rate in tasks.values_list(
+            'pk', 'owner', 'sending_date', 'project_type__price', 'project_type__net_price_rate'):
+        task_keys[task] = (owner, month_start(sending_date))
+        facts[task_keys[task]]['owner_income'] += round(price * net_price_rate / 100, 2)
+    for task, total in Order.objects.filter(task__in=tasks.values('pk')) \
+                                    .order_by().values('task').annotate(total=Sum('value')) \
+                                    .values_list('task', 'total'):
+        facts[task_keys[task]]['owner_costs'] += total or 0
+    for task, duration, salary in Execution.objects.filter(task__in=tasks.values('pk'),
+                                                           subtask__simultaneous_execution=False,
+                                                           executor__isnull=False) \
+                                                   .exclude(executor__user__username__startswith='outsourcing') \
+                                                   .values_list('task', 'actual_duration', 'executor__salary'):
+        # 3600 * 166.6 (average month hours) = 600000
+        facts[task_keys[task]]['owner_costs'] += Decimal(duration.total_seconds()) * salary / 600000
+
+    for fact in facts.values():
+        for figure in ('executed_income', 'inttasks_income', 'owner_income', 'owner_costs'):
+            fact[figure] = fact[figure].quantize(Decimal("1.0000"))
+    return dict(facts)
+
+
+@app.task
+def update_productivity_facts(employee_months=None):
+    """ Recalculate productivity facts of (employee_id, month) pairs, of all pairs if not given """
+    existing = ProductivityFact.objects.all()
+    if employee_months is not None:
+        existing = existing.filter(months_condition(employee_months, 'employee', 'month'))
+    counts = replace_facts(existing, productivity_facts(employee_months), ('employee_id', 'month'))
+
+    if any(counts):
+        invalidate_data(PRODUCTIVITY)
+    LOGGER.info("Productivity facts: %s created, %s updated, %s deleted", *counts)
+    return counts
 
 
 @app.task
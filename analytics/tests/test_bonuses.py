@@ -0,0 +1,90 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from crum import impersonate
+
+from planner.models import Company, Employee, Execution, Order, SubTask, Task
+from planner.tests.base import PlannerTestCase
+from analytics.models import Kpi
+from analytics.tasks import employees_bonuses
+
+
+def per_employee_bonuses(period):
+    """ Bonuses of active employees summed execution by execution and task by task as calc_bonuses() did """
+    kpis = {}
+    for employee in Employee.objects.filter(user__is_active=True):
+        for company in Company.objects.exclude(bonus_kpi=''):
+            bonuses = 0
+            for execution in employee.executions_for_period(period).filter(task__deal__company=company):
+                bonuses += execution.bonus()
+            for task in employee.tasks_for_period(period).filter(deal__company=company):
+                bonuses += task.owner_bonus()
+            if bonuses > 0:
+                kpis[(employee.pk, company.bonus_kpi)] = kpis.get((employee.pk, company.bonus_kpi), 0) + bonuses
+    return kpis
+
+
+class EmployeesBonusesTest(PlannerTestCase):
+
+    def setUp(self):
+        self.period = date(2024, 5, 1)
+        Company.objects.filter(pk=self.companies[0].pk).update(bonus_kpi=Kpi.BonusItel)
+        Company.objects.filter(pk=self.companies[1].pk).update(bonus_kpi=Kpi.BonusGKP)
+        with impersonate(self.admin):
+            inactive = Employee.objects.create(user=User.objects.create_user('inactive', is_active=False),
+                                               name='Звільнений', position='Інженер', salary=10000)
+            self.unmapped = Company.objects.create(name='Нова компанія', chief=self.employees[0],
+                                                   accountant=self.employees[0], taxation='wvat')
+            self.subtasks = [SubTask.objects.create(project_type=project, name=f'Розділ {i}', part=70,
+                                                    duration=timedelta(hours=4))
+                             for i, project in enumerate(self.projects)]
+        self.projects[1].exclude_costs = True
+        self.projects[1].save()
+        self.executors = self.employees + [inactive]
+
+    def add_task(self, deal, object_code, project, sending_date, difficulty_owner='1.00', owner=0):
+        task = self.create_task(deal, object_code, project=project)
+        Task.objects.filter(pk=task.pk).update(sending_date=sending_date, owner=self.executors[owner],
+                                               difficulty_owner=Decimal(difficulty_owner),
+                                               difficulty_executor=Decimal('1.10'))
+        return task
+
+    def add_execution(self, task, project, executor, part, exec_status, finish, difficulty='1.00'):
+        with impersonate(self.admin):
+            execution = Execution.objects.create(task=task, subtask=self.subtasks[project],
+                                                 executor=self.executors[executor], part=part)
+        Execution.objects.filter(pk=execution.pk).update(exec_status=exec_status, actual_finish=finish,
+                                                         difficulty=Decimal(difficulty))
+
+    def test_bonuses_match_per_employee_calculation(self):
+        in_period = datetime(2024, 5, 14, 12)
+        deals = [self.create_deal('Д-1'), self.create_deal('Д-2', customer=1)]
+        for i, deal in enumerate(deals):
+            # sent in period, sent in other month and not sent tasks
+            sent = self.add_task(deal, f'ОБ-{i}-1', i, self.period + timedelta(days=3), '1.25')
+            other_month = self.add_task(deal, f'ОБ-{i}-2', i, date(2024, 4, 20), owner=1)
+            not_sent = self.add_task(deal, f'ОБ-{i}-3', i, None, owner=1)
+            inactive_owner = self.add_task(deal, f'ОБ-{i}-4', i, self.period, owner=2)
+            # executors parts over 100 reduce owner part
+            self.add_execution(sent, i, 0, 80, Execution.Done, in_period, '1.35')
+            self.add_execution(sent, i, 1, 60, Execution.OnChecking, in_period)
+            self.add_execution(other_month, i, 0, 30, Execution.OnCorrection, in_period)
+            self.add_execution(other_month, i, 1, 40, Execution.Done, datetime(2024, 6, 1, 9))
+            self.add_execution(not_sent, i, 0, 50, Execution.InProgress, in_period)
+            self.add_execution(not_sent, i, 2, 50, Execution.Done, in_period)
+            self.add_execution(inactive_owner, i, 1, 120, Execution.Done, in_period)
+            with impersonate(self.admin):
+                Order.objects.create(contractor=self.contractor, company=deal.company, task=sent,
+                                     value=Decimal(300))
+
+        # bonuses of deals of company without bonus KPI are skipped
+        unmapped_deal = self.create_deal('Д-3')
+        unmapped_deal.company = self.unmapped
+        unmapped_deal.save()
+        self.add_execution(self.add_task(unmapped_deal, 'ОБ-3', 0, self.period), 0, 0, 100, Execution.Done,
+                           in_period)
+
+        expected = per_employee_bonuses(self.period)
+        self.assertTrue(any(name == Kpi.BonusGKP for _, name in expected))
+        bonuses = {key: value for key, value in employees_bonuses(self.period).items() if key[1] != Kpi.Tasks}
+        self.assertEqual(bonuses, expected)
@@ -0,0 +1,36 @@
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from crum import impersonate
+
+from planner.models import Execution, SubTask, Task
+from planner.tests.base import PlannerTestCase
+from analytics.models import ProductivityFact
+from analytics.tasks import productivity_facts, update_productivity_facts
+
+
+class ProductivityFactsTest(PlannerTestCase):
+
+    def facts(self):
+        return {(fact.employee_id, fact.month): {figure: getattr(fact, figure) for figure in ProductivityFact.FIGURES}
+                for fact in ProductivityFact.objects.all()}
+
+    def test_salary_change_updates_owner_costs(self):
+        task = self.create_task(self.create_deal('Д-1'), 'ОБ-1')
+        Task.objects.filter(pk=task.pk).update(sending_date=date(2024, 5, 20))
+        with impersonate(self.admin):
+            subtask = SubTask.objects.create(project_type=self.projects[0], name='Креслення', part=50,
+                                             duration=timedelta(hours=8))
+            execution = Execution.objects.create(task=task, subtask=subtask, executor=self.employees[1], part=50)
+        Execution.objects.filter(pk=execution.pk).update(exec_status=Execution.Done,
+                                                         actual_finish=datetime(2024, 5, 10, 12),
+                                                         actual_duration=timedelta(hours=16))
+        self.commit()
+        update_productivity_facts()
+        owner_costs = ProductivityFact.objects.get(employee=self.employees[0]).owner_costs
+
+        executor = self.employees[1]
+        executor.salary = Decimal(30000)
+        executor.save()
+        self.commit()
+        self.assertEqual(self.facts(), productivity_facts())
+        self.assertGreater(ProductivityFact.objects.get(employee=self.employees[0]).owner_costs, owner_costs)
@@ -1,3 +1,4 @@
+from collections import defaultdict
 from rest_framework import viewsets, permissions
 
 from . import serializers
@@ -74,3 +75,15 @@ class EmployeeViewSet(viewsets.ModelViewSet):
         queryset = employee_queryset_filter(self.request.user, self.request.GET)
         # return filtered queryset
         return queryset
+
+    def get_serializer_context(self):
+        # filter executions once and partition them by executors for serializer
+        context = super().get_serializer_context()
+        if self.action in ['list', 'retrieve']:
+            query_dict = self.request.GET.copy()
+            query_dict.pop('executor', None)
+            executions, _, _ = execuition_queryset_filter(self.request.user, query_dict)
+            context['executions'] = defaultdict(list)
+            for execution in executions.select_related('subtask'):
+                context['executions'][execution.executor_id].append(execution)
+        return context
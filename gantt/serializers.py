@@ -3,6 +3,7 @@ from drf_dynamic_fields import DynamicFieldsMixin
 
 from planner.models import Task, Employee, Execution
 from planner.filters import execuition_queryset_filter
+from planner.timeplanning import TimePlanner
 
 
 class TaskSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
@@ -30,9 +31,15 @@ class TaskSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
         ]
 
     def get_planned_duration(self, instance):
+        # use shared timeplanner of executor if given in context
+        timeplanner = self.context.get('timeplanner')
+        if timeplanner and instance.planned_start and instance.planned_finish:
+            planned_duration = timeplanner.calc_businesshrsdiff(instance.planned_start, instance.planned_finish)
+        else:
+            planned_duration = instance.planned_duration
         # convert planned_duration to hours, minutes
-        if instance.planned_duration:
-            min, sec = divmod(instance.planned_duration.total_seconds(), 60)
+        if planned_duration:
+            min, sec = divmod(planned_duration.total_seconds(), 60)
             hour, min = divmod(min, 60)
             return f'{int(hour)} год {int(min)} хв'
 
@@ -77,9 +84,13 @@ class EmployeeSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
         ]
 
     def get_tasks(self, instance):
-        # get tasks for employee using request data
-        request_user = self.context['request'].user
-        query_dict = self.context['request'].GET.copy()
-        query_dict['executor'] = instance.pk
-        executor_tasks, _, _ = execuition_queryset_filter(request_user, query_dict)
-        return TaskSerializer(executor_tasks, many=True).data
+        # get tasks for employee from executions partitioned by view or using request data
+        if 'executions' in self.context:
+            executor_tasks = self.context['executions'].get(instance.pk, [])
+        else:
+            request_user = self.context['request'].user
+            query_dict = self.context['request'].GET.copy()
+            query_dict['executor'] = instance.pk
+            executor_tasks, _, _ = execuition_queryset_filter(request_user, query_dict)
+        # one calendar of employee for durations of all tasks
+        return TaskSerializer(executor_tasks, many=True, context={'timeplanner': TimePlanner(instance)}).data
@@ -41,36 +41,37 @@ class GetPlan(TemplateView):
         context = super().get_context_data(*args, **kwargs)
         # get subtasks_queryset_filter
         subtasks, actual_start, end_date = execuition_queryset_filter(self.request.user, self.request.GET)
-        projects = subtasks.values_list('task', flat=True)
-        # distinct values
-        projects = list(set(projects))
         # prepare dictionary
         gantt_data = {"view_mode": "project_view",
                       "start_date": str(actual_start),
                       "end_date": str(end_date),
                       "projects": []}
-        for index, project_id in enumerate(projects):
-            project = Task.objects.get(pk=project_id)
-
-            # add project to the dictionary
-            gantt_data["projects"].append({"pk": project.pk,
-                                           "object_code": project.object_code,
-                                           "owner": project.owner.name,
-                                           "exec_status": project.exec_status,
-                                           "planned_start": str(project.planned_start),
-                                           "planned_finish": str(project.planned_finish),
-                                           "tasks": []})
-            tasks = subtasks.filter(task=project)
-            # add tasks to the project
-            for task in tasks:
-                gantt_data["projects"][index]["tasks"].append({"pk": task.pk,
-                                                               "executor": task.executor.name,
-                                                               "subtask": task.subtask.name,
-                                                               "exec_status": task.exec_status,
-                                                               "planned_start": str(task.planned_start),
-                                                               "planned_finish": str(task.planned_finish),
-                                                               "start_date": str(task.actual_start),
-                                                               "finish_date": str(task.actual_finish)})
+        # group filtered executions by projects in order of the first execution
+        projects = {}
+        for task in subtasks.values('pk', 'executor__name', 'subtask__name', 'exec_status',
+                                    'planned_start', 'planned_finish', 'actual_start', 'actual_finish',
+                                    'task', 'task__object_code', 'task__owner__name', 'task__exec_status',
+                                    'task__planned_start', 'task__planned_finish'):
+            project = projects.get(task['task'])
+            if project is None:
+                # add project to the dictionary
+                project = projects[task['task']] = {"pk": task['task'],
+                                                    "object_code": task['task__object_code'],
+                                                    "owner": task['task__owner__name'],
+                                                    "exec_status": task['task__exec_status'],
+                                                    "planned_start": str(task['task__planned_start']),
+                                                    "planned_finish": str(task['task__planned_finish']),
+                                                    "tasks": []}
+                gantt_data["projects"].append(project)
+            # add task to the project
+            project["tasks"].append({"pk": task['pk'],
+                                     "executor": task['executor__name'],
+                                     "subtask": task['subtask__name'],
+                                     "exec_status": task['exec_status'],
+                                     "planned_start": str(task['planned_start']),
+                                     "planned_finish": str(task['planned_finish']),
+                                     "start_date": str(task['actual_start']),
+                                     "finish_date": str(task['actual_finish'])})
         context['gantt_data'] = json.dumps(gantt_data)
         return context
 
@@ -7,6 +7,7 @@ from django.conf import settings
 from django.core.mail import EmailMessage, get_connection
 from django.template.loader import render_to_string
 from django.apps import apps
+from django.db.models import Q
 
 from planner.models import Employee, Deal, Task, Order
 from html_templates.context import context_bonus_per_month
@@ -138,7 +139,9 @@ def send_overdue_tasks_report():
     """Sending notifications about overdue tasks to owners and executors"""
 
     template_name = "overdue_tasks_report.html"
-    employees = Employee.objects.filter(user__is_active=True)
+    employees = Employee.objects.filter(user__is_active=True).with_workload() \
+                                .filter(Q(owner_overdue__gt=0) | Q(executions_overdue__gt=0) | Q(inttasks_overdue__gt=0)) \
+                                .select_related('user')
 
     # prepearing emails
     emails = []
@@ -167,7 +170,8 @@ def send_unsent_tasks_report():
     template_name = "unsent_tasks_report.html"
     project_managers = Employee.objects.filter(user__groups__name__in=['ГІПи'],
                                                user__is_active=True,
-                                               )
+                                               ) \
+                                       .with_workload().filter(owner_overdue__gt=0).select_related('user')
 
     # prepearing emails
     emails = []
@@ -0,0 +1,17 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('notice', '0004_auto_20220617_1802'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='comment',
+            index=models.Index(fields=['content_type', 'object_id', 'timestamp'], name='notice_comm_content_bb1d6c_idx'),
+        ),
+    ]
@@ -9,7 +9,7 @@ from crum import get_current_user
 
 from eventlog.models import log
 from messaging.tasks import send_comment_notification
-from planner.models import Task
+from planner.models import Task, Deal
 
 
 class Event(models.Model):
@@ -167,6 +167,7 @@ class Comment(models.Model):
         verbose_name = 'Коментар'
         verbose_name_plural = 'Коментарі'
         ordering = ["-timestamp"]
+        indexes = [models.Index(fields=['content_type', 'object_id', 'timestamp'])]
 
     def __str__(self):
         return f'{self.timestamp} - {self.user.employee.name}'
@@ -187,6 +188,7 @@ class Comment(models.Model):
                 obj=self,
                 )
         super().save(*args, **kwargs)
+        update_last_comment(self.content_type_id, self.object_id)
 
         # send email for executors
         send_comment_notification.delay(self.pk)
@@ -198,6 +200,27 @@ class Comment(models.Model):
             obj=self,
             )
         super().delete(*args, **kwargs)
+        update_last_comment(self.content_type_id, self.object_id)
+
+
+def get_comments(obj):
+    """ Return comments of given object """
+    content_type = ContentType.objects.get_for_model(obj)
+    return Comment.objects.filter(content_type=content_type, object_id=obj.pk)
+
+
+def update_last_comment(content_type_id, object_id):
+    """ Store latest comment text and time on commented task or deal """
+    model = ContentType.objects.get_for_id(content_type_id).model_class()
+    if model not in (Task, Deal):
+        return
+    last_comment = Comment.objects.filter(content_type_id=content_type_id, object_id=object_id) \
+                                  .order_by('-timestamp', '-pk') \
+                                  .values('text', 'timestamp').first()
+    model.objects.filter(pk=object_id).update(
+        last_comment_text=last_comment['text'] if last_comment else '',
+        last_comment_at=last_comment['timestamp'] if last_comment else None
+    )
 
 
 def create_comment(user, obj, text):
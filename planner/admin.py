@@ -74,7 +74,7 @@ class EmployeeAdmin(admin.ModelAdmin):
     inlines = [VacationsInline]
 
     def get_queryset(self, request):
-        qs = super(EmployeeAdmin, self).get_queryset(request)
+        qs = super(EmployeeAdmin, self).get_queryset(request).with_workload()
         if request.user.is_superuser or request.user.groups.filter(name__in=['Бухгалтери', 'Секретарі']).exists():
             return qs.filter(user__is_active=True)
         return qs.filter(Q(user=request.user) | Q(head__user=request.user), user__is_active=True).distinct()
@@ -113,6 +113,9 @@ class CustomerAdmin(admin.ModelAdmin):
             return self.readonly_fields
         return [f.name for f in self.model._meta.fields]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_financials()
+
 
 class IgnoreEDRPOUInline(admin.TabularInline):
     model = IgnoreEDRPOU
@@ -125,7 +128,7 @@ class CompanyAdmin(admin.ModelAdmin):
     fieldsets = [
         (None, {'fields': [('name', 'full_name'),
                            'chief',
-                           ('taxation'),
+                           ('taxation', 'bonus_kpi'),
                            ('signatory_person', 'signatory_position'),
                            ('regulations', 'city'),
                            ('requisites'),
@@ -141,6 +144,9 @@ class CompanyAdmin(admin.ModelAdmin):
             return self.readonly_fields
         return [f.name for f in self.model._meta.fields]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_summary()
+
 
 class ContractorOrdersInlineFormSet(BaseInlineFormSet):
 
@@ -210,6 +216,9 @@ class ContractorAdmin(admin.ModelAdmin):
     ]
     inlines = [ContractorOrdersInline]
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_payables()
+
 
 class ReceiverAdmin(admin.ModelAdmin):
     list_display = ['name', 'address', 'contact_person', 'phone']
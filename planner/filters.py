@@ -1,7 +1,105 @@
 from datetime import datetime, date, timedelta
 from django.db.models import Q
 
-from .models import Deal, Employee, Task, Execution, Order
+from .models import Deal, Employee, Task, Execution, Order, search_documents
+
+
+class FilterSpec:
+    """
+    Declarative filter of a list queryset by get parameters
+    lists - {parameter: lookup}, every parameters list is compiled to single __in lookup
+    search - lookups which should contain every word of search_string ('filter' get parameter)
+    documents - {lookup: model}, search words are also looked up in search documents of model
+    dates - {parameter: lookup}, dates in '%Y-%m-%d' format
+    """
+
+    def __init__(self, lists, search=(), documents=None, dates=None):
+        self.lists = lists
+        self.search = search
+        self.documents = documents or {}
+        self.dates = dates or {}
+
+    def query(self, query_dict):
+        """ Return Q object for given get parameters """
+        query = Q()
+        words = query_dict.get('filter', '').split()
+        if words and not self.search and len(self.documents) == 1:
+            # look up all words in one scan of search documents
+            (lookup, model), = self.documents.items()
+            query &= Q(**{f'{lookup}__in': search_documents(model, *words)})
+        else:
+            for word in words:
+                word_query = Q()
+                for lookup in self.search:
+                    word_query |= Q(**{f'{lookup}__icontains': word})
+                for lookup, model in self.documents.items():
+                    word_query |= Q(**{f'{lookup}__in': search_documents(model, word)})
+                query &= word_query
+        for parameter, lookup in self.lists.items():
+            values = list(filter(None, query_dict.getlist(parameter)))
+            if values:
+                query &= Q(**{f'{lookup}__in': values})
+        for parameter, lookup in self.dates.items():
+            value = query_dict.get(parameter)
+            if value:
+                query &= Q(**{lookup: datetime.strptime(value, '%Y-%m-%d')})
+        return query
+
+    def filter(self, queryset, query_dict):
+        return queryset.filter(self.query(query_dict))
+
+    def sql(self, queryset, query_dict):
+        """ Return SQL of filtered queryset """
+        return str(self.filter(queryset, query_dict).query)
+
+    def union_filter(self, queryset, query_dict):
+        """ Filter queryset by OR-ing one queryset per value of every parameters list as list filters did before,
+        kept to compare results and speed in tests and benchmark_filters command """
+        queryset = FilterSpec({}, self.search, self.documents, self.dates).filter(queryset, query_dict)
+        for parameter, lookup in self.lists.items():
+            values = list(filter(None, query_dict.getlist(parameter)))
+            if values:
+                union = queryset.none()
+                for value in values:
+                    union = union | queryset.filter(**{lookup: value})
+                queryset = union
+        return queryset
+
+
+DEAL_FILTER = FilterSpec(lists={'customer': 'customer',
+                                'company': 'company',
+                                'act_status': 'act_status',
+                                'pay_status': 'pay_status',
+                                'exec_status': 'exec_status'},
+                         documents={'pk': Deal},
+                         dates={'start_date': 'date__gte',
+                                'end_date': 'date__lte'})
+
+TASK_FILTER = FilterSpec(lists={'exec_status': 'exec_status',
+                                'owner': 'owner',
+                                'customer': 'deal__customer',
+                                'construction': 'construction',
+                                'work_type': 'work_type'},
+                         documents={'pk': Task})
+
+EXECUTION_FILTER = FilterSpec(lists={'exec_status': 'exec_status',
+                                     'work_type': 'task__work_type',
+                                     'owner': 'task__owner',
+                                     'executor': 'executor',
+                                     'company': 'task__deal__company'},
+                              search=('subtask__name',),
+                              documents={'task': Task})
+
+ORDER_FILTER = FilterSpec(lists={'contractor': 'contractor',
+                                 'company': 'company',
+                                 'pay_status': 'pay_status',
+                                 'exec_status': 'task__exec_status',
+                                 'pay_type': 'pay_type',
+                                 'owner': 'task__owner',
+                                 'cost_type': 'cost_type'},
+                          documents={'pk': Order},
+                          dates={'start_date': 'pay_date__gte',
+                                 'end_date': 'pay_date__lte'})
 
 
 def deal_queryset_filter(request_user, query_dict):
@@ -16,15 +114,7 @@ def deal_queryset_filter(request_user, query_dict):
     Filter queryset by specific_status ('specific_status' get parameters list)
     Order queryset by any given field ('o' get parameter)
     """
-    search_string = query_dict.get('filter')
-    customers = query_dict.getlist('customer')
-    companies = query_dict.getlist('company')
-    act_statuses = query_dict.getlist('act_status')
-    pay_statuses = query_dict.getlist('pay_status')
-    exec_statuses = query_dict.getlist('exec_status')
     specific_status = query_dict.get('specific_status')
-    start_date = query_dict.get('start_date')
-    end_date = query_dict.get('end_date')
     order = query_dict.get('o')
 
     deals = Deal.objects.select_related('customer', 'company')
@@ -39,47 +129,7 @@ def deal_queryset_filter(request_user, query_dict):
     if specific_status == 'RE':
         deals = deals.receivables()
 
-    if search_string:
-        for word in search_string.split():
-            deals = deals.filter(Q(number__icontains=word) |
-                                 Q(value__icontains=word))
-
-    if customers:
-        deals_union = Deal.objects.none()
-        for customer in customers:
-            deals_part = deals.filter(customer=customer)
-            deals_union = deals_union | deals_part
-        deals = deals_union
-    if companies:
-        deals_union = Deal.objects.none()
-        for company in companies:
-            deals_part = deals.filter(company=company)
-            deals_union = deals_union | deals_part
-        deals = deals_union
-    if act_statuses:
-        deals_union = Deal.objects.none()
-        for act_status in act_statuses:
-            deals_part = deals.filter(act_status=act_status)
-            deals_union = deals_union | deals_part
-        deals = deals_union
-    if pay_statuses:
-        deals_union = Deal.objects.none()
-        for pay_status in pay_statuses:
-            deals_part = deals.filter(pay_status=pay_status)
-            deals_union = deals_union | deals_part
-        deals = deals_union
-    if exec_statuses:
-        deals_union = Deal.objects.none()
-        for exec_status in exec_statuses:
-            deals_part = deals.filter(exec_status=exec_status)
-            deals_union = deals_union | deals_part
-        deals = deals_union
-    if start_date:
-        start_value = datetime.strptime(start_date, '%Y-%m-%d')
-        deals = deals.filter(date__gte=start_value)
-    if end_date:
-        finish_value = datetime.strptime(end_date, '%Y-%m-%d')
-        deals = deals.filter(date__lte=finish_value)
+    deals = DEAL_FILTER.filter(deals, query_dict)
     if order:
         deals = deals.order_by(order)
     return deals
@@ -97,12 +147,6 @@ def task_queryset_filter(request_user, query_dict):
     Order queryset by any given field ('o' get parameter)
     """
 
-    search_string = query_dict.get('filter', '').split()
-    exec_statuses = list(filter(None, query_dict.getlist('exec_status')))
-    owners = list(filter(None, query_dict.getlist('owner')))
-    customers = list(filter(None, query_dict.getlist('customer')))
-    constructions = list(filter(None, query_dict.getlist('construction')))
-    work_types = list(filter(None, query_dict.getlist('work_type')))
     period_month = query_dict.get('period_month')
     period_year = query_dict.get('period_year')
     order = query_dict.get('o')
@@ -111,42 +155,7 @@ def task_queryset_filter(request_user, query_dict):
     # filter only customer tasks
     if request_user.groups.filter(name='Замовники').exists():
         tasks = tasks.filter(deal__customer__user=request_user)
-    for word in search_string:
-        tasks = tasks.filter(Q(object_code__icontains=word) |
-                                Q(object_address__icontains=word) |
-                                Q(deal__number__icontains=word) |
-                                Q(project_type__price_code__icontains=word) |
-                                Q(project_type__project_type__icontains=word))
-    if exec_statuses:
-        tasks_union = Task.objects.none()
-        for status in exec_statuses:
-            tasks_segment = tasks.filter(exec_status=status)
-            tasks_union = tasks_union | tasks_segment
-        tasks = tasks_union
-    if owners:
-        tasks_union = Task.objects.none()
-        for owner in owners:
-            tasks_segment = tasks.filter(owner=owner)
-            tasks_union = tasks_union | tasks_segment
-        tasks = tasks_union
-    if customers:
-        tasks_union = Task.objects.none()
-        for customer in customers:
-            tasks_segment = tasks.filter(deal__customer=customer)
-            tasks_union = tasks_union | tasks_segment
-        tasks = tasks_union
-    if constructions:
-        tasks_union = Task.objects.none()
-        for construction in constructions:
-            tasks_segment = tasks.filter(construction=construction)
-            tasks_union = tasks_union | tasks_segment
-        tasks = tasks_union
-    if work_types:
-        tasks_union = Task.objects.none()
-        for work_type in work_types:
-            tasks_part = tasks.filter(work_type=work_type)
-            tasks_union = tasks_union | tasks_part
-        tasks = tasks_union
+    tasks = TASK_FILTER.filter(tasks, query_dict)
     if period_month and period_month != '0':
         tasks = tasks.filter(period__month=period_month)
     if period_year and period_year != '0':
@@ -163,23 +172,17 @@ def execuition_queryset_filter(request_user, query_dict):
     Filter for the Execution class
     Filter queryset by exec_statuses ('exec_status' get parameters list)
     Filter queryset by work_types ('work_type' get parameters list)
-    Filter queryset by owner ('owner' get parameter)
-    Filter queryset by executor ('executor' get parameter)
-    Filter queryset by company ('company' get parameter)
+    Filter queryset by owners ('owner' get parameters list)
+    Filter queryset by executors ('executor' get parameters list)
+    Filter queryset by companies ('company' get parameters list)
     Filter queryset by planned_start ('planned_start' get parameter)
     Filter queryset by planned_finish ('planned_finish' get parameter)
     Filter queryset by search_string ('filter' get parameter)
     Order queryset by any given field ('o' get parameter)
     """
 
-    exec_statuses = list(filter(None, query_dict.getlist('exec_status')))
-    work_types = list(filter(None, query_dict.getlist('work_type')))
-    owner = query_dict.get('owner')
-    executor = query_dict.get('executor')
-    company = query_dict.get('company')
     planned_start = query_dict.get('actual_start')
     planned_finish = query_dict.get('actual_finish')
-    search_string = query_dict.get('filter', '').split()
     order = query_dict.get('o')
 
     # create qs tasks
@@ -198,24 +201,7 @@ def execuition_queryset_filter(request_user, query_dict):
             query |= Q(executor=request_user.employee)
         executions = executions.filter(query)
 
-    if exec_statuses:
-        tasks_union = Execution.objects.none()
-        for status in exec_statuses:
-            tasks_part = executions.filter(exec_status=status)
-            tasks_union = tasks_union | tasks_part
-        executions = tasks_union
-    if work_types:
-        tasks_union = Execution.objects.none()
-        for work_type in work_types:
-            tasks_part = executions.filter(task__work_type=work_type)
-            tasks_union = tasks_union | tasks_part
-        executions = tasks_union
-    if owner:
-        executions = executions.filter(task__owner=owner)
-    if executor:
-        executions = executions.filter(executor=executor)
-    if company:
-        executions = executions.filter(task__deal__company=company)
+    executions = EXECUTION_FILTER.filter(executions, query_dict)
     if planned_start:
         planned_start_value = datetime.strptime(planned_start, '%Y-%m-%d')
     else:
@@ -232,12 +218,6 @@ def execuition_queryset_filter(request_user, query_dict):
                            exec_status__in=[Execution.ToDo, Execution.InProgress, Execution.OnChecking, Execution.OnCorrection])
                          ) \
                  .exclude(task__exec_status__in=[Task.OnHold, Task.Canceled])
-    for word in search_string:
-        executions = executions.filter(Q(subtask__name__icontains=word) |
-                             Q(task__object_code__icontains=word) |
-                             Q(task__project_type__project_type__icontains=word) |
-                             Q(task__object_address__icontains=word) |
-                             Q(task__deal__number__icontains=word))
     if order:
         executions = executions.order_by(order, 'planned_start')
     else:
@@ -268,16 +248,6 @@ def order_queryset_filter(request_user, query_dict):
     Order queryset by any given field ('o' get parameter)
     """
 
-    search_string = query_dict.get('filter', '').split()
-    contractors = list(filter(None, query_dict.getlist('contractor')))
-    companies = list(filter(None, query_dict.getlist('company')))
-    pay_statuses = list(filter(None, query_dict.getlist('pay_status')))
-    exec_statuses = list(filter(None, query_dict.getlist('exec_status')))
-    pay_types = list(filter(None, query_dict.getlist('pay_type')))
-    owners = list(filter(None, query_dict.getlist('owner')))
-    cost_types = list(filter(None, query_dict.getlist('cost_type')))
-    start_date = query_dict.get('start_date')
-    end_date = query_dict.get('end_date')
     order = query_dict.get('o')
 
     orders = Order.objects.all().select_related('contractor', 'task', 'subtask')
@@ -287,61 +257,7 @@ def order_queryset_filter(request_user, query_dict):
         and request_user.groups.filter(name='ГІПи').exists():
             orders = orders.filter(task__owner__user=request_user)
 
-    for word in search_string:
-        orders = orders.filter(Q(contractor__name__icontains=word) |
-                               Q(task__object_code__icontains=word) |
-                               Q(subtask__name__icontains=word) |
-                               Q(purpose__icontains=word) |
-                               Q(deal_number__icontains=word)
-                               )
-    if contractors:
-        orders_union = Order.objects.none()
-        for contractor in contractors:
-            orders_segment = orders.filter(contractor=contractor)
-            orders_union = orders_union | orders_segment
-        orders = orders_union
-    if companies:
-        orders_union = Order.objects.none()
-        for company in companies:
-            orders_segment = orders.filter(company=company)
-            orders_union = orders_union | orders_segment
-        orders = orders_union
-    if pay_statuses:
-        orders_union = Order.objects.none()
-        for status in pay_statuses:
-            orders_segment = orders.filter(pay_status=status)
-            orders_union = orders_union | orders_segment
-        orders = orders_union
-    if exec_statuses:
-        orders_union = Order.objects.none()
-        for status in exec_statuses:
-            orders_segment = orders.filter(task__exec_status=status)
-            orders_union = orders_union | orders_segment
-        orders = orders_union
-    if pay_types:
-        orders_union = Order.objects.none()
-        for pay_type in pay_types:
-            orders_segment = orders.filter(pay_type=pay_type)
-            orders_union = orders_union | orders_segment
-        orders = orders_union
-    if owners:
-        orders_union = Order.objects.none()
-        for owner in owners:
-            orders_segment = orders.filter(task__owner=owner)
-            orders_union = orders_union | orders_segment
-        orders = orders_union
-    if cost_types:
-        orders_union = Order.objects.none()
-        for cost_type in cost_types:
-            orders_segment = orders.filter(cost_type=cost_type)
-            orders_union = orders_union | orders_segment
-        orders = orders_union
-    if start_date:
-        start_value = datetime.strptime(start_date, '%Y-%m-%d')
-        orders = orders.filter(pay_date__gte=start_value)
-    if end_date:
-        finish_value = datetime.strptime(end_date, '%Y-%m-%d')
-        orders = orders.filter(pay_date__lte=finish_value)
+    orders = ORDER_FILTER.filter(orders, query_dict)
     if order:
         orders = orders.order_by(order)
     else:
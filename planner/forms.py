@@ -926,7 +926,7 @@ class CompanyFilterForm(forms.Form):
 class CompanyForm(forms.ModelForm):
     class Meta:
         model = Company
-        fields = ['name', 'full_name', 'edrpou', 'chief', 'accountant', 'taxation',
+        fields = ['name', 'full_name', 'edrpou', 'chief', 'accountant', 'taxation', 'bonus_kpi',
                   'city', 'legal_description', 'legal', 'regulations',
                   'signatory_person', 'signatory_position',
                   'requisites', 'bank_requisites', 'active',
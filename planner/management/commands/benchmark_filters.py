@@ -0,0 +1,64 @@
+from time import perf_counter
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.http import QueryDict
+
+from planner.filters import DEAL_FILTER, TASK_FILTER, EXECUTION_FILTER, ORDER_FILTER
+from planner.models import Deal, Task, Execution, Order
+
+SPECS = {'deal': (DEAL_FILTER, Deal),
+         'task': (TASK_FILTER, Task),
+         'execution': (EXECUTION_FILTER, Execution),
+         'order': (ORDER_FILTER, Order)}
+
+
+class Command(BaseCommand):
+    help = 'Compare list filters compiled to single __in lookups with the former union of one queryset per value. ' \
+           'Every parameters list of filter gets the most used values of its field'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filters', nargs='*', help='Filters to benchmark (%s), all if not given' % ', '.join(SPECS))
+        parser.add_argument('--values', type=int, default=5, help='Values in every parameters list')
+        parser.add_argument('--search', default='', help='Search string (filter get parameter)')
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of every query, the best one is reported')
+
+    def handle(self, *args, **options):
+        unknown = set(options['filters']) - set(SPECS)
+        if unknown:
+            raise CommandError('Unknown filters: %s' % ', '.join(sorted(unknown)))
+
+        for name in options['filters'] or SPECS:
+            spec, model = SPECS[name]
+            query_dict = self.query_dict(spec, model, options['values'], options['search'])
+            results = {}
+            for method in ('filter', 'union_filter'):
+                queryset = getattr(spec, method)(model.objects.all(), query_dict)
+                seconds = min(self.run(queryset) for _ in range(options['repeat']))
+                results[method] = set(queryset.values_list('pk', flat=True))
+                self.stdout.write('%s %s: %s rows, %.1f ms, %s chars of SQL'
+                                  % (name, method, len(results[method]), seconds * 1000, len(str(queryset.query))))
+            if results['filter'] == results['union_filter']:
+                self.stdout.write(self.style.SUCCESS('%s: results match' % name))
+            else:
+                self.stdout.write(self.style.ERROR('%s: results differ in %s rows'
+                                                   % (name, len(results['filter'] ^ results['union_filter']))))
+
+    @staticmethod
+    def query_dict(spec, model, values, search):
+        """ get parameters with the most used values of every parameters list """
+        query_dict = QueryDict(mutable=True)
+        for parameter, lookup in spec.lists.items():
+            most_used = model.objects.exclude(**{lookup + '__isnull': True}) \
+                                     .order_by().values(lookup).annotate(count=Count('pk')) \
+                                     .order_by('-count').values_list(lookup, flat=True)[:values]
+            query_dict.setlist(parameter, [str(value) for value in most_used])
+        if search:
+            query_dict['filter'] = search
+        return query_dict
+
+    @staticmethod
+    def run(queryset):
+        """ seconds to evaluate a fresh copy of queryset """
+        start = perf_counter()
+        list(queryset.all().values_list('pk', flat=True))
+        return perf_counter() - start
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from planner.models import Deal
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify rollup fields of deals (acts_total, paid_total, costs_total, bonuses_total)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('deal_ids', nargs='*', type=int, help='Deals to process, all deals if not given')
+        parser.add_argument('--verify', action='store_true', help='Only report deals with wrong rollups')
+
+    def handle(self, *args, **options):
+        deals = Deal.objects.order_by('pk')
+        if options['deal_ids']:
+            deals = deals.filter(pk__in=options['deal_ids'])
+
+        mismatches = 0
+        for deal in deals.iterator():
+            rollups = deal.rollups_calc()
+            diff = {field: (getattr(deal, field), value) for field, value in rollups.items()
+                    if getattr(deal, field) != value}
+            if not diff:
+                continue
+            mismatches += 1
+            self.stdout.write('%s (id %s): %s' % (deal.number, deal.pk, ', '.join(
+                '%s %s -> %s' % (field, *values) for field, values in diff.items())))
+            if not options['verify']:
+                Deal.objects.filter(pk=deal.pk).update(**rollups)
+
+        if options['verify']:
+            self.stdout.write('Deals with wrong rollups: %s' % mismatches)
+        else:
+            self.stdout.write(self.style.SUCCESS('Rollups rebuilt for %s deals' % mismatches))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from planner.models import Deal, Task, Order, update_search_documents
+
+
+class Command(BaseCommand):
+    help = 'Rebuild search documents of deals, tasks and orders'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch', type=int, default=1000, help='Objects per batch')
+
+    def handle(self, *args, **options):
+        for model in (Deal, Task, Order):
+            ids = list(model.objects.order_by('pk').values_list('pk', flat=True))
+            for start in range(0, len(ids), options['batch']):
+                update_search_documents(model, ids[start:start + options['batch']])
+            self.stdout.write('%s: %s documents' % (model._meta.verbose_name_plural, len(ids)))
+        self.stdout.write(self.style.SUCCESS('Search documents rebuilt'))
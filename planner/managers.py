@@ -1,14 +1,133 @@
 from datetime import date
-from django.db.models import QuerySet, Sum, F, Max, Func, DateField, DecimalField
-from django.db.models.functions import Coalesce
+from django.apps import apps
+from django.db.models import QuerySet, Sum, Count, Q, F, Max, Func, DateField, DecimalField, OuterRef, Subquery, \
+                             Case, When, Value
+from django.db.models.functions import Coalesce, Least
 
 
 class MysqlAddDate(Func):
     function = 'ADDDATE'
     output_field = DateField()
 
+def overdue_tasks_q():
+    """ condition for overdue tasks: not finished and deal or planned finish date has expired """
+    return ~Q(exec_status__in=['HD', 'ST', 'OH', 'CL']) & \
+        (Q(deal__expire_date__lt=date.today()) | Q(planned_finish__lt=date.today()))
+
+
+def overdue_executions_q():
+    """ condition for overdue executions: not done and without planned finish or it has expired """
+    return ~Q(exec_status__in=['HD', 'OC']) & ~Q(planned_finish__gte=date.today())
+
+
+def overdue_inttasks_q():
+    """ condition for overdue inttasks: not done and without planned finish or it has expired """
+    return ~Q(exec_status='HD') & ~Q(planned_finish__gte=date.today())
+
+
+class EmployeeQuerySet(QuerySet):
+
+    WORKLOAD = ['owner_active', 'owner_overdue', 'executor_active', 'executor_overdue',
+                'executions_active', 'executions_overdue', 'inttasks_active', 'inttasks_overdue']
+
+    def with_workload(self):
+        """ annotate employees with counts of active and overdue tasks, executions and inttasks """
+        def employee_count(model_name, employee_field, condition):
+            objects = apps.get_model('planner', model_name).objects \
+                          .filter(**{employee_field: OuterRef('pk')}).order_by()
+            total = objects.values(employee_field) \
+                           .annotate(total=Count('pk', filter=condition, distinct=True)).values('total')
+            return Coalesce(Subquery(total), 0)
+
+        return  self.annotate(owner_active=employee_count('Task', 'owner', ~Q(exec_status='ST')),
+                              owner_overdue=employee_count('Task', 'owner', overdue_tasks_q()),
+                              executor_active=employee_count('Task', 'execution__executor', ~Q(exec_status='ST')),
+                              executor_overdue=employee_count('Task', 'execution__executor', overdue_tasks_q()),
+                              executions_active=employee_count('Execution', 'executor', ~Q(exec_status='HD')),
+                              executions_overdue=employee_count('Execution', 'executor', overdue_executions_q()),
+                              inttasks_active=employee_count('IntTask', 'executor', ~Q(exec_status='HD')),
+                              inttasks_overdue=employee_count('IntTask', 'executor', overdue_inttasks_q()))
+
+
+class CustomerQuerySet(QuerySet):
+
+    FINANCIALS = ['debit', 'credit', 'completed', 'expect']
+
+    def with_financials(self):
+        """ annotate customers with debit, credit, completed and expect sums of their deals """
+        def deals_sum(expression, condition):
+            deals = apps.get_model('planner', 'Deal').objects.filter(condition, customer=OuterRef('pk')) \
+                                                             .exclude(exec_status='CL').order_by()
+            total = deals.values('customer').annotate(total=Sum(expression)).values('total')
+            return Coalesce(Subquery(total), 0, output_field=DecimalField())
+
+        return  self.annotate(debit=deals_sum(F('acts_total') - F('paid_total'),
+                                              ~Q(pay_status='PU') & Q(acts_total__gt=F('paid_total'))),
+                              credit=deals_sum(F('paid_total') - F('acts_total'),
+                                               ~Q(pay_status='NP') & Q(acts_total__lt=F('paid_total'))),
+                              completed=deals_sum(Least('acts_total', 'paid_total'),
+                                                  Q(expire_date__year=date.today().year) &
+                                                  (~Q(pay_status='NP') | ~Q(act_status='NI'))),
+                              expect=deals_sum(F('value') - F('paid_total'),
+                                               Q(pay_status='NP', act_status='NI')))
+
+
+class CompanyQuerySet(QuerySet):
+
+    SUMMARY = ['turnover', 'costs', 'bonuses']
+
+    def with_summary(self, year=None):
+        """ annotate companies with turnover, costs and bonuses of their deals for the year """
+        def deals_sum(field):
+            deals = apps.get_model('planner', 'Deal').objects \
+                        .filter(company=OuterRef('pk'), date__year=year or date.today().year).order_by()
+            total = deals.values('company').annotate(total=Sum(field)).values('total')
+            return Coalesce(Subquery(total), 0, output_field=DecimalField())
+
+        return  self.annotate(turnover=deals_sum('acts_total'),
+                              costs=deals_sum('costs_total'),
+                              bonuses=deals_sum('bonuses_total'))
+
+
+class ContractorQuerySet(QuerySet):
+
+    PAYABLES = ['advance', 'credit', 'expect', 'completed']
+
+    def with_payables(self):
+        """ annotate contractors with advance, credit, expect and completed sums of their orders """
+        def orders_sum(condition, **by_pay_status):
+            whens = [When(condition & Q(order__pay_status=pay_status), then=expression)
+                     for pay_status, expression in by_pay_status.items()]
+            return Sum(Case(*whens, default=Value(0), output_field=DecimalField()))
+
+        value, advance = F('order__value'), F('order__advance')
+        done = Q(order__task__exec_status__in=['HD', 'ST'])
+        return  self.annotate(advance=orders_sum(~Q(order__task__exec_status__in=['HD', 'ST', 'CL']),
+                                                 AP=advance, PU=value),
+                              credit=orders_sum(done, NP=value, AP=value - advance),
+                              expect=orders_sum(~done, NP=value, AP=value - advance),
+                              completed=orders_sum(done & Q(order__pay_date__year=date.today().year),
+                                                   AP=advance, PU=value))
+
+
 class DealQuerySet(QuerySet):
 
+    def with_rollups(self):
+        """ annotate deals with tasks, acts and payments aggregates used for statuses calculation """
+        def deal_aggregate(model_name, aggregate):
+            queryset = apps.get_model('planner', model_name).objects.filter(deal=OuterRef('pk')).order_by()
+            return Subquery(queryset.values('deal').annotate(total=aggregate).values('total'))
+
+        tasks_by_status = {'tasks_%s' % status: Count('task', filter=Q(task__exec_status=status))
+                           for status in ('IW', 'IP', 'HD', 'ST', 'CL')}
+        return  self.annotate(tasks_count=Count('task'),
+                              acts_sum=deal_aggregate('ActOfAcceptance', Sum('value')),
+                              last_act_date=deal_aggregate('ActOfAcceptance', Max('date')),
+                              payments_sum=deal_aggregate('Payment', Sum('value')),
+                              debtor_term=F('customer__debtor_term'),
+                              taxation=F('company__taxation'),
+                              **tasks_by_status)
+
     def active_deals(self):
         return  self.exclude(exec_status='CL') \
                     .exclude(act_status='IS') \
@@ -37,22 +156,26 @@ class DealQuerySet(QuerySet):
         return  self.exclude(act_status='NI') \
                     .exclude(pay_status__in=['PU', 'AP']) \
                     .exclude(exec_status='CL') \
-                    .annotate(acts_total=Coalesce(Sum('actofacceptance__value'), 0, output_field=DecimalField()),
-                              paid_total=Coalesce(Sum('payment__value'), 0, output_field=DecimalField())) \
                     .annotate(debt=F('acts_total')-F('paid_total')) \
                     .order_by('expire_date')
 
 
 class ActQuerySet(QuerySet):
 
-    def receivables(self):
+    def in_receivables(self):
         return  self.exclude(deal__act_status='NI') \
-                    .exclude(deal__pay_status='AP') \
+                    .exclude(deal__pay_status='AP')
+
+    def receivables(self):
+        return  self.in_receivables() \
                     .annotate(acts_total=Coalesce(Sum('deal__actofacceptance__value'), 0, output_field=DecimalField()))
 
 
 class PaymentQuerySet(QuerySet):
 
+    def in_receivables(self):
+        return  self.exclude(deal__pay_status__in=['NP', 'AP'])
+
     def receivables(self):
-        return  self.exclude(deal__pay_status__in=['NP', 'AP']) \
+        return  self.in_receivables() \
                     .annotate(paid_total=Coalesce(Sum('deal__payment__value'), 0, output_field=DecimalField()))
@@ -0,0 +1,98 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+from collections import defaultdict
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Sum, DecimalField
+from django.db.models.functions import Coalesce
+
+
+def deals_bonuses(apps):
+    """ Return dict {deal_id: bonuses} with the same arithmetic as Deal.bonuses_calc() """
+    Task = apps.get_model('planner', 'Task')
+    Execution = apps.get_model('planner', 'Execution')
+    Order = apps.get_model('planner', 'Order')
+
+    exec_parts = dict(Execution.objects.filter(executor__isnull=False).order_by()
+                      .values('task').annotate(total=Sum('part')).values_list('task', 'total'))
+    costs = dict(Order.objects.filter(task__isnull=False).order_by()
+                 .values('task').annotate(total=Sum('value')).values_list('task', 'total'))
+    bonuses = defaultdict(Decimal)
+
+    # executors bonuses as Execution.bonus()
+    executions = Execution.objects.exclude(executor__user__username__startswith='outsourcing') \
+                                  .values_list('task__deal', 'part', 'difficulty', 'task__difficulty_executor',
+                                               'task__project_type__price', 'task__project_type__net_price_rate',
+                                               'task__project_type__executors_bonus')
+    for deal, part, difficulty, difficulty_executor, price, net_price_rate, executors_bonus in executions.iterator():
+        net_price = round(price * net_price_rate / 100, 2)
+        bonus = net_price * executors_bonus * part / 10000 * difficulty_executor * difficulty
+        bonuses[deal] += bonus.quantize(Decimal("1.00"), ROUND_HALF_UP)
+
+    # owners bonuses as Task.owner_bonus()
+    tasks = Task.objects.values_list('pk', 'deal', 'difficulty_owner', 'project_type__price',
+                                     'project_type__net_price_rate', 'project_type__owner_bonus',
+                                     'project_type__executors_bonus', 'project_type__exclude_costs')
+    for task, deal, difficulty_owner, price, net_price_rate, owner_bonus, executors_bonus, exclude_costs \
+            in tasks.iterator():
+        owner_part = 0
+        if owner_bonus > 0:
+            exec_part = exec_parts.get(task) or 0
+            owner_part = int(100 + (100 - exec_part) * executors_bonus / owner_bonus) if exec_part > 100 else 100
+        net_price = round(price * net_price_rate / 100, 2)
+        if exclude_costs:
+            net_price -= costs.get(task) or 0
+        bonus = net_price * owner_part * owner_bonus / 10000 * difficulty_owner
+        if bonus > 0:
+            bonuses[deal] += bonus.quantize(Decimal("1.00"), ROUND_HALF_UP)
+    return bonuses
+
+
+def fill_rollups(apps, schema_editor):
+    """ Fill rollups of existing deals """
+    Deal = apps.get_model('planner', 'Deal')
+
+    def deal_sum(model_name, deal_field):
+        queryset = apps.get_model('planner', model_name).objects.filter(**{deal_field: OuterRef('pk')}).order_by()
+        total = queryset.values(deal_field).annotate(total=Sum('value')).values('total')
+        return Coalesce(Subquery(total), 0, output_field=DecimalField())
+
+    Deal.objects.update(acts_total=deal_sum('ActOfAcceptance', 'deal'),
+                        paid_total=deal_sum('Payment', 'deal'),
+                        costs_total=deal_sum('Order', 'task__deal'))
+
+    deals = []
+    for deal_id, bonuses in deals_bonuses(apps).items():
+        deals.append(Deal(pk=deal_id, bonuses_total=round(bonuses, 2)))
+    Deal.objects.bulk_update(deals, ['bonuses_total'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0101_project_exclude_costs'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deal',
+            name='acts_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Сума актів, грн.'),
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='bonuses_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Бонуси по договору, грн.'),
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='costs_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Витрати по договору, грн.'),
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='paid_total',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Сума оплат, грн.'),
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
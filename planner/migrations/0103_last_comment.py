@@ -0,0 +1,54 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def fill_last_comment(apps, schema_editor):
+    """ Fill latest comment of tasks and deals """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    Comment = apps.get_model('notice', 'Comment')
+
+    for model_name in ('task', 'deal'):
+        content_type = ContentType.objects.filter(app_label='planner', model=model_name).first()
+        if content_type is None:
+            continue
+        comments = Comment.objects.filter(content_type=content_type, object_id=OuterRef('pk')) \
+                                  .order_by('-timestamp', '-pk')
+        model = apps.get_model('planner', model_name)
+        model.objects.filter(pk__in=Comment.objects.filter(content_type=content_type).values('object_id')) \
+                     .update(last_comment_text=Subquery(comments.values('text')[:1]),
+                             last_comment_at=Subquery(comments.values('timestamp')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('notice', '0005_comment_index'),
+        ('planner', '0102_deal_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='deal',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата останнього коментаря'),
+        ),
+        migrations.AddField(
+            model_name='deal',
+            name='last_comment_text',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Останній коментар'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='last_comment_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Дата останнього коментаря'),
+        ),
+        migrations.AddField(
+            model_name='task',
+            name='last_comment_text',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Останній коментар'),
+        ),
+        migrations.RunPython(fill_last_comment, migrations.RunPython.noop),
+    ]
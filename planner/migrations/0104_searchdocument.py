@@ -0,0 +1,51 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+SEARCH_FIELDS = {
+    'deal': ['number', 'value'],
+    'task': ['object_code', 'object_address', 'deal__number', 'project_type__price_code', 'project_type__project_type'],
+    'order': ['contractor__name', 'task__object_code', 'subtask__name', 'purpose', 'deal_number'],
+}
+
+
+def fill_search_documents(apps, schema_editor):
+    """ Fill search documents of existing deals, tasks and orders """
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+    SearchDocument = apps.get_model('planner', 'SearchDocument')
+
+    for model_name, fields in SEARCH_FIELDS.items():
+        content_type, _ = ContentType.objects.get_or_create(app_label='planner', model=model_name)
+        rows = apps.get_model('planner', model_name).objects.values_list('pk', *fields).iterator()
+        SearchDocument.objects.bulk_create(
+            (SearchDocument(content_type=content_type, object_id=pk,
+                            text='\n'.join(str(value) for value in values if value is not None).lower())
+             for pk, *values in rows), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('planner', '0103_last_comment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', models.PositiveIntegerField()),
+                ('text', models.TextField(verbose_name='Текст для пошуку')),
+                ('content_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='contenttypes.contenttype')),
+            ],
+            options={
+                'verbose_name': 'Пошуковий документ',
+                'verbose_name_plural': 'Пошукові документи',
+                'unique_together': {('content_type', 'object_id')},
+            },
+        ),
+        migrations.RunPython(fill_search_documents, migrations.RunPython.noop),
+    ]
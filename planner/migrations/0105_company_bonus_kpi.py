@@ -0,0 +1,33 @@
+# Generated by Django 3.2.20 on 2026-10-19 00:01
+
+from django.db import migrations, models
+
+
+# bonus KPIs of companies before they were stored in Company.bonus_kpi
+COMPANIES_BONUS_KPIS = {
+    1: 'BI',
+    2: 'BG',
+    3: 'BS',
+}
+
+
+def fill_bonus_kpi(apps, schema_editor):
+    Company = apps.get_model('planner', 'Company')
+    for company_id, bonus_kpi in COMPANIES_BONUS_KPIS.items():
+        Company.objects.filter(pk=company_id).update(bonus_kpi=bonus_kpi)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('planner', '0104_searchdocument'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='bonus_kpi',
+            field=models.CharField(blank=True, choices=[('BI', 'Бонус Ітел-Cервіс'), ('BG', 'Бонус Галкомпроект'), ('BS', 'Бонус ФОП')], help_text='Показник, до якого зараховуються бонуси по договорах компанії', max_length=2, verbose_name='КПЕ бонусів'),
+        ),
+        migrations.RunPython(fill_bonus_kpi, migrations.RunPython.noop),
+    ]
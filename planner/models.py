@@ -1,15 +1,15 @@
 # -*- coding: utf-8 -*-
 from datetime import date, datetime, timedelta
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Sum, Max
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, pre_delete, post_delete
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.models import ContentType
 from django.utils.timezone import now
 from django.urls import reverse
 from django.core.validators import MaxValueValidator
 from django.conf.locale.uk import formats as uk_formats
 from django.dispatch import receiver
-from django.apps import apps
 from crum import get_current_user
 from decimal import Decimal, ROUND_HALF_UP
 
@@ -19,7 +19,8 @@ from html_templates.models import HTMLTemplate
 
 from .mixins import ModelDiffMixin
 from .formatChecker import ContentTypeRestrictedFileField
-from .managers import DealQuerySet, ActQuerySet, PaymentQuerySet
+from .managers import EmployeeQuerySet, CustomerQuerySet, CompanyQuerySet, ContractorQuerySet, DealQuerySet, \
+                      ActQuerySet, PaymentQuerySet, overdue_tasks_q, overdue_executions_q, overdue_inttasks_q
 from .timeplanning import TimePlanner
 
 
@@ -67,7 +68,7 @@ class WorkType(models.Model):
         return self.name
 
 
-class Employee(models.Model):
+class Employee(ModelDiffMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.PROTECT)
     name = models.CharField('ПІБ', max_length=30, unique=True)
     position = models.CharField('Посада', max_length=50)
@@ -86,6 +87,9 @@ class Employee(models.Model):
     card_number = models.CharField('Номер карти', max_length=19, blank=True)
     comment = models.TextField('Коментар', blank=True)
 
+    # defining custom manager
+    objects = EmployeeQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Працівник'
         verbose_name_plural = 'Працівники'
@@ -94,32 +98,32 @@ class Employee(models.Model):
     def __str__(self):
         return self.name
 
+    def workload(self):
+        """ Return employee with counts annotated by with_workload(), query them if not annotated """
+        if not hasattr(self, 'owner_active'):
+            values = Employee.objects.filter(pk=self.pk).with_workload() \
+                                     .values(*EmployeeQuerySet.WORKLOAD).get()
+            for name, value in values.items():
+                setattr(self, name, value)
+        return self
+
     def owner_count(self):
-        active = 0
-        overdue = 0
-        for task in self.task_set.exclude(exec_status=Task.Sent):
-            active += 1
-            if task.warning.startswith('Протерміновано'):
-                overdue += 1
-        return 'Активні-' + str(active) + '/Протерміновані-' + str(overdue)
+        workload = self.workload()
+        return 'Активні-' + str(workload.owner_active) + '/Протерміновані-' + str(workload.owner_overdue)
     owner_count.short_description = 'Керівник проектів'
+    owner_count.admin_order_field = 'owner_overdue'
 
     def task_count(self):
-        active = 0
-        overdue = 0
-        for task in self.tasks.exclude(exec_status=Task.Sent):
-            active += 1
-            if task.warning.startswith('Протерміновано'):
-                overdue += 1
-        return 'Активні-' + str(active) + '/Протерміновані-' + str(overdue)
+        workload = self.workload()
+        return 'Активні-' + str(workload.executor_active) + '/Протерміновані-' + str(workload.executor_overdue)
     task_count.short_description = 'Виконавець в проектах'
+    task_count.admin_order_field = 'executor_overdue'
 
     def inttask_count(self):
-        active = self.inttask_set.exclude(exec_status=IntTask.Done).count()
-        overdue = self.inttask_set.exclude(exec_status=IntTask.Done)\
-                                  .exclude(planned_finish__gte=date.today()).count()
-        return 'Активні-' + str(active) + '/Протерміновані-' + str(overdue)
+        workload = self.workload()
+        return 'Активні-' + str(workload.inttasks_active) + '/Протерміновані-' + str(workload.inttasks_overdue)
     inttask_count.short_description = 'Завдання'
+    inttask_count.admin_order_field = 'inttasks_overdue'
 
     def tasks_for_period(self, period):
         """ return queryset with tasks for given month """
@@ -139,22 +143,15 @@ class Employee(models.Model):
 
     def overdue_tasks(self):
         """ return queryset with overdue tasks of task owner """
-        return self.task_set.exclude(exec_status__in=[Task.Done, Task.Sent,
-                                                      Task.OnHold, Task.Canceled]) \
-                            .exclude(deal__expire_date__gte=date.today(),
-                                     planned_finish__isnull=True) \
-                            .exclude(deal__expire_date__gte=date.today(),
-                                     planned_finish__gte=date.today())
+        return self.task_set.filter(overdue_tasks_q())
 
     def overdue_executions(self):
         """ return queryset with overdue executions of employee """
-        return self.execution_set.exclude(exec_status__in=[Execution.Done, Execution.OnChecking]) \
-                                 .exclude(planned_finish__gte=date.today())
+        return self.execution_set.filter(overdue_executions_q())
 
     def overdue_inttasks(self):
         """ return queryset with overdues inttasks of employee """
-        return self.inttask_set.exclude(exec_status=IntTask.Done) \
-                               .exclude(planned_finish__gte=date.today())
+        return self.inttask_set.filter(overdue_inttasks_q())
 
     def unsent_tasks(self):
         """ return queryset with tasks tasks of task owner """
@@ -200,6 +197,9 @@ class Customer(Requisites):
     report_template = models.ForeignKey(HTMLTemplate, verbose_name='Шаблон звіту', blank=True, null=True, on_delete=models.CASCADE, related_name='customers_reports')
     active = models.BooleanField('Активний', default=True)
 
+    # defining custom manager
+    objects = CustomerQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Замовник'
         verbose_name_plural = 'Замовники'
@@ -207,48 +207,39 @@ class Customer(Requisites):
     def __str__(self):
         return self.name
 
+    def financials(self):
+        """ Return customer with sums annotated by with_financials(), query them if not annotated """
+        if not hasattr(self, 'debit'):
+            values = Customer.objects.filter(pk=self.pk).with_financials() \
+                                     .values(*CustomerQuerySet.FINANCIALS).get()
+            for name, value in values.items():
+                setattr(self, name, value)
+        return self
+
     def debit_calc(self):
-        total = 0
-        for deal in self.deal_set.exclude(exec_status=Deal.Canceled):
-            if deal.pay_status != Deal.PaidUp:
-                acts_total = deal.acts_total()
-                paid_total = deal.paid_total()
-                if acts_total > paid_total:
-                    total += acts_total - paid_total
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.financials().debit).replace(u',', u' ')
     debit_calc.short_description = 'Дебіторська заборгованість {}'.format(
         date.today().year)
+    debit_calc.admin_order_field = 'debit'
 
     def credit_calc(self):
-        total = 0
-        for deal in self.deal_set.exclude(exec_status=Deal.Canceled):
-            if deal.pay_status != Deal.NotPaid:
-                acts_total = deal.acts_total()
-                paid_total = deal.paid_total()
-                if acts_total < paid_total:
-                    total += paid_total - acts_total
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.financials().credit).replace(u',', u' ')
     credit_calc.short_description = 'Авансові платежі'
+    credit_calc.admin_order_field = 'credit'
 
     def completed_calc(self):
-        total = 0
-        for deal in self.deal_set.exclude(exec_status=Deal.Canceled).filter(expire_date__year=date.today().year):
-            if deal.pay_status != Deal.NotPaid or deal.act_status != Deal.NotIssued:
-                total += min(deal.acts_total(), deal.paid_total())
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.financials().completed).replace(u',', u' ')
     completed_calc.short_description = 'Виконано та оплачено {}'.format(
         date.today().year)
+    completed_calc.admin_order_field = 'completed'
 
     def expect_calc(self):
-        total = 0
-        for deal in self.deal_set.exclude(exec_status=Deal.Canceled):
-            if deal.pay_status == Deal.NotPaid and deal.act_status == Deal.NotIssued:
-                total += deal.value - deal.paid_total()
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.financials().expect).replace(u',', u' ')
     expect_calc.short_description = 'В роботі'
+    expect_calc.admin_order_field = 'expect'
 
 
-class Project(models.Model):
+class Project(ModelDiffMixin, models.Model):
     project_type = models.CharField('Вид робіт', max_length=100)
     customer = models.ForeignKey(Customer, verbose_name='Замовник', on_delete=models.PROTECT)
     price_code = models.CharField('Пункт кошторису', max_length=15, unique=True)
@@ -292,11 +283,22 @@ class Company(Requisites):
         ('wvat', 'З ПДВ'),
         ('wovat', 'Без ПДВ'),
     )
+    # bonus KPIs of analytics.Kpi
+    BONUS_KPI_CHOICES = (
+        ('BI', 'Бонус Ітел-Cервіс'),
+        ('BG', 'Бонус Галкомпроект'),
+        ('BS', 'Бонус ФОП'),
+    )
     chief = models.ForeignKey(Employee, verbose_name='Керівник', related_name='company_chiefs', on_delete=models.PROTECT)
     accountant = models.ForeignKey(Employee, verbose_name='Бухгалтер', related_name='company_accountant', on_delete=models.PROTECT)
     taxation = models.CharField('Система оподаткування', max_length=5, choices=TAXATION_CHOICES, default='wvat')
+    bonus_kpi = models.CharField('КПЕ бонусів', max_length=2, choices=BONUS_KPI_CHOICES, blank=True,
+                                 help_text='Показник, до якого зараховуються бонуси по договорах компанії')
     active = models.BooleanField('Активний', default=True)
 
+    # defining custom manager
+    objects = CompanyQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Компанія'
         verbose_name_plural = 'Компанії'
@@ -304,27 +306,29 @@ class Company(Requisites):
     def __str__(self):
         return self.name
 
+    def summary(self):
+        """ Return company with current year sums annotated by with_summary(), query them if not annotated """
+        if not hasattr(self, 'turnover'):
+            values = Company.objects.filter(pk=self.pk).with_summary() \
+                                    .values(*CompanyQuerySet.SUMMARY).get()
+            for name, value in values.items():
+                setattr(self, name, value)
+        return self
+
     def turnover_calc(self):
-        total = 0
-        for deal in self.deal_set.filter(date__year=date.today().year):
-            acts_total = deal.acts_total()
-            total += acts_total
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.summary().turnover).replace(u',', u' ')
     turnover_calc.short_description = 'Оборот {}'.format(date.today().year)
+    turnover_calc.admin_order_field = 'turnover'
 
     def costs_calc(self):
-        total = 0
-        for deal in self.deal_set.filter(date__year=date.today().year):
-            total += deal.costs_calc()
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.summary().costs).replace(u',', u' ')
     costs_calc.short_description = 'Витрати {}'.format(date.today().year)
+    costs_calc.admin_order_field = 'costs'
 
     def bonuses_calc(self):
-        total = 0
-        for deal in self.deal_set.filter(date__year=date.today().year):
-            total += deal.bonuses_calc()
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.summary().bonuses).replace(u',', u' ')
     bonuses_calc.short_description = 'Бонуси {}'.format(date.today().year)
+    bonuses_calc.admin_order_field = 'bonuses'
 
 
 class Contractor(models.Model):
@@ -336,6 +340,9 @@ class Contractor(models.Model):
     requisites = models.TextField('Реквізити', blank=True)
     active = models.BooleanField('Активний', default=True)
 
+    # defining custom manager
+    objects = ContractorQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Контрагент'
         verbose_name_plural = 'Контрагенти'
@@ -343,46 +350,34 @@ class Contractor(models.Model):
     def __str__(self):
         return self.name
 
+    def payables(self):
+        """ Return contractor with sums annotated by with_payables(), query them if not annotated """
+        if not hasattr(self, 'advance'):
+            values = Contractor.objects.filter(pk=self.pk).with_payables() \
+                                       .values(*ContractorQuerySet.PAYABLES).get()
+            for name, value in values.items():
+                setattr(self, name, value)
+        return self
+
     def advance_calc(self):
-        total = 0
-        for order in self.order_set.exclude(task__exec_status__in=[Task.Done, Task.Sent, Task.Canceled]):
-            if order.pay_status == Order.AdvancePaid:
-                total += order.advance
-            if order.pay_status == Order.PaidUp:
-                total += order.value
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.payables().advance).replace(u',', u' ')
     advance_calc.short_description = 'Авансові платежі'
+    advance_calc.admin_order_field = 'advance'
 
     def credit_calc(self):
-        total = 0
-        for order in self.order_set.filter(task__exec_status__in=[Task.Done, Task.Sent]):
-            if order.pay_status == Order.NotPaid:
-                total += order.value
-            if order.pay_status == Order.AdvancePaid:
-                total += order.value - order.advance
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.payables().credit).replace(u',', u' ')
     credit_calc.short_description = 'Кредиторська заборгованість'
+    credit_calc.admin_order_field = 'credit'
 
     def expect_calc(self):
-        total = 0
-        for order in self.order_set.exclude(task__exec_status__in=[Task.Done, Task.Sent]):
-            if order.pay_status == Order.NotPaid:
-                total += order.value
-            if order.pay_status == Order.AdvancePaid:
-                total += order.value - order.advance
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.payables().expect).replace(u',', u' ')
     expect_calc.short_description = 'Не виконано та не оплачено'
+    expect_calc.admin_order_field = 'expect'
 
     def completed_calc(self):
-        total = 0
-        for order in self.order_set.filter(task__exec_status__in=[Task.Done, Task.Sent],
-                                           pay_date__year=date.today().year):
-            if order.pay_status == Order.PaidUp:
-                total += order.value
-            if order.pay_status == Order.AdvancePaid:
-                total += order.advance
-        return u'{0:,}'.format(total).replace(u',', u' ')
+        return u'{0:,}'.format(self.payables().completed).replace(u',', u' ')
     completed_calc.short_description = 'Виконано та оплачено'
+    completed_calc.admin_order_field = 'completed'
 
 
 class Deal(ModelDiffMixin, models.Model):
@@ -449,10 +444,22 @@ class Deal(ModelDiffMixin, models.Model):
                                                              'wordprocessingml.document'],
                                               max_upload_size=26214400,
                                               blank=True, null=True)
+    # Rollups of related objects, maintained by ActOfAcceptance, Payment, Order, Task and Execution
+    acts_total = models.DecimalField('Сума актів, грн.', max_digits=10, decimal_places=2, default=0)
+    paid_total = models.DecimalField('Сума оплат, грн.', max_digits=10, decimal_places=2, default=0)
+    costs_total = models.DecimalField('Витрати по договору, грн.', max_digits=10, decimal_places=2, default=0)
+    bonuses_total = models.DecimalField('Бонуси по договору, грн.', max_digits=10, decimal_places=2, default=0)
+    # Latest comment, maintained by Comment
+    last_comment_text = models.CharField('Останній коментар', max_length=255, blank=True)
+    last_comment_at = models.DateTimeField('Дата останнього коментаря', blank=True, null=True)
     # Creating information
     creator = models.ForeignKey(User, verbose_name='Створив', related_name='deal_creators', on_delete=models.PROTECT)
     creation_date = models.DateField(auto_now_add=True)
 
+    ROLLUP_FIELDS = ['acts_total', 'paid_total', 'costs_total', 'bonuses_total']
+    COMMENT_FIELDS = ['last_comment_text', 'last_comment_at']
+    SEARCH_FIELDS = ['number', 'value']
+
     # defining custom manager
     objects = DealQuerySet.as_manager()
 
@@ -494,6 +501,12 @@ class Deal(ModelDiffMixin, models.Model):
                     extra={'title': self.number, 'diff': self.diff_str},
                     obj=self,
                     )
+
+        # Don't overwrite rollups and latest comment updated by related objects after this deal was loaded
+        if self.pk:
+            rollups = Deal.objects.filter(pk=self.pk).values(*self.ROLLUP_FIELDS, *self.COMMENT_FIELDS).first() or {}
+            for field, value in rollups.items():
+                setattr(self, field, value)
         super().save(*args, **kwargs)
 
     def delete(self, *args, **kwargs):
@@ -566,20 +579,50 @@ class Deal(ModelDiffMixin, models.Model):
                 return last_act.date + timedelta(days=self.customer.debtor_term)
     pay_date_calc.short_description = 'Дата оплати'
 
-    def acts_total(self):
+    def acts_calc(self):
         """ total act's value """
         return self.actofacceptance_set.aggregate(total=Sum('value')).get('total') or 0
 
-    def paid_total(self):
+    def paid_calc(self):
         """ total paid value """
         return self.payment_set.aggregate(total=Sum('value')).get('total') or 0
 
+    def rollups_calc(self, *fields):
+        """ actual values of given rollup fields or all of them """
+        calc = {'acts_total': self.acts_calc,
+                'paid_total': self.paid_calc,
+                'costs_total': self.costs_calc,
+                'bonuses_total': self.bonuses_calc}
+        return {field: calc[field]() for field in fields or self.ROLLUP_FIELDS}
+
+    def update_rollups(self, *fields):
+        """ recalculate given rollup fields or all of them and store them without logging """
+        rollups = self.rollups_calc(*fields)
+        Deal.objects.filter(pk=self.pk).update(**rollups)
+        for field, value in rollups.items():
+            setattr(self, field, value)
+
+
+def update_deals_rollups(deal_ids, *fields):
+    """ Update rollup fields of deals with given ids """
+    with transaction.atomic():
+        for deal in Deal.objects.select_for_update().filter(pk__in=[pk for pk in deal_ids if pk]):
+            deal.update_rollups(*fields)
+
+
+def changed_deal_ids(instance, created):
+    """ Ids of deals linked to instance before and after save """
+    deal_ids = {instance.deal_id}
+    if not created and 'deal' in instance.changed_fields:
+        deal_ids.add(instance.get_field_diff('deal')[0])
+    return deal_ids
+
 
 @receiver(post_save, sender=Deal, dispatch_uid="update_deal_status")
 def update_deal(sender, instance, **kwargs):
     """ Update Deals status after save Deal """
-    from planner.tasks import update_deal_statuses
-    update_deal_statuses(instance.pk)
+    from planner.tasks import update_statuses_on_commit
+    update_statuses_on_commit(deal_id=instance.pk)
 
 
 class ActOfAcceptance(ModelDiffMixin, models.Model):
@@ -654,6 +697,12 @@ class ActOfAcceptance(ModelDiffMixin, models.Model):
         super().delete(*args, **kwargs)
 
 
+@receiver([post_save, post_delete], sender=ActOfAcceptance, dispatch_uid="update_deal_acts_total")
+def update_acts_total(sender, instance, created=False, **kwargs):
+    """ Update Deal acts_total after save or delete ActOfAcceptance """
+    update_deals_rollups(changed_deal_ids(instance, created), 'acts_total')
+
+
 class PaymentBase(ModelDiffMixin, models.Model):
     date = models.DateField('Дата оплати')
     value = models.DecimalField('Сума, грн.', max_digits=8, decimal_places=2, default=0)
@@ -740,6 +789,12 @@ class Payment(PaymentBase):
         super().delete(*args, **kwargs)
 
 
+@receiver([post_save, post_delete], sender=Payment, dispatch_uid="update_deal_paid_total")
+def update_paid_total(sender, instance, created=False, **kwargs):
+    """ Update Deal paid_total after save or delete Payment """
+    update_deals_rollups(changed_deal_ids(instance, created), 'paid_total')
+
+
 class Invoice(models.Model):
     deal = models.ForeignKey(Deal, verbose_name='Договір', on_delete=models.PROTECT)
     act_of_acceptance = models.ForeignKey(ActOfAcceptance, verbose_name='Акт виконаних робіт',
@@ -831,12 +886,19 @@ class Task(ModelDiffMixin, models.Model):
     difficulty_executor = models.DecimalField('Коефіцієнт виконання', max_digits=3, decimal_places=2, default=1)
     act_of_acceptance = models.ForeignKey(ActOfAcceptance, verbose_name='Акт виконаних робіт',
                                           blank=True, null=True, on_delete=models.SET_NULL)
+    # Latest comment, maintained by Comment
+    last_comment_text = models.CharField('Останній коментар', max_length=255, blank=True)
+    last_comment_at = models.DateTimeField('Дата останнього коментаря', blank=True, null=True)
     # Creating information
     creator = models.ForeignKey(User, verbose_name='Створив', related_name='task_creators', on_delete=models.PROTECT)
     creation_date = models.DateField(auto_now_add=True)
     project_share = models.CharField('Папка проекту', max_length=255, blank=True, null=True)
     photo_share = models.CharField('Папка фото', max_length=255, blank=True, null=True)
 
+    COMMENT_FIELDS = ['last_comment_text', 'last_comment_at']
+    SEARCH_FIELDS = ['object_code', 'object_address', 'deal__number',
+                     'project_type__price_code', 'project_type__project_type']
+
     class Meta:
         unique_together = ('object_code', 'project_type', 'deal')
         verbose_name = 'Проект'
@@ -850,10 +912,7 @@ class Task(ModelDiffMixin, models.Model):
         return reverse('task_detail', args=[self.pk])
 
     def get_last_comment(self):
-        Comment =apps.get_model('notice.Comment')
-        last_comment = Comment.objects.filter(content_type__model='Task',
-                                      object_id=self.pk)
-        return last_comment.latest('timestamp').text[:50] if last_comment else None
+        return self.last_comment_text[:50] if self.last_comment_at else None
 
     def save(self, *args, logging=True, **kwargs):
 
@@ -900,6 +959,12 @@ class Task(ModelDiffMixin, models.Model):
                 self.exec_status = self.Sent
                 self.sending_date = self.sending_set.filter(copies_count__gt=0).first().receipt_date
 
+        # Don't overwrite latest comment updated after this task was loaded
+        if not is_new_object:
+            comment = Task.objects.filter(pk=self.pk).values(*self.COMMENT_FIELDS).first() or {}
+            for field, value in comment.items():
+                setattr(self, field, value)
+
         super().save(*args, **kwargs)
 
         # Automatic change Executions.exec_status when Task status changed
@@ -1064,8 +1129,25 @@ class Task(ModelDiffMixin, models.Model):
 @receiver(post_save, sender=Task, dispatch_uid="update_task_status")
 def update_task(sender, instance, **kwargs):
     """ Update Tasks status after save Task"""
-    from planner.tasks import update_task_statuses
-    update_task_statuses(instance.pk)
+    from planner.tasks import update_statuses_on_commit
+    update_statuses_on_commit(task_id=instance.pk)
+
+
+@receiver([post_save, post_delete], sender=Task, dispatch_uid="update_deal_task_rollups")
+def update_task_rollups(sender, instance, signal, created=False, **kwargs):
+    """ Update Deal costs and bonuses after save or delete Task """
+    if signal == post_delete or created or \
+            {'deal', 'project_type', 'difficulty_owner', 'difficulty_executor'} & set(instance.changed_fields):
+        update_deals_rollups(changed_deal_ids(instance, created), 'costs_total', 'bonuses_total')
+
+
+@receiver(post_save, sender=Project, dispatch_uid="update_deal_project_rollups")
+def update_project_rollups(sender, instance, created, **kwargs):
+    """ Update costs and bonuses of Deals with tasks of Project after change of its price or rates """
+    if not created and {'price', 'net_price_rate', 'owner_bonus', 'executors_bonus', 'exclude_costs'} & \
+            set(instance.changed_fields):
+        update_deals_rollups(Deal.objects.filter(task__project_type=instance).values_list('pk', flat=True),
+                             'costs_total', 'bonuses_total')
 
 
 class SubTask(models.Model):
@@ -1180,6 +1262,8 @@ class Order(ModelDiffMixin, models.Model):
                                 on_delete=models.PROTECT)
     creation_date = models.DateField(auto_now_add=True)
 
+    SEARCH_FIELDS = ['contractor__name', 'task__object_code', 'subtask__name', 'purpose', 'deal_number']
+
     class Meta:
         verbose_name = 'Замовлення'
         verbose_name_plural = 'Замовлення'
@@ -1322,6 +1406,16 @@ class Order(ModelDiffMixin, models.Model):
         return ''
 
 
+@receiver([post_save, post_delete], sender=Order, dispatch_uid="update_deal_order_rollups")
+def update_order_rollups(sender, instance, created=False, **kwargs):
+    """ Update Deal costs and bonuses after save or delete Order """
+    task_ids = {instance.task_id}
+    if not created and 'task' in instance.changed_fields:
+        task_ids.add(instance.get_field_diff('task')[0])
+    deal_ids = Task.objects.filter(pk__in=[pk for pk in task_ids if pk]).values_list('deal', flat=True)
+    update_deals_rollups(deal_ids, 'costs_total', 'bonuses_total')
+
+
 class OrderPayment(PaymentBase):
     order = models.ForeignKey(Order, verbose_name='Замовлення', on_delete=models.PROTECT, blank=True, null=True)
     payer = models.ForeignKey(Company, verbose_name='Платник', on_delete=models.PROTECT, blank=True, null=True)
@@ -1558,11 +1652,24 @@ class Execution(ModelDiffMixin, models.Model):
                     extra={'title': title, 'diff': self.diff_str},
                     obj=self.task,
                     )
+
+        # Save initial values of changed scheduling fields for queue recalculation
+        initial = None
+        if self.pk:
+            initial = {field: values[0] for field, values in self.diff.items()
+                       if field in TimePlanner.SCHEDULING_FIELDS}
         super().save(*args, **kwargs)
 
-        # Recal employee execution queue
+        # Recalc employee execution queue from changed execution forward
+        if initial == {}:
+            return
         if self.executor and self.executor.user.is_staff:
-            timeplanner.recalc_queue()
+            timeplanner.recalc_queue(self, initial)
+        # Recalc queue of previous executor
+        if initial and initial.get('executor'):
+            previous_executor = Employee.objects.get(pk=initial['executor'])
+            if previous_executor.user.is_staff:
+                TimePlanner(previous_executor).recalc_queue(self, initial)
 
     def delete(self, *args, **kwargs):
         title = f'{self.task.object_code} {self.task.project_type.price_code} {self.subtask.name}'
@@ -1604,6 +1711,19 @@ class Execution(ModelDiffMixin, models.Model):
         return False
 
 
+@receiver([post_save, post_delete], sender=Execution, dispatch_uid="update_deal_execution_rollups")
+def update_execution_rollups(sender, instance, signal, created=False, **kwargs):
+    """ Update Deal bonuses after save or delete Execution """
+    task_ids = {instance.task_id}
+    if signal == post_save and not created:
+        if not {'task', 'executor', 'part', 'difficulty'} & set(instance.changed_fields):
+            return
+        if 'task' in instance.changed_fields:
+            task_ids.add(instance.get_field_diff('task')[0])
+    deal_ids = Task.objects.filter(pk__in=task_ids).values_list('deal', flat=True)
+    update_deals_rollups(deal_ids, 'bonuses_total')
+
+
 class IntTask(ModelDiffMixin, models.Model):
     ToDo = 'IW'
     InProgress = 'IP'
@@ -1716,6 +1836,20 @@ class Vacation(ModelDiffMixin, models.Model):
                     )
         super().save(*args, **kwargs)
 
+        employee_pk = self.employee.pk
+        TimePlanner.invalidate_calendar(employee_pk)
+        # invalidate again after commit, other processes could cache calendar built from uncommitted vacations
+        transaction.on_commit(lambda: TimePlanner.invalidate_calendar(employee_pk))
+        timeplanner = TimePlanner(self.employee)
+        timeplanner.recalc_queue()
+
+    def delete(self, *args, **kwargs):
+        super().delete(*args, **kwargs)
+
+        employee_pk = self.employee.pk
+        TimePlanner.invalidate_calendar(employee_pk)
+        # invalidate again after commit, other processes could cache calendar built from uncommitted vacations
+        transaction.on_commit(lambda: TimePlanner.invalidate_calendar(employee_pk))
         timeplanner = TimePlanner(self.employee)
         timeplanner.recalc_queue()
 
@@ -1776,3 +1910,88 @@ class Plan(models.Model):
             obj=self,
             )
         super().delete(*args, **kwargs)
+
+
+class SearchDocument(models.Model):
+    """ Lowercased text of searchable fields of a task, deal or order including related objects """
+
+    content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE)
+    object_id = models.PositiveIntegerField()
+    text = models.TextField('Текст для пошуку')
+
+    class Meta:
+        unique_together = ('content_type', 'object_id')
+        verbose_name = 'Пошуковий документ'
+        verbose_name_plural = 'Пошукові документи'
+
+
+def update_search_documents(model, ids):
+    """ Rebuild search documents of model objects with given ids, remove documents of deleted objects """
+    ids = [pk for pk in ids if pk]
+    if not ids:
+        return
+    content_type = ContentType.objects.get_for_model(model)
+    texts = {pk: '\n'.join(str(value) for value in values if value is not None).lower()
+             for pk, *values in model.objects.filter(pk__in=ids).values_list('pk', *model.SEARCH_FIELDS)}
+    documents = SearchDocument.objects.filter(content_type=content_type, object_id__in=ids)
+    documents.exclude(object_id__in=texts).delete()
+    changed = []
+    for document in documents.filter(object_id__in=texts):
+        text = texts.pop(document.object_id)
+        if document.text != text:
+            document.text = text
+            changed.append(document)
+    SearchDocument.objects.bulk_update(changed, ['text'])
+    SearchDocument.objects.bulk_create([SearchDocument(content_type=content_type, object_id=pk, text=text)
+                                        for pk, text in texts.items()])
+
+
+def search_documents(model, *words):
+    """ Ids of model objects which search documents contain every given word """
+    documents = SearchDocument.objects.filter(content_type=ContentType.objects.get_for_model(model))
+    for word in words:
+        documents = documents.filter(text__contains=word.lower())
+    return documents.values('object_id')
+
+
+@receiver([post_save, post_delete], sender=Deal, dispatch_uid="update_deal_search_document")
+def update_deal_search_document(sender, instance, created=False, **kwargs):
+    update_search_documents(Deal, [instance.pk])
+    if not created and 'number' in instance.changed_fields:
+        update_search_documents(Task, instance.task_set.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Task, dispatch_uid="update_task_search_document")
+def update_task_search_document(sender, instance, created=False, **kwargs):
+    update_search_documents(Task, [instance.pk])
+    if not created and 'object_code' in instance.changed_fields:
+        update_search_documents(Order, instance.order_set.values_list('pk', flat=True))
+
+
+@receiver([post_save, post_delete], sender=Order, dispatch_uid="update_order_search_document")
+def update_order_search_document(sender, instance, **kwargs):
+    update_search_documents(Order, [instance.pk])
+
+
+@receiver(post_save, sender=Project, dispatch_uid="update_project_search_documents")
+def update_project_search_documents(sender, instance, created, **kwargs):
+    if not created:
+        update_search_documents(Task, instance.task_set.values_list('pk', flat=True))
+
+
+@receiver(post_save, sender=Contractor, dispatch_uid="update_contractor_search_documents")
+@receiver(post_save, sender=SubTask, dispatch_uid="update_subtask_search_documents")
+def update_orders_search_documents(sender, instance, created, **kwargs):
+    if not created:
+        update_search_documents(Order, instance.order_set.values_list('pk', flat=True))
+
+
+@receiver(pre_delete, sender=SubTask, dispatch_uid="collect_subtask_search_documents")
+def collect_subtask_search_documents(sender, instance, **kwargs):
+    # orders lose deleted subtask by queryset update which sends no signals, so remember them before
+    instance.search_order_ids = list(instance.order_set.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=SubTask, dispatch_uid="update_deleted_subtask_search_documents")
+def update_deleted_subtask_search_documents(sender, instance, **kwargs):
+    update_search_documents(Order, getattr(instance, 'search_order_ids', []))
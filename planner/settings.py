@@ -234,6 +234,18 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = TIME_ZONE
 DJANGO_CELERY_BEAT_TZ_AWARE = False
 
+# Cache shared by gunicorn workers and celery, keeps calendars and contexts versions consistent.
+# REDIS_CACHE must point to other redis database than celery broker, e.g. redis://redis:6379/1
+CACHES = {
+    'default': {
+        'BACKEND': 'django_redis.cache.RedisCache',
+        'LOCATION': os.environ.get("REDIS_CACHE"),
+    }
+}
+
+# Update statuses of saved tasks and deals through celery
+STATUSES_UPDATE_ASYNC = os.environ.get("STATUSES_UPDATE_ASYNC") == 'TRUE'
+
 # Email related settings
 EMAIL_ENABLED = os.environ.get("EMAIL_ENABLED") == 'TRUE'
 EMAIL_USE_TLS = os.environ.get("EMAIL_USE_TLS") == 'TRUE'
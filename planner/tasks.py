@@ -1,123 +1,256 @@
+import threading
+from collections import defaultdict
 from datetime import date, timedelta
 from celery.utils.log import get_task_logger
-from django.db.models import F
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Q, Count, Min, Max, Sum, OuterRef, Subquery
 from django.conf.locale.uk import formats as uk_formats
 
-from planner.models import Deal, Task, Order
+from planner.models import Deal, Task, Order, Employee, Execution, Sending
+from planner.timeplanning import TimePlanner
 from planner.celery import app
 
 date_format = uk_formats.DATE_INPUT_FORMATS[0]
 logger = get_task_logger(__name__)
 
+# Count of employees which queues are saved by one bulk_update
+QUEUES_CHUNK_SIZE = 10
+
+# Tasks and deals changed in current thread which statuses are not updated yet
+pending_statuses = threading.local()
+
+
+def waits_for_commit(callback):
+    """ Return True if callback is registered by on_commit() and waits for commit of current transaction """
+    connection = transaction.get_connection()
+    return connection.in_atomic_block and any(func is callback for _, func in connection.run_on_commit)
+
+
+def update_statuses_on_commit(task_id=None, deal_id=None):
+    """ Collect changed tasks and deals and update their statuses once on transaction commit.
+        Outside of transaction statuses are updated immediately.
+    """
+    # start new collection if callback of previous one has run or was discarded by rollback
+    is_new = not waits_for_commit(getattr(pending_statuses, 'callback', None))
+    if is_new:
+        task_ids, deal_ids = set(), set()
+        pending_statuses.task_ids, pending_statuses.deal_ids = task_ids, deal_ids
+        pending_statuses.callback = lambda: update_pending_statuses(task_ids, deal_ids)
+    if task_id:
+        pending_statuses.task_ids.add(task_id)
+    if deal_id:
+        pending_statuses.deal_ids.add(deal_id)
+    if is_new:
+        transaction.on_commit(pending_statuses.callback)
+
+
+def update_pending_statuses(task_ids, deal_ids):
+    """ Update statuses of collected tasks and deals directly or through celery """
+    task_ids = list(task_ids)
+    deal_ids = list(deal_ids)
+    if settings.STATUSES_UPDATE_ASYNC:
+        if task_ids:
+            update_task_statuses.delay(task_ids=task_ids)
+        if deal_ids:
+            update_deal_statuses.delay(deal_ids=deal_ids)
+    else:
+        if task_ids:
+            update_task_statuses(task_ids=task_ids)
+        if deal_ids:
+            update_deal_statuses(deal_ids=deal_ids)
+
+
+def task_warning(task):
+    """ Return warning of task annotated by with_status_rollups() """
+    if task.manual_warning:
+        return task.manual_warning
+    if task.exec_status == Task.OnHold:
+        return 'Призупинено'
+    if task.exec_status == Task.Canceled:
+        return 'Відмінено'
+    if task.exec_status == Task.Done:
+        if task.sent_copies is None:
+            if task.copies_count > 0:
+                return 'Не надіслано'
+        elif task.sent_copies < task.copies_count:
+            return 'Не всі відправки'
+    if task.exec_status in [Task.Sent, Task.Done] and task.actual_finish:
+        return 'Виконано %s' % task.actual_finish.strftime(date_format)
+    if not task.todo_count and not task.inprogress_count and task.done_count:
+        return 'Очікує на перевірку'
+    if task.planned_finish:
+        expire_date = task.planned_finish
+    else:
+        expire_date = task.deal_expire_date
+    if expire_date < date.today():
+        return 'Протерміновано %s' % expire_date.strftime(date_format)
+    if expire_date - timedelta(days=7) <= date.today():
+        return 'Завершується %s' % expire_date.strftime(date_format)
+    return 'Завершити до %s' % expire_date.strftime(date_format)
+
+
+def with_status_rollups(tasks):
+    """ Annotate tasks with executions and sendings rollups needed for warnings and planned dates """
+    sent_copies = Sending.objects.filter(task=OuterRef('pk')).order_by() \
+                                 .values('task').annotate(total=Sum('copies_count')).values('total')
+    return tasks.annotate(executions_count=Count('execution'),
+                          todo_count=Count('execution', filter=Q(execution__exec_status=Execution.ToDo)),
+                          inprogress_count=Count('execution', filter=Q(execution__exec_status=Execution.InProgress)),
+                          done_count=Count('execution', filter=Q(execution__exec_status=Execution.Done)),
+                          unplanned_count=Count('execution', filter=Q(execution__planned_finish__isnull=True)),
+                          executions_start=Min('execution__planned_start'),
+                          executions_finish=Max('execution__planned_finish'),
+                          sent_copies=Subquery(sent_copies),
+                          copies_count=F('project_type__copies_count'),
+                          deal_expire_date=F('deal__expire_date'))
+
 
 @app.task
-def update_task_statuses(task_id=None):
-    """ Update statuses. If task_id given updates for task_id else updates for last 500 tasks """
+def update_task_statuses(task_id=None, task_ids=None):
+    """ Update statuses. If task_id or task_ids given updates for them else updates for all not sent tasks """
     if task_id:
-        tasks = Task.objects.filter(pk=task_id)
+        task_ids = [task_id]
+    if task_ids:
+        tasks = Task.objects.filter(pk__in=task_ids)
     else:
-        tasks = Task.objects.order_by('-id').prefetch_related('execution_set')[:500]
+        tasks = Task.objects.exclude(exec_status__in=[Task.Sent, Task.Canceled])
     task_list = []
-    for task in tasks:
+    for task in with_status_rollups(tasks).order_by():
         # update warning
-        sending_status = task.sending_status()
-        if task.manual_warning:
-            task.warning = task.manual_warning
-        elif task.exec_status == Task.OnHold:
-            task.warning = 'Призупинено'
-        elif task.exec_status == Task.Canceled:
-            task.warning = 'Відмінено'
-        elif task.exec_status == Task.Done and sending_status != 'Надіслано':
-            task.warning = sending_status
-        elif task.exec_status in [Task.Sent, Task.Done] and task.actual_finish:
-            task.warning = 'Виконано %s' % task.actual_finish.strftime(date_format)
-        elif task.execution_status() == 'Виконано':
-            task.warning = 'Очікує на перевірку'
-        elif task.planned_finish:
-            if task.planned_finish < date.today():
-                task.warning = 'Протерміновано %s' % task.planned_finish.strftime(
-                    date_format)
-            elif task.planned_finish - timedelta(days=7) <= date.today():
-                task.warning = 'Завершується %s' % task.planned_finish.strftime(
-                    date_format)
-            else:
-                task.warning = 'Завершити до %s' % task.planned_finish.strftime(
-                    date_format)
-        elif task.deal.expire_date < date.today():
-            task.warning = 'Протерміновано %s' % task.deal.expire_date.strftime(
-                date_format)
-        elif task.deal.expire_date - timedelta(days=7) <= date.today():
-            task.warning = 'Завершується %s' % task.deal.expire_date.strftime(
-                date_format)
-        else:
-            task.warning = 'Завершити до %s' % task.deal.expire_date.strftime(
-                date_format)
+        task.warning = task_warning(task)
 
         # update planned_start and planner_finish
-        if task.exec_status in [Task.ToDo, Task.InProgress, Task.Done] and task.execution_set.exists():
-            planned_start = task.execution_set.order_by(F('planned_start').asc(nulls_last=True)).first().planned_start
-            task.planned_start = planned_start.date() if planned_start else None
-            if not task.execution_set.filter(planned_finish__isnull=True).exists():
-                task.planned_finish = task.execution_set.order_by('planned_finish').last().planned_finish.date()
+        if task.exec_status in [Task.ToDo, Task.InProgress, Task.Done] and task.executions_count:
+            task.planned_start = task.executions_start.date() if task.executions_start else None
+            if not task.unplanned_count:
+                task.planned_finish = task.executions_finish.date()
 
         task_list.append(task)
 
-    Task.objects.bulk_update(task_list, ['warning', 'planned_start', 'planned_finish'])
-    logger.info("Tasks warning and planned dates updated. %s", task_id)
+    Task.objects.bulk_update(task_list, ['warning', 'planned_start', 'planned_finish'], batch_size=500)
+    logger.info("Tasks warning and planned dates updated. %s", task_ids)
+
+
+def deal_exec_status(deal):
+    """ Return exec_status of deal annotated by with_rollups() """
+    for status in [Deal.ToDo, Deal.InProgress, Deal.Done, Deal.Sent, Deal.Canceled]:
+        if getattr(deal, 'tasks_%s' % status):
+            return status
+    return Deal.ToDo
+
+
+def deal_act_status(deal):
+    """ Return act_status of deal annotated by with_rollups(), same as Deal.get_act_status() """
+    if deal.acts_sum is not None:
+        if deal.acts_sum >= deal.value + deal.value_correction:
+            return Deal.Issued
+        elif deal.acts_sum > 0:
+            return Deal.PartlyIssued
+    return Deal.NotIssued
+
+
+def deal_pay_status(deal):
+    """ Return pay_status of deal annotated by with_rollups(), same as Deal.get_pay_status() """
+    if deal.payments_sum is not None:
+        act_sum = deal.acts_sum or 0
+        if deal.payments_sum > act_sum:
+            return Deal.AdvancePaid
+        elif deal.payments_sum > 0 and act_sum > deal.payments_sum:
+            return Deal.PartlyPaid
+        elif act_sum == deal.payments_sum == deal.value + deal.value_correction:
+            return Deal.PaidUp
+    return Deal.NotPaid
+
+
+def deal_value(deal):
+    """ Return value of deal loaded by deals_with_rollups(), same as Deal.value_calc() """
+    total = 0
+    for price in deal.tasks_prices:
+        if deal.taxation == 'wovat':
+            price = price / 6 * 5
+        total += price
+    return round(total, 2)
+
+
+def deal_pay_date(deal):
+    """ Return pay date of deal annotated by with_rollups(), same as Deal.pay_date_calc() """
+    if deal.debtor_term and deal.last_act_date:
+        return deal.last_act_date + timedelta(days=deal.debtor_term)
+
+
+def deal_warning(deal):
+    """ Return warning of deal loaded by deals_with_rollups() """
+    if deal.manual_warning:
+        return deal.manual_warning
+    if deal.tasks_count == 0:
+        return 'Відсутні проекти'
+    if deal.exec_status == Deal.Canceled:
+        return 'Відмінено'
+    if deal.exec_status == Deal.Sent:
+        value_calc = deal_value(deal) + deal.value_correction
+        pay_date = deal_pay_date(deal)
+        if deal.value > 0 and deal.value != value_calc:
+            return 'Вартість по роботам %s' % value_calc
+        if deal.act_status in [Deal.NotIssued, Deal.PartlyIssued]:
+            return 'Очікує закриття акту'
+        if deal.pay_status != Deal.PaidUp and pay_date:
+            return 'Оплата %s' % pay_date.strftime(date_format)
+        return ''
+    if deal.expire_date < date.today():
+        return 'Протерміновано %s' % deal.expire_date.strftime(date_format)
+    if deal.expire_date - timedelta(days=7) <= date.today():
+        return 'Закінчується %s' % deal.expire_date.strftime(date_format)
+    return ''
+
+
+def deals_with_rollups(deals):
+    """ Return list of deals with rollups and prices of their tasks in order of Deal.task_set """
+    deals = list(deals.with_rollups().order_by())
+    tasks_prices = defaultdict(list)
+    tasks = Task.objects.filter(deal__in=[deal.pk for deal in deals]).order_by('-creation_date', 'object_code')
+    for deal_id, price in tasks.values_list('deal', 'project_type__price'):
+        tasks_prices[deal_id].append(price)
+    for deal in deals:
+        deal.tasks_prices = tasks_prices[deal.pk]
+    return deals
 
 
 @app.task
-def update_deal_statuses(deal_id=None):
-    """ Update statuses and warnings. If deal_id given updates for deal_id else updates for last 200 deals """
+def update_deal_statuses(deal_id=None, deal_ids=None):
+    """ Update statuses and warnings. If deal_id or deal_ids given updates for them else updates for all open deals """
     if deal_id:
-        deals = Deal.objects.filter(pk=deal_id)
+        deal_ids = [deal_id]
+    if deal_ids:
+        deals = Deal.objects.filter(pk__in=deal_ids)
     else:
-        deals = Deal.objects.order_by('-id').prefetch_related('task_set')[:200]
+        deals = Deal.objects.exclude(exec_status=Deal.Canceled) \
+                            .exclude(exec_status=Deal.Sent, act_status=Deal.Issued, pay_status=Deal.PaidUp)
     deal_list = []
-    for deal in deals:
-        tasks = deal.task_set.values_list('exec_status', flat=True)
-        if Task.ToDo in tasks:
-            deal.exec_status = Deal.ToDo
-        elif Task.InProgress in tasks:
-            deal.exec_status = Deal.InProgress
-        elif Task.Done in tasks:
-            deal.exec_status = Deal.Done
-        elif Task.Sent in tasks:
-            deal.exec_status = Deal.Sent
-        elif Task.Canceled in tasks:
-            deal.exec_status = Deal.Canceled
-        else:
-            deal.exec_status = Deal.ToDo
-
-        if deal.manual_warning:
-            deal.warning = deal.manual_warning
-        elif deal.task_set.all().count() == 0:
-            deal.warning = 'Відсутні проекти'
-        elif deal.exec_status == Deal.Canceled:
-                deal.warning = 'Відмінено'
-        elif deal.exec_status == Deal.Sent:
-            value_calc = deal.value_calc() + deal.value_correction
-            if deal.value > 0 and deal.value != value_calc:
-                deal.warning = 'Вартість по роботам %s' % value_calc
-            elif deal.act_status in [deal.NotIssued, deal.PartlyIssued]:
-                deal.warning = 'Очікує закриття акту'
-            elif deal.pay_status != deal.PaidUp and deal.pay_date_calc():
-                deal.warning = 'Оплата %s' % deal.pay_date_calc().strftime(date_format)
-            else:
-                deal.warning = ''
-        elif deal.expire_date < date.today():
-            deal.warning = 'Протерміновано %s' % deal.expire_date.strftime(
-                date_format)
-        elif deal.expire_date - timedelta(days=7) <= date.today():
-            deal.warning = 'Закінчується %s' % deal.expire_date.strftime(
-                date_format)
-        else:
-            deal.warning = ''
-
+    statuses_changed = False
+    receivables_changed = set()
+    for deal in deals_with_rollups(deals):
+        statuses = deal.exec_status, deal.act_status, deal.pay_status, deal.warning
+        deal.exec_status = deal_exec_status(deal)
+        deal.act_status = deal_act_status(deal)
+        deal.pay_status = deal_pay_status(deal)
+        deal.warning = deal_warning(deal)
         deal_list.append(deal)
+        if statuses != (deal.exec_status, deal.act_status, deal.pay_status, deal.warning):
+            statuses_changed = True
+        if statuses[1:3] != (deal.act_status, deal.pay_status):
+            receivables_changed.add((deal.customer_id, deal.company_id))
 
-    Deal.objects.bulk_update(deal_list, ['exec_status', 'warning'])
-    logger.info("Deal statuses and warnings updated. %s", deal_id)
+    Deal.objects.bulk_update(deal_list, ['exec_status', 'act_status', 'pay_status', 'warning'], batch_size=500)
+    if receivables_changed:
+        # act and pay statuses define documents counted in receivables of finance facts
+        from analytics.tasks import update_finance_facts
+        update_finance_facts(pairs=list(receivables_changed))
+    if statuses_changed:
+        # reports select deals by statuses
+        from analytics.context import invalidate_data, FINANCE
+        invalidate_data(FINANCE)
+    logger.info("Deal statuses and warnings updated. %s", deal_ids)
 
 
 @app.task
@@ -142,3 +275,60 @@ def create_periodical_orders():
 
     Order.objects.bulk_create(order_list)
     logger.info("New periodical orders created, %s", today)
+
+
+@app.task
+def recalc_all_queues(dry_run=False):
+    """ Recalc execution queues of all staff employees.
+        If dry_run is True returns planned changes without saving them
+    """
+    # rebuild calendars in case of holidays changes
+    TimePlanner.calendars.clear()
+
+    employees = Employee.objects.filter(user__is_staff=True).prefetch_related('vacation_set')
+    tasks_to_do = TimePlanner.queued_executions(Execution.objects.filter(executor__user__is_staff=True)) \
+                             .select_related('subtask') \
+                             .order_by('executor', 'exec_status', F('planned_start').asc(nulls_last=True), 'pk')
+    last_task_finishes = dict(TimePlanner.finished_executions(Execution.objects.filter(executor__user__is_staff=True))
+                                         .order_by()
+                                         .values('executor')
+                                         .annotate(last_finish=Max('actual_finish'))
+                                         .values_list('executor', 'last_finish'))
+
+    # group executions by employees queues
+    queues = defaultdict(list)
+    tasks_to_do_fixed = defaultdict(list)
+    for execution in tasks_to_do:
+        if execution.fixed_date:
+            tasks_to_do_fixed[execution.executor_id].append({'planned_start': execution.planned_start,
+                                                             'planned_finish': execution.planned_finish})
+        else:
+            queues[execution.executor_id].append(execution)
+
+    employees = list(employees)
+    changes = []
+    for chunk_start in range(0, len(employees), QUEUES_CHUNK_SIZE):
+        tasks = []
+        for employee in employees[chunk_start:chunk_start + QUEUES_CHUNK_SIZE]:
+            queue = queues[employee.pk]
+            initial = {task.pk: (task.planned_start, task.planned_finish, task.interruption) for task in queue}
+            timeplanner = TimePlanner(employee)
+            timeplanner.set_fixed_tasks(tasks_to_do_fixed[employee.pk])
+            queued_tasks = timeplanner.plan_queue(queue, timeplanner.queue_start(last_task_finishes.get(employee.pk)))
+            for task in queued_tasks:
+                changes.append({'id': task.pk,
+                                'executor': employee.name,
+                                **{field: [str(initial[task.pk][index]), str(getattr(task, field))]
+                                   for index, field in enumerate(TimePlanner.QUEUE_FIELDS)}
+                                })
+            tasks += queued_tasks
+
+        # perform bulk_update
+        if not dry_run:
+            with transaction.atomic():
+                Execution.objects.bulk_update(tasks, TimePlanner.QUEUE_FIELDS)
+
+    logger.info("Queues of %s employees recalculated, %s executions changed. Dry run: %s",
+                len(employees), len(changes), dry_run)
+    if dry_run:
+        return changes
@@ -0,0 +1,56 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.test import TestCase
+from crum import impersonate
+
+from planner.models import Employee, Company, Customer, Project, SubTask, Contractor, Deal, Task
+
+
+class PlannerTestCase(TestCase):
+    """ Test case with employees, companies, customers and project types shared by tests """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        with impersonate(cls.admin):
+            cls.employees = [Employee.objects.create(user=User.objects.create_user(f'user{i}', is_staff=True),
+                                                     name=f'Працівник {i}', position='Інженер', salary=20000)
+                             for i in range(2)]
+            cls.companies = [Company.objects.create(name=f'Компанія {i}', chief=cls.employees[0],
+                                                    accountant=cls.employees[0], taxation=taxation)
+                             for i, taxation in enumerate(['wvat', 'wovat'])]
+            cls.customers = [Customer.objects.create(name=f'Замовник {i}', contact_person='Контакт', phone='1',
+                                                     email='customer@example.com', debtor_term=debtor_term)
+                             for i, debtor_term in enumerate([None, 30])]
+            cls.projects = []
+            for i in range(2):
+                project = Project.objects.create(project_type=f'Тип {i}', customer=cls.customers[i],
+                                                 price_code=f'P{i}', price=Decimal(1000 + i * 500),
+                                                 net_price_rate=75, owner_bonus=6, executors_bonus=12,
+                                                 need_project_code=False)
+                SubTask.objects.create(project_type=project, name=f'Підзадача {i}', part=100,
+                                       duration=timedelta(hours=8), base=True)
+                cls.projects.append(project)
+            cls.contractor = Contractor.objects.create(name='Підрядник')
+
+    def create_deal(self, number, customer=0, expire_date=None):
+        with impersonate(self.admin):
+            return Deal.objects.create(number=number, customer=self.customers[customer],
+                                       company=self.companies[customer],
+                                       expire_date=expire_date or date.today() + timedelta(days=30))
+
+    def create_task(self, deal, object_code, project=0, **kwargs):
+        with impersonate(self.admin):
+            return Task.objects.create(object_code=object_code, object_address=f'вул. Тестова, {object_code}',
+                                       project_type=self.projects[project], deal=deal,
+                                       owner=self.employees[0], **kwargs)
+
+    @staticmethod
+    def commit():
+        """ Run and discard on commit callbacks of test transaction as its commit would do """
+        connection = transaction.get_connection()
+        callbacks, connection.run_on_commit = connection.run_on_commit, []
+        for _, callback in callbacks:
+            callback()
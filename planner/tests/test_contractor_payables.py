@@ -0,0 +1,87 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from crum import impersonate
+
+from planner.models import Contractor, Order, Task
+from .base import PlannerTestCase
+
+
+def per_order_payables(contractor):
+    """ Payables of contractor summed order by order as Contractor *_calc() methods did """
+    advance = credit = expect = completed = 0
+    for order in contractor.order_set.exclude(task__exec_status__in=[Task.Done, Task.Sent, Task.Canceled]):
+        if order.pay_status == Order.AdvancePaid:
+            advance += order.advance
+        if order.pay_status == Order.PaidUp:
+            advance += order.value
+    for order in contractor.order_set.filter(task__exec_status__in=[Task.Done, Task.Sent]):
+        if order.pay_status == Order.NotPaid:
+            credit += order.value
+        if order.pay_status == Order.AdvancePaid:
+            credit += order.value - order.advance
+    for order in contractor.order_set.exclude(task__exec_status__in=[Task.Done, Task.Sent]):
+        if order.pay_status == Order.NotPaid:
+            expect += order.value
+        if order.pay_status == Order.AdvancePaid:
+            expect += order.value - order.advance
+    for order in contractor.order_set.filter(task__exec_status__in=[Task.Done, Task.Sent],
+                                             pay_date__year=date.today().year):
+        if order.pay_status == Order.PaidUp:
+            completed += order.value
+        if order.pay_status == Order.AdvancePaid:
+            completed += order.advance
+    return {'advance': advance, 'credit': credit, 'expect': expect, 'completed': completed}
+
+
+class ContractorPayablesTest(PlannerTestCase):
+
+    def add_order(self, contractor, task, value, advance, pay_status, pay_date=None):
+        with impersonate(self.admin):
+            order = Order.objects.create(contractor=contractor, company=self.companies[0], task=task,
+                                         value=Decimal(value), advance=Decimal(advance),
+                                         pay_date=pay_date or date.today())
+        # pay status is calculated by payments on save
+        Order.objects.filter(pk=order.pk).update(pay_status=pay_status)
+
+    def test_payables_match_per_order_sums(self):
+        deal = self.create_deal('D1')
+        tasks = {}
+        for status in [Task.ToDo, Task.InProgress, Task.Done, Task.Sent, Task.Canceled, Task.OnHold]:
+            tasks[status] = self.create_task(deal, f'T-{status}')
+            Task.objects.filter(pk=tasks[status].pk).update(exec_status=status)
+
+        with impersonate(self.admin):
+            partly_paid = Contractor.objects.create(name='Частково оплачений')
+            mixed = Contractor.objects.create(name='Різні замовлення')
+            without_orders = Contractor.objects.create(name='Без замовлень')
+
+        # partly paid orders of tasks in progress and done, this and last year
+        last_year = date.today() - timedelta(days=366)
+        self.add_order(partly_paid, tasks[Task.InProgress], 1000, 300, Order.AdvancePaid)
+        self.add_order(partly_paid, tasks[Task.Done], 800, 200, Order.AdvancePaid)
+        self.add_order(partly_paid, tasks[Task.Sent], 500, 100, Order.AdvancePaid, pay_date=last_year)
+        # every pay status with every task status and orders without task
+        pay_statuses = [Order.NotPaid, Order.Approved, Order.AdvancePaid, Order.AdvanceApproved, Order.PaidUp]
+        for i, pay_status in enumerate(pay_statuses):
+            for j, task in enumerate(list(tasks.values()) + [None]):
+                self.add_order(self.contractor if task else mixed, task, 100 * (i + j + 1), 10 * (i + 1),
+                               pay_status, pay_date=last_year if j % 3 == 0 else None)
+                self.add_order(mixed, task, 50 * (i + 1), 5 * (j + 1), pay_status)
+
+        contractors = Contractor.objects.with_payables().order_by('pk')
+        self.assertEqual(len(contractors), 4)
+        for contractor in contractors:
+            with self.subTest(contractor=contractor.name):
+                self.assertEqual({name: getattr(contractor, name) for name in ['advance', 'credit', 'expect',
+                                                                                'completed']},
+                                 per_order_payables(contractor))
+        self.assertEqual(per_order_payables(without_orders),
+                         {'advance': 0, 'credit': 0, 'expect': 0, 'completed': 0})
+        self.assertEqual(per_order_payables(partly_paid),
+                         {'advance': Decimal(300), 'credit': Decimal(1000), 'expect': Decimal(700),
+                          'completed': Decimal(200)})
+
+    def test_payables_of_not_annotated_contractor(self):
+        self.add_order(self.contractor, None, 400, 150, Order.AdvancePaid)
+        contractor = Contractor.objects.get(pk=self.contractor.pk).payables()
+        self.assertEqual((contractor.advance, contractor.expect), (Decimal(150), Decimal(250)))
@@ -0,0 +1,43 @@
+from datetime import timedelta
+from decimal import Decimal
+from crum import impersonate
+
+from planner.models import Deal, Execution, Order, SubTask
+from .base import PlannerTestCase
+
+
+class ProjectRollupsTest(PlannerTestCase):
+
+    def setUp(self):
+        self.deal = self.create_deal('Д-1')
+        self.other_deal = self.create_deal('Д-2', customer=1)
+        task = self.create_task(self.deal, 'ОБ-1')
+        self.create_task(self.other_deal, 'ОБ-2', project=1)
+        with impersonate(self.admin):
+            subtask = SubTask.objects.create(project_type=self.projects[0], name='Креслення', part=60,
+                                             duration=timedelta(hours=4))
+            Execution.objects.create(task=task, subtask=subtask, executor=self.employees[1], part=60)
+            Order.objects.create(contractor=self.contractor, company=self.companies[0], task=task,
+                                 value=Decimal(200))
+
+    def assertRollupsActual(self, deal):
+        deal = Deal.objects.get(pk=deal.pk)
+        self.assertEqual(deal.costs_total, deal.costs_calc())
+        self.assertEqual(deal.bonuses_total, deal.bonuses_calc())
+        return deal.bonuses_total
+
+    def test_project_change_updates_deals_rollups(self):
+        bonuses = self.assertRollupsActual(self.deal)
+        other_bonuses = self.assertRollupsActual(self.other_deal)
+
+        project = self.projects[0]
+        for field, value in [('price', Decimal(3000)), ('net_price_rate', 60), ('owner_bonus', 10),
+                             ('executors_bonus', 20), ('exclude_costs', True)]:
+            setattr(project, field, value)
+            project.save()
+            changed_bonuses = self.assertRollupsActual(self.deal)
+            self.assertNotEqual(changed_bonuses, bonuses, field)
+            bonuses = changed_bonuses
+
+        # deals without tasks of project are not changed
+        self.assertEqual(self.assertRollupsActual(self.other_deal), other_bonuses)
@@ -0,0 +1,118 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from crum import impersonate
+
+from planner.models import Deal, Task, ActOfAcceptance, Payment
+from planner.tasks import update_deal_statuses, date_format
+from .base import PlannerTestCase
+
+
+def per_deal_statuses(deal):
+    """ Statuses and warning of deal calculated deal by deal as Deal.save() and update_deal_statuses() did """
+    tasks = deal.task_set.values_list('exec_status', flat=True)
+    for task_status, deal_status in [(Task.ToDo, Deal.ToDo), (Task.InProgress, Deal.InProgress),
+                                     (Task.Done, Deal.Done), (Task.Sent, Deal.Sent),
+                                     (Task.Canceled, Deal.Canceled)]:
+        if task_status in tasks:
+            exec_status = deal_status
+            break
+    else:
+        exec_status = Deal.ToDo
+    act_status = deal.get_act_status()
+    pay_status = deal.get_pay_status()
+
+    if deal.manual_warning:
+        warning = deal.manual_warning
+    elif deal.task_set.count() == 0:
+        warning = 'Відсутні проекти'
+    elif exec_status == Deal.Canceled:
+        warning = 'Відмінено'
+    elif exec_status == Deal.Sent:
+        value_calc = deal.value_calc() + deal.value_correction
+        if deal.value > 0 and deal.value != value_calc:
+            warning = 'Вартість по роботам %s' % value_calc
+        elif act_status in [Deal.NotIssued, Deal.PartlyIssued]:
+            warning = 'Очікує закриття акту'
+        elif pay_status != Deal.PaidUp and deal.pay_date_calc():
+            warning = 'Оплата %s' % deal.pay_date_calc().strftime(date_format)
+        else:
+            warning = ''
+    elif deal.expire_date < date.today():
+        warning = 'Протерміновано %s' % deal.expire_date.strftime(date_format)
+    elif deal.expire_date - timedelta(days=7) <= date.today():
+        warning = 'Закінчується %s' % deal.expire_date.strftime(date_format)
+    else:
+        warning = ''
+    return exec_status, act_status, pay_status, warning
+
+
+class DealStatusesTest(PlannerTestCase):
+
+    def add_act(self, deal, value, days_ago=0):
+        with impersonate(self.admin):
+            ActOfAcceptance.objects.create(deal=deal, number=f'{deal.number}-{value}', value=value,
+                                           date=date.today() - timedelta(days=days_ago))
+
+    def add_payment(self, deal, value):
+        with impersonate(self.admin):
+            Payment.objects.create(deal=deal, date=date.today(), value=value)
+
+    def deal_with_tasks(self, number, statuses, customer=0, **kwargs):
+        deal = self.create_deal(number, customer=customer, **kwargs)
+        for i, status in enumerate(statuses):
+            task = self.create_task(deal, f'{number}-{i}', project=i % 2)
+            Task.objects.filter(pk=task.pk).update(exec_status=status)
+        # calculate value of deal by its tasks
+        with impersonate(self.admin):
+            Deal.objects.get(pk=deal.pk).save()
+        deal.refresh_from_db()
+        return deal
+
+    def test_bulk_statuses_match_per_deal_calculation(self):
+        # execution states
+        self.deal_with_tasks('todo', [Task.ToDo, Task.Done])
+        self.deal_with_tasks('progress', [Task.InProgress, Task.Sent])
+        self.deal_with_tasks('done', [Task.Done, Task.Sent])
+        self.deal_with_tasks('canceled', [Task.Canceled])
+        self.deal_with_tasks('onhold', [Task.OnHold])
+        self.deal_with_tasks('empty', [])
+        self.deal_with_tasks('expired', [Task.InProgress], expire_date=date.today() - timedelta(days=1))
+        self.deal_with_tasks('expiring', [Task.InProgress], expire_date=date.today() + timedelta(days=3))
+        manual = self.deal_with_tasks('manual', [Task.ToDo])
+        Deal.objects.filter(pk=manual.pk).update(manual_warning='Вручну')
+
+        # act and payment states of sent deals
+        self.deal_with_tasks('sent', [Task.Sent, Task.Sent])
+        partly_issued = self.deal_with_tasks('partly-issued', [Task.Sent])
+        self.add_act(partly_issued, partly_issued.value / 2)
+        issued = self.deal_with_tasks('issued', [Task.Sent], customer=1)
+        self.add_act(issued, issued.value, days_ago=10)
+        partly_paid = self.deal_with_tasks('partly-paid', [Task.Sent, Task.Sent], customer=1)
+        self.add_act(partly_paid, partly_paid.value)
+        self.add_payment(partly_paid, partly_paid.value / 3)
+        paid_up = self.deal_with_tasks('paid-up', [Task.Sent], customer=1)
+        self.add_act(paid_up, paid_up.value)
+        self.add_payment(paid_up, paid_up.value)
+        advance = self.deal_with_tasks('advance', [Task.InProgress])
+        self.add_payment(advance, Decimal(100))
+        corrected = self.deal_with_tasks('corrected', [Task.Sent])
+        Deal.objects.filter(pk=corrected.pk).update(value_correction=Decimal(-50))
+        wrong_value = self.deal_with_tasks('wrong-value', [Task.Sent])
+        Deal.objects.filter(pk=wrong_value.pk).update(value=Decimal(1))
+
+        deals = list(Deal.objects.order_by('pk'))
+        expected = {deal.pk: per_deal_statuses(deal) for deal in deals}
+        # forget statuses calculated on save
+        Deal.objects.update(exec_status=Deal.Canceled, act_status=Deal.NotIssued, pay_status=Deal.NotPaid,
+                            warning='')
+
+        update_deal_statuses(deal_ids=[deal.pk for deal in deals])
+
+        for deal in Deal.objects.order_by('pk'):
+            with self.subTest(deal=deal.number):
+                self.assertEqual((deal.exec_status, deal.act_status, deal.pay_status, deal.warning),
+                                 expected[deal.pk])
+        self.assertEqual({status[1] for status in expected.values()},
+                         {Deal.NotIssued, Deal.PartlyIssued, Deal.Issued})
+        self.assertEqual({status[2] for status in expected.values()},
+                         {Deal.NotPaid, Deal.PartlyPaid, Deal.PaidUp, Deal.AdvancePaid})
@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import cycle
+from django.http import QueryDict
+from crum import impersonate
+
+from planner.filters import DEAL_FILTER, TASK_FILTER, EXECUTION_FILTER, ORDER_FILTER
+from planner.models import Construction, WorkType, Deal, Task, Execution, Order, SubTask
+from .base import PlannerTestCase
+
+
+class FilterSpecTest(PlannerTestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        constructions = [Construction.objects.create(name=f'Конструкція {i}') for i in range(2)]
+        work_types = [WorkType.objects.create(name=f'Будівництво {i}') for i in range(2)]
+        deal_statuses = cycle([(Deal.NotIssued, Deal.NotPaid, Deal.ToDo), (Deal.Issued, Deal.PaidUp, Deal.Done),
+                               (Deal.PartlyIssued, Deal.AdvancePaid, Deal.InProgress)])
+        task_statuses = cycle([Task.ToDo, Task.InProgress, Task.Done, Task.Sent])
+        exec_statuses = cycle([Execution.ToDo, Execution.InProgress, Execution.OnChecking, Execution.Done])
+        pay_statuses = cycle([Order.NotPaid, Order.AdvancePaid, Order.PaidUp])
+        with impersonate(cls.admin):
+            subtask = SubTask.objects.create(project_type=cls.projects[0], name='Розділ', part=50,
+                                             duration=timedelta(hours=8))
+            for i in range(6):
+                deal = Deal.objects.create(number=f'Д-{i}', customer=cls.customers[i % 2],
+                                           company=cls.companies[i // 3], expire_date=date.today())
+                act_status, pay_status, exec_status = next(deal_statuses)
+                Deal.objects.filter(pk=deal.pk).update(act_status=act_status, pay_status=pay_status,
+                                                       exec_status=exec_status)
+                for j in range(2):
+                    task = Task.objects.create(object_code=f'ОБ-{i}-{j}', object_address=f'вул. Тестова, {i}',
+                                               project_type=cls.projects[0], deal=deal,
+                                               owner=cls.employees[(i + j) % 2])
+                    Task.objects.filter(pk=task.pk).update(exec_status=next(task_statuses),
+                                                           construction=constructions[i % 2],
+                                                           work_type=work_types[j])
+                    execution = Execution.objects.create(task=task, subtask=subtask,
+                                                         executor=cls.employees[j], part=50)
+                    Execution.objects.filter(pk=execution.pk).update(exec_status=next(exec_statuses))
+                    order = Order.objects.create(contractor=cls.contractor, company=cls.companies[j], task=task,
+                                                 value=Decimal(100), cost_type=[Order.ProjectCost,
+                                                                                Order.OfficeCost][i % 2])
+                    Order.objects.filter(pk=order.pk).update(pay_status=next(pay_statuses))
+        cls.list_values = {
+            'customer': [customer.pk for customer in cls.customers],
+            'company': [company.pk for company in cls.companies],
+            'owner': [employee.pk for employee in cls.employees],
+            'executor': [employee.pk for employee in cls.employees],
+            'contractor': [cls.contractor.pk],
+            'construction': [construction.pk for construction in constructions],
+            'work_type': [work_type.pk for work_type in work_types],
+            'act_status': [Deal.Issued, Deal.PartlyIssued],
+            'pay_status': [Deal.PaidUp, Deal.AdvancePaid, Order.NotPaid],
+            'exec_status': [Deal.ToDo, Deal.InProgress, Task.Sent, Execution.OnChecking],
+            'pay_type': [Order.BankPaymentVAT, Order.CashPayment],
+            'cost_type': [Order.ProjectCost, Order.OfficeCost],
+        }
+
+    SPECS = [(DEAL_FILTER, Deal), (TASK_FILTER, Task), (EXECUTION_FILTER, Execution), (ORDER_FILTER, Order)]
+
+    def query_dict(self, spec, values_count, words=''):
+        query_dict = QueryDict(mutable=True)
+        for parameter in spec.lists:
+            query_dict.setlist(parameter, [str(value) for value in self.list_values[parameter][:values_count]])
+        if words:
+            query_dict['filter'] = words
+        return query_dict
+
+    def test_every_list_compiles_to_single_in(self):
+        for spec, model in self.SPECS:
+            sql = spec.sql(model.objects.all(), self.query_dict(spec, values_count=3))
+            self.assertEqual(sql.count(' IN ('), len(spec.lists), model.__name__)
+
+    def test_results_match_union_of_values(self):
+        for spec, model in self.SPECS:
+            for values_count in (1, 2, 4):
+                for words in ('', 'об', 'д-1 тестова'):
+                    query_dict = self.query_dict(spec, values_count, words)
+                    with self.subTest(model=model.__name__, values_count=values_count, words=words):
+                        self.assertEqual(set(spec.filter(model.objects.all(), query_dict)),
+                                         set(spec.union_filter(model.objects.all(), query_dict)))
+            # every single parameter
+            for parameter in spec.lists:
+                query_dict = QueryDict(mutable=True)
+                query_dict.setlist(parameter, [str(value) for value in self.list_values[parameter]])
+                with self.subTest(model=model.__name__, parameter=parameter):
+                    result = set(spec.filter(model.objects.all(), query_dict))
+                    self.assertTrue(result)
+                    self.assertEqual(result, set(spec.union_filter(model.objects.all(), query_dict)))
@@ -0,0 +1,77 @@
+from datetime import date, datetime, timedelta
+from crum import impersonate
+
+from planner.models import Task, Execution, SubTask, Vacation
+from planner.tasks import recalc_all_queues
+from planner.timeplanning import TimePlanner
+from .base import PlannerTestCase
+
+
+class RecalcAllQueuesTest(PlannerTestCase):
+
+    def setUp(self):
+        today = datetime.now().replace(hour=9, minute=0, second=0, microsecond=0)
+        with impersonate(self.admin):
+            subtasks = [SubTask.objects.create(project_type=self.projects[0], name=f'Креслення {i}', part=20,
+                                               duration=timedelta(hours=hours))
+                        for i, hours in enumerate([3, 6, 12])]
+            Vacation.objects.create(employee=self.employees[1], creator=self.admin,
+                                    start_date=date.today() + timedelta(days=2),
+                                    end_date=date.today() + timedelta(days=4))
+            deal = self.create_deal('Д-1')
+            for i in range(4):
+                task = self.create_task(deal, f'ОБ-{i}')
+                for j, subtask in enumerate(subtasks):
+                    Execution.objects.create(task=task, subtask=subtask, executor=self.employees[(i + j) % 2],
+                                             part=20, exec_status=Execution.InProgress if i == 0 else Execution.ToDo)
+            # finished execution moves queue start of the second employee
+            finished = Execution.objects.create(task=self.create_task(deal, 'ОБ-5'), subtask=subtasks[0],
+                                                executor=self.employees[1], part=20)
+            # fixed execution makes an interruption in queue of the first employee
+            fixed = Execution.objects.create(task=self.create_task(deal, 'ОБ-6'), subtask=subtasks[1],
+                                             executor=self.employees[0], part=20, fixed_date=True,
+                                             planned_start=today + timedelta(days=1, hours=1),
+                                             planned_finish=today + timedelta(days=1, hours=5))
+        last_wednesday = today - timedelta(days=(today.weekday() - 2) % 7 or 7)
+        Execution.objects.filter(pk=finished.pk).update(exec_status=Execution.Done,
+                                                        actual_finish=last_wednesday + timedelta(hours=3))
+        Task.objects.filter(pk=finished.task_id).update(exec_status=Task.InProgress)
+        # queues planned before changes which recalculation should catch up with
+        Execution.objects.exclude(pk__in=[finished.pk, fixed.pk]) \
+                         .update(planned_start=None, planned_finish=None, interruption=timedelta(0))
+        self.queued = TimePlanner.queued_executions(Execution.objects.filter(executor__in=self.employees))
+
+    def queues(self):
+        return {execution.pk: (execution.planned_start, execution.planned_finish, execution.interruption)
+                for execution in Execution.objects.all()}
+
+    def test_all_queues_equal_employees_queues(self):
+        initial = self.queues()
+        recalc_all_queues()
+        all_queues = self.queues()
+
+        for pk, values in initial.items():
+            Execution.objects.filter(pk=pk).update(planned_start=values[0], planned_finish=values[1],
+                                                   interruption=values[2])
+        for employee in self.employees:
+            TimePlanner(employee).recalc_queue()
+
+        self.assertEqual(all_queues, self.queues())
+        self.assertEqual(self.queued.count(), 13)
+        self.assertTrue(all(all_queues[pk][0] for pk in self.queued.values_list('pk', flat=True)))
+        self.assertTrue(any(values[2] for values in all_queues.values()))
+
+    def test_dry_run_writes_nothing(self):
+        initial = self.queues()
+        changes = recalc_all_queues(dry_run=True)
+        self.assertEqual(self.queues(), initial)
+
+        recalc_all_queues()
+        planned = self.queues()
+        self.assertEqual({change['id'] for change in changes},
+                         {pk for pk in initial if planned[pk] != initial[pk]})
+        for change in changes:
+            self.assertEqual(change['planned_start'], [str(initial[change['id']][0]),
+                                                       str(planned[change['id']][0])])
+            self.assertEqual(change['planned_finish'], [str(initial[change['id']][1]),
+                                                        str(planned[change['id']][1])])
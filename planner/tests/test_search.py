@@ -0,0 +1,58 @@
+from datetime import timedelta
+from decimal import Decimal
+from django.http import QueryDict
+from crum import impersonate
+
+from planner.filters import DEAL_FILTER, TASK_FILTER, ORDER_FILTER
+from planner.models import Deal, Task, Order, SubTask
+from .base import PlannerTestCase
+
+
+class SearchDocumentsTest(PlannerTestCase):
+
+    def setUp(self):
+        self.deal = self.create_deal('Д-101')
+        self.task = self.create_task(self.deal, 'ОБ-7')
+        self.other_task = self.create_task(self.create_deal('Д-202'), 'ОБ-8', project=1)
+        with impersonate(self.admin):
+            self.subtask = SubTask.objects.create(project_type=self.projects[0], name='Геодезична зйомка',
+                                                  part=0, duration=timedelta(hours=2))
+            self.order = Order.objects.create(contractor=self.contractor, company=self.companies[0],
+                                              task=self.task, subtask=self.subtask, purpose='Вишукування',
+                                              value=Decimal(500))
+
+    def search(self, spec, model, words):
+        return set(spec.filter(model.objects.all(), QueryDict(f'filter={words}')))
+
+    def test_words_match_in_different_fields(self):
+        # deal number, object address and project type of task
+        self.assertEqual(self.search(TASK_FILTER, Task, 'д-101 Тестова'), {self.task})
+        self.assertEqual(self.search(TASK_FILTER, Task, 'ТЕСТОВА тип'), {self.task, self.other_task})
+        self.assertEqual(self.search(TASK_FILTER, Task, 'P1 ОБ-8'), {self.other_task})
+        self.assertEqual(self.search(DEAL_FILTER, Deal, 'Д-20'), {self.other_task.deal})
+
+    def test_every_word_must_match(self):
+        self.assertEqual(self.search(ORDER_FILTER, Order, 'підрядник геодезична об-7 вишукування'), {self.order})
+        self.assertEqual(self.search(ORDER_FILTER, Order, 'підрядник ремонт'), set())
+        self.assertEqual(self.search(TASK_FILTER, Task, 'д-101 ОБ-8'), set())
+
+    def test_documents_follow_related_changes(self):
+        with impersonate(self.admin):
+            self.deal.number = 'Д-303'
+            self.deal.save()
+        self.assertEqual(self.search(TASK_FILTER, Task, 'д-303'), {self.task})
+        self.assertEqual(self.search(TASK_FILTER, Task, 'д-101'), set())
+
+        project = self.projects[0]
+        project.project_type = 'Топографія'
+        project.save()
+        self.assertEqual(self.search(TASK_FILTER, Task, 'топографія'), {self.task})
+
+        self.contractor.name = 'Нова назва'
+        self.contractor.save()
+        self.assertEqual(self.search(ORDER_FILTER, Order, 'нова назва'), {self.order})
+        self.assertEqual(self.search(ORDER_FILTER, Order, 'підрядник'), set())
+
+        self.subtask.delete()
+        self.assertEqual(self.search(ORDER_FILTER, Order, 'геодезична'), set())
+        self.assertEqual(self.search(ORDER_FILTER, Order, 'вишукування'), {self.order})
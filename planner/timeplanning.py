@@ -1,11 +1,122 @@
-from datetime import  datetime, timedelta, time
+from array import array
+from bisect import bisect_left, bisect_right
+from copy import copy
+from datetime import  date, datetime, timedelta, time
+from time import monotonic, time_ns
 from django.db.models import F
 from django.apps import apps
+from django.core.cache import cache
 
 import businesstimedelta
 import holidays as pyholidays
 
 
+class VacationIntervals():
+    """
+    Sorted non-overlapping vacation intervals of employee.
+    Vacation lasts from start_date till end_date not including end_date.
+    """
+
+    def __init__(self, vacations):
+        intervals = []
+        for start_date, end_date in sorted(vacations):
+            if end_date <= start_date:
+                continue
+            if intervals and start_date <= intervals[-1][1]:
+                intervals[-1][1] = max(intervals[-1][1], end_date)
+            else:
+                intervals.append([start_date, end_date])
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+
+    def __contains__(self, day):
+        index = bisect_right(self.starts, day) - 1
+        return index >= 0 and day < self.ends[index]
+
+
+class DaysOff():
+    """ Holidays and employee vacations """
+
+    def __init__(self, holidays, vacations):
+        self.holidays = holidays
+        self.vacations = vacations
+
+    def __contains__(self, day):
+        return day in self.holidays or day in self.vacations
+
+
+class WorkingTimeIndex():
+    """
+    Index of cumulative working minutes at the beginning of each day of the window.
+    Working day lasts from 9 to 18 with lunch break from 13 to 14.
+    Weekends and holidays have no working minutes.
+    """
+
+    DAY_START = timedelta(hours=9)
+    LUNCH_START = timedelta(hours=13)
+    LUNCH_FINISH = timedelta(hours=14)
+    DAY_FINISH = timedelta(hours=18)
+    MINUTE = timedelta(minutes=1)
+
+    def __init__(self, holidays, first_day, last_day):
+        self.first_day = first_day
+        self.morning = self.LUNCH_START - self.DAY_START
+        self.afternoon = self.DAY_FINISH - self.LUNCH_FINISH
+        day_minutes = (self.morning + self.afternoon) // self.MINUTE
+        self.cumulative = array('l', [0])
+        for day in range((last_day - first_day).days + 1):
+            working_day = first_day + timedelta(day)
+            working = working_day.weekday() < 5 and working_day not in holidays
+            self.cumulative.append(self.cumulative[-1] + (day_minutes if working else 0))
+
+    def covers(self, moment):
+        """ check if moment is inside the window """
+        return 0 <= (moment.date() - self.first_day).days < len(self.cumulative) - 1
+
+    def offset(self, moment):
+        """ working time from the window start till moment """
+        day = (moment.date() - self.first_day).days
+        offset = timedelta(minutes=self.cumulative[day])
+        if self.cumulative[day + 1] > self.cumulative[day]:
+            day_time = moment - datetime.combine(moment.date(), time())
+            offset += min(max(day_time - self.DAY_START, timedelta(0)), self.morning)
+            offset += min(max(day_time - self.LUNCH_FINISH, timedelta(0)), self.afternoon)
+        return offset
+
+    def moment(self, offset, period_end=False):
+        """ return moment at working time offset from the window start or None if it is outside the window.
+            Offset on the boundary of working periods gives the end of previous period if period_end is True,
+            else the start of next period.
+        """
+        minutes, remainder = divmod(offset, self.MINUTE)
+        if period_end and not remainder:
+            day = bisect_left(self.cumulative, minutes) - 1
+        else:
+            day = bisect_right(self.cumulative, minutes) - 1
+        if day < 0 or day >= len(self.cumulative) - 1:
+            return None
+        day_offset = offset - timedelta(minutes=self.cumulative[day])
+        day_start = datetime.combine(self.first_day + timedelta(day), time())
+        if day_offset < self.morning or period_end and day_offset == self.morning:
+            return day_start + self.DAY_START + day_offset
+        return day_start + self.LUNCH_FINISH + day_offset - self.morning
+
+    def difference(self, start_time, finish_time):
+        """ working time between two moments in whole seconds or None if they are outside the window """
+        if not self.covers(start_time) or not self.covers(finish_time):
+            return None
+        difference = abs(self.offset(finish_time) - self.offset(start_time))
+        return timedelta(days=difference.days, seconds=difference.seconds)
+
+    def add(self, start_time, duration):
+        """ moment when duration of working time has passed since start_time or None if it is outside the window.
+            Zero duration gives the nearest working moment.
+        """
+        if not self.covers(start_time):
+            return None
+        return self.moment(self.offset(start_time) + duration, period_end=duration > timedelta(0))
+
+
 class TimePlanner():
 
     # Execution statuses
@@ -16,10 +127,60 @@ class TimePlanner():
     OnCorrection = 'CR'
     Sent = 'ST'
 
+    # Execution fields which affect employee queue
+    SCHEDULING_FIELDS = ['executor', 'subtask', 'exec_status', 'planned_start', 'planned_finish', 'fixed_date']
+    # Execution fields which are set by queue planning
+    QUEUE_FIELDS = ['planned_start', 'planned_finish', 'interruption']
+
+    # Years before and after current year covered by working time index
+    INDEX_YEARS = 2
+
+    # Process-wide registry of business hours calendars
+    # {employee_pk: (vacation_version, year, (businesshrs, worktime))}
+    calendars = {}
+
+    # Seconds to trust vacation versions read from shared cache before reading them again
+    VERSION_TTL = 5
+    # {employee_pk: (vacation_version, monotonic time of reading)}
+    versions = {}
+
     def __init__(self, employee):
         self.employee = employee
+        self.businesshrs, self.worktime = self.get_calendar(employee)
+
+    @classmethod
+    def vacation_version(cls, employee_pk):
+        """ return version of employee's vacations shared between processes through cache,
+        the version is read from cache at most once in VERSION_TTL seconds """
+        version, read_at = cls.versions.get(employee_pk, (None, None))
+        now = monotonic()
+        if version is None or now - read_at > cls.VERSION_TTL:
+            version = cache.get_or_set(f'vacation_version_{employee_pk}', time_ns, None)
+            cls.versions[employee_pk] = (version, now)
+        return version
 
-        ''' Init businesshrs rules '''
+    @classmethod
+    def invalidate_calendar(cls, employee_pk):
+        """ change version of employee's vacations so cached calendars are rebuilt """
+        version = time_ns()
+        cache.set(f'vacation_version_{employee_pk}', version, None)
+        cls.versions[employee_pk] = (version, monotonic())
+
+    @classmethod
+    def get_calendar(cls, employee):
+        """ return cached businesshrs rules and working time index of employee or build new ones """
+        employee_pk = employee.pk if employee else None
+        version = cls.vacation_version(employee_pk)
+        year = date.today().year
+        cached_version, cached_year, calendar = cls.calendars.get(employee_pk, (None, None, None))
+        if cached_version != version or cached_year != year:
+            calendar = cls.__build_calendar__(employee, year)
+            cls.calendars[employee_pk] = (version, year, calendar)
+        return calendar
+
+    @classmethod
+    def __build_calendar__(cls, employee, year):
+        """ init businesshrs rules and working time index """
         workday = businesstimedelta.WorkDayRule(
             start_time=time(9),
             end_time=time(18),
@@ -35,15 +196,22 @@ class TimePlanner():
             end_time=time(14),
             working_days=[0, 1, 2, 3, 4])
 
-        ua_holidays = self.__add_vacation__(pyholidays.country_holidays('UA'))
-        holidays = businesstimedelta.HolidayRule(ua_holidays)
+        days_off = DaysOff(pyholidays.country_holidays('UA'), cls.__get_vacations__(employee))
+        holidays = businesstimedelta.HolidayRule(days_off)
+
+        worktime = WorkingTimeIndex(days_off,
+                                    date(year - cls.INDEX_YEARS, 1, 1),
+                                    date(year + cls.INDEX_YEARS, 12, 31))
 
-        self.businesshrs = businesstimedelta.Rules([workday, friday, lunchbreak, holidays])
+        return businesstimedelta.Rules([workday, friday, lunchbreak, holidays]), worktime
 
     @staticmethod
-    def __daterange__(start_date, end_date):
-        for n in range(int((end_date - start_date).days)):
-            yield start_date + timedelta(n)
+    def __get_vacations__(employee):
+        """ return all vacations of employee """
+        if not employee:
+            return VacationIntervals([])
+        return VacationIntervals([(vacation.start_date, vacation.end_date)
+                                  for vacation in employee.vacation_set.all()])
 
     @staticmethod
     def __merge_fixed_periods__(tasks_to_do_fixed):
@@ -70,23 +238,21 @@ class TimePlanner():
                     break
         return fixed_periods
 
-    def __add_vacation__(self, holidays):
-        ''' add employee's vacation to holidays '''
-        try:
-            vacation_model = apps.get_model('planner.Vacation')
-            last_vacation = self.employee.vacation_set.latest('end_date')
-            if last_vacation:
-                for day in self.__daterange__(last_vacation.start_date, last_vacation.end_date):
-                    holidays[day] = "Відпустка"
-        except vacation_model.DoesNotExist:
-            pass
-        return holidays
-
     def calc_businesshrsdiff(self, start_time, finish_time):
+        businesshrsdelta = self.worktime.difference(start_time, finish_time)
+        if businesshrsdelta is not None:
+            return businesshrsdelta
+        # fall back to businesshrs rules outside the working time index
         businesshrsdelta = self.businesshrs.difference(start_time, finish_time)
         return timedelta(hours=businesshrsdelta.hours, seconds=businesshrsdelta.seconds)
 
     def calc_businesstimedelta(self, start_time, task_duration):
+        if task_duration >= timedelta(0):
+            finish_time = self.worktime.add(start_time, timedelta(days=task_duration.days,
+                                                                  seconds=task_duration.seconds))
+            if finish_time is not None:
+                return finish_time
+        # fall back to businesshrs rules outside the working time index
         finish_time = start_time + businesstimedelta.BusinessTimeDelta(
             self.businesshrs,
             hours=task_duration.days*24+task_duration.seconds/3600
@@ -119,9 +285,8 @@ class TimePlanner():
     def __queue_task__(self, task, last_task_finish):
         """ set planned start and finish """
         task_duration = self.__get_task_duration__(task)
-        business_hour = businesstimedelta.BusinessTimeDelta(self.businesshrs, hours=1)
-        task.planned_start = last_task_finish + business_hour - business_hour
-        task.planned_start = task.planned_start.replace(tzinfo=None)
+        # move start to the nearest working moment
+        task.planned_start = self.calc_businesstimedelta(last_task_finish, timedelta(0))
         task.planned_finish = self.calc_businesstimedelta(task.planned_start, task_duration)
 
         return self.__add_interruption__(task, task_duration)
@@ -133,38 +298,118 @@ class TimePlanner():
         else:
             return task.planned_finish
 
+    @classmethod
+    def queued_executions(cls, executions):
+        """ filter executions which are planned in employees queues """
+        return executions.filter(exec_status__in=[cls.ToDo, cls.InProgress],
+                                 subtask__add_to_schedule=True,
+                                 task__exec_status__in=[cls.ToDo, cls.InProgress]
+                                 )
+
+    @classmethod
+    def finished_executions(cls, executions):
+        """ filter executions which queues are started after """
+        return executions.filter(exec_status__in=[cls.Done, cls.OnCorrection, cls.OnChecking],
+                                 task__exec_status__in=[cls.InProgress, cls.Done, cls.Sent],
+                                 subtask__add_to_schedule=True
+                                 )
+
+    @staticmethod
+    def queue_start(last_task_finish=None):
+        """ return queue start after last finished task or at the beginning of today """
+        if last_task_finish:
+            return last_task_finish
+        return datetime.now().replace(hour=9,minute=0,second=0,microsecond=0)
+
     def __get_last_task_finish__(self):
         """ calculate last task finish time """
-        last_task = self.employee.execution_set.filter(exec_status__in=[self.Done, self.OnCorrection, self.OnChecking],
-                                                       task__exec_status__in=[self.InProgress, self.Done, self.Sent],
-                                                       subtask__add_to_schedule=True
-                                                       ) \
-                                               .order_by('actual_finish').last()
-        if last_task and last_task.actual_finish:
-            return last_task.actual_finish
-        return datetime.now().replace(hour=9,minute=0,second=0,microsecond=0)
+        last_task = self.finished_executions(self.employee.execution_set).order_by('actual_finish').last()
+        return self.queue_start(last_task.actual_finish if last_task else None)
+
+    @staticmethod
+    def __queue_key__(exec_status, planned_start, pk):
+        """ sort key of not fixed task, the same as queue ordering in database """
+        return exec_status, planned_start is None, planned_start or datetime.min, pk
 
-    def recalc_queue(self):
-        """ recalc queue for executors whem subtask changed"""
+    def __get_queue_positions__(self, queue, execution, initial):
+        """ return execution positions in the queue before and after change """
+        positions = []
+        # execution position in the queue after change
+        for index, task in enumerate(queue):
+            if task.pk == execution.pk:
+                positions.append(index)
+                break
+        # execution position in the queue before change
+        if initial is not None:
+            exec_status = initial.get('exec_status', execution.exec_status)
+            executor = initial.get('executor', execution.executor_id)
+            if exec_status in [self.ToDo, self.InProgress] and executor == self.employee.pk:
+                key = self.__queue_key__(exec_status, initial.get('planned_start', execution.planned_start),
+                                         execution.pk)
+                positions.append(sum(1 for task in queue if task.pk != execution.pk and
+                                     self.__queue_key__(task.exec_status, task.planned_start, task.pk) < key))
+        return positions
 
-        tasks_to_do = self.employee.execution_set.filter(exec_status__in=[self.ToDo, self.InProgress],
-                                                         subtask__add_to_schedule=True,
-                                                         task__exec_status__in=[self.ToDo, self.InProgress]
-                                                         )
-        tasks_to_do_fixed = tasks_to_do.filter(fixed_date=True).values('planned_start', 'planned_finish')
+    @staticmethod
+    def __planned_values__(task):
+        return task.planned_start, task.planned_finish, task.interruption
+
+    def set_fixed_tasks(self, tasks_to_do_fixed):
+        """ set periods of fixed tasks which queued tasks are planned around """
         self.fixed_periods = self.__merge_fixed_periods__(tasks_to_do_fixed)
+
+    def plan_queue(self, queue, last_task_finish, start_index=0, stable_index=None):
+        """ plan queued tasks starting from start_index and return tasks with changed planned dates.
+            Planning stops after stable_index when planned dates of the task stay unchanged.
+        """
+        tasks = []
+        for index in range(start_index, len(queue)):
+            planned_values = self.__planned_values__(queue[index])
+            queued_task = self.__queue_task__(queue[index], last_task_finish)
+            last_task_finish = self.planned_finish_with_interruption(queued_task)
+            if self.__planned_values__(queued_task) != planned_values:
+                tasks.append(queued_task)
+            elif stable_index is not None and index > stable_index:
+                # the rest of the queue is planned the same way as before
+                break
+        return tasks
+
+    def recalc_queue(self, execution=None, initial=None):
+        """ recalc queue for executors whem subtask changed.
+            If changed execution is given, the queue is replanned from its position forward
+            until planned dates of the following tasks stay unchanged.
+            initial is a dict with values of changed scheduling fields before change
+            or None when execution is new
+        """
+
+        tasks_to_do = self.queued_executions(self.employee.execution_set)
+        self.set_fixed_tasks(tasks_to_do.filter(fixed_date=True).values('planned_start', 'planned_finish'))
         self.tasks_to_do_not_fixed = tasks_to_do.filter(fixed_date=False) \
-                                                .order_by('exec_status', F('planned_start').asc(nulls_last=True))
+                                                .order_by('exec_status', F('planned_start').asc(nulls_last=True), 'pk')
 
         execution_model = apps.get_model('planner.Execution')
+        queue = list(self.tasks_to_do_not_fixed)
+
+        # find queue part affected by execution change
+        # fixed execution changes fixed periods so whole queue is replanned
+        start_index, stable_index = 0, None
+        if execution is not None and not execution.fixed_date and not (initial or {}).get('fixed_date'):
+            positions = self.__get_queue_positions__(queue, execution, initial)
+            if not positions:
+                return
+            start_index, stable_index = min(positions), max(positions)
+
         last_task_finish = self.__get_last_task_finish__()
+        if start_index > 0:
+            # replan whole queue if its start has moved since last planning
+            first_task = self.__queue_task__(copy(queue[0]), last_task_finish)
+            if self.__planned_values__(first_task) != self.__planned_values__(queue[0]):
+                start_index = 0
+            else:
+                last_task_finish = self.planned_finish_with_interruption(queue[start_index - 1])
 
-        tasks = []
         # plan queued tasks
-        for task in self.tasks_to_do_not_fixed:
-            queued_task = self.__queue_task__(task, last_task_finish)
-            tasks.append(queued_task)
-            last_task_finish = self.planned_finish_with_interruption(queued_task)
+        tasks = self.plan_queue(queue, last_task_finish, start_index, stable_index)
 
         # perform bulk_update
-        execution_model.objects.bulk_update(tasks, ['planned_start', 'planned_finish', 'interruption'])
+        execution_model.objects.bulk_update(tasks, self.QUEUE_FIELDS)
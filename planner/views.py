@@ -25,7 +25,7 @@ from . import forms
 from .models import Task, Deal, Employee, Project, Execution, Receiver, Sending, Order,\
                     Contractor, SubTask, ActOfAcceptance, IntTask, Customer, Company, Plan
 from .filters import *
-from notice.models import Comment, create_comment
+from notice.models import Comment, create_comment, get_comments
 from eventlog.models import Log
 
 
@@ -140,9 +140,7 @@ class DealUpdate(UpdateView):
             owners = Employee.objects.filter(user__groups__name__contains="ГІПи", user__is_active=True)
             project_types = Project.objects.filter(customer=self.object.customer, active=True)
             acts = ActOfAcceptance.objects.filter(deal=self.object)
-            context['comments'] = Comment.objects.filter(content_type__model='Deal',
-                                                         object_id=self.object.pk
-                                                         )
+            context['comments'] = get_comments(self.object)
             context['activities'] = Log.objects.filter(content_type__model='Deal',
                                                        object_id=self.object.pk
                                                        )
@@ -277,9 +275,7 @@ class TaskDetail(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['comments'] = Comment.objects.filter(content_type__model='Task',
-                                                     object_id=self.kwargs['pk']
-                                                     )
+        context['comments'] = get_comments(self.object)
         context['executors'] = Execution.objects.filter(task=self.kwargs['pk'])
         context['costs'] = Order.objects.filter(task=self.kwargs['pk'])
         context['sendings'] = Sending.objects.filter(task=self.kwargs['pk'])
@@ -307,9 +303,7 @@ class TaskUpdate(UpdateView):
             employees = Employee.objects.filter(user__is_active=True)
             subtasks = SubTask.objects.filter(project_type=self.object.project_type).order_by('name')
             contractors = Contractor.objects.filter(active=True)
-            context['comments'] = Comment.objects.filter(content_type__model='Task',
-                                                         object_id=self.object.pk
-                                                         )
+            context['comments'] = get_comments(self.object)
             context['activities'] = Log.objects.filter(content_type__model='Task',
                                                        object_id=self.object.pk
                                                        )
@@ -628,9 +622,7 @@ class OrderUpdate(UpdateView):
         if self.request.POST:
             context['payment_formset'] = forms.OrderPaymentFormSet(self.request.POST, instance=self.object)
         else:
-            context['comments'] = Comment.objects.filter(content_type__model='Order',
-                                                         object_id=self.object.pk
-                                                         )
+            context['comments'] = get_comments(self.object)
             context['activities'] = Log.objects.filter(content_type__model='Order',
                                                        object_id=self.object.pk
                                                        )
@@ -1001,14 +993,9 @@ class CustomerList(ListView):
     paginate_by = 35
 
     def get_queryset(self):
-        debit_qry = Q(deal__act_status=Deal.Issued, deal__pay_status=Deal.NotPaid)
-        customers = Customer.objects.annotate(
+        customers = Customer.objects.with_financials().annotate(
             url=Concat(F('pk'), Value('/change/'), output_field=CharField()),
-            advance = Sum(Case(When(deal__pay_status=Deal.AdvancePaid, then=F('deal__value')),
-                                    output_field=DecimalField(), default=0)),
-            debit = Sum(Case(When(debit_qry, then=F('deal__value')),
-                                  output_field=DecimalField(), default=0)),
-            ).values_list('name', 'advance', 'debit', 'url')
+            ).values_list('name', 'credit', 'debit', 'url')
 
         search_string = self.request.GET.get('filter', '').split()
         order = self.request.GET.get('o', '0')
@@ -1022,7 +1009,7 @@ class CustomerList(ListView):
         request = self.request
         context = super().get_context_data(**kwargs)
         context['headers'] = [['name', 'Назва', 1],
-                              ['credit_calc', 'Авансові платежі', 0],
+                              ['credit', 'Авансові платежі', 0],
                               ['debit', 'Дебітрська заборгованість', 0]]
         context['search'] = True
         context['filter'] = []
@@ -1233,10 +1220,19 @@ class EmployeeList(ListView):
     success_url = reverse_lazy('home_page')
 
     def get_queryset(self):
+        def workload(active, overdue):
+            return Concat(Value('Активні-'), F(active), Value('/Протерміновані-'), F(overdue),
+                          output_field=CharField())
+
         employees = Employee.objects.filter(user__is_active=True) \
                                     .order_by('name')\
-                                    .annotate(url=Concat(F('pk'), Value('/change/'), output_field=CharField()))\
-                                    .values_list('name', 'url')
+                                    .with_workload()\
+                                    .annotate(url=Concat(F('pk'), Value('/change/'), output_field=CharField()),
+                                              owner_workload=workload('owner_active', 'owner_overdue'),
+                                              executor_workload=workload('executor_active', 'executor_overdue'),
+                                              inttasks_workload=workload('inttasks_active', 'inttasks_overdue'))\
+                                    .values_list('name', 'owner_workload', 'executor_workload', 'inttasks_workload',
+                                                 'url')
         search_string = self.request.GET.get('filter', '').split()
         for word in search_string:
             employees = employees.filter(Q(name__icontains=word))
@@ -1337,16 +1333,9 @@ class ContractorList(ListView):
     paginate_by = 35
 
     def get_queryset(self):  # todo args url
-        advance_qry = Q(order__pay_status=Order.AdvancePaid, order__task__exec_status__in=[Task.ToDo,Task.InProgress])
-        credit_qry = Q(order__pay_status=Order.NotPaid, order__task__exec_status__in=[Task.Done,Task.Sent])
-        contractors = Contractor.objects.annotate(
+        contractors = Contractor.objects.with_payables().annotate(
             url=Concat(F('pk'), Value('/change/'), output_field=CharField()),
-            advance = Sum(Case(When(advance_qry, then=F('order__advance')),
-                                    output_field=DecimalField(), default=0)),
-            debit = Sum(Case(When(credit_qry, then=F('order__value')),
-                                  output_field=DecimalField(), default=0)),
-            ).\
-            values_list('name', 'advance', 'debit', 'active', 'url')
+            ).values_list('name', 'advance', 'credit', 'active', 'url')
         search_string = self.request.GET.get('filter')
         order = self.request.GET.get('o')
         if search_string:
@@ -1362,8 +1351,8 @@ class ContractorList(ListView):
         request = self.request
         context = super().get_context_data(**kwargs)
         context['headers'] = [['name', 'Назва', 1],
-                              ['advance_calc', 'Авансові платежі', 0],
-                              ['credit_calc', 'Кредиторська заборгованість', 0],
+                              ['advance', 'Авансові платежі', 0],
+                              ['credit', 'Кредиторська заборгованість', 0],
                               ['active', 'Активний', 0]]
         context['search'] = True
         context['filter'] = []